@@ -0,0 +1,127 @@
+"""
+Tokens-per-second through the auth layer on a streaming response.
+
+Compares the old `BaseHTTPMiddleware`-based auth (reproduced below, with the
+same cached key lookup so only the middleware plumbing differs) against the
+pure ASGI `AuthMiddleware`. The ASGI app is driven in-process, so the numbers
+are the middleware overhead per SSE chunk and nothing else.
+
+    uv run python benchmarks/auth_streaming.py [--tokens N] [--rounds N]
+"""
+import argparse
+import hashlib
+import time
+
+import trio
+from starlette.applications import Starlette
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+from slut_proxy.middleware import AuthMiddleware, ApiKeyCache, ApiKeyPermissions, RateLimiter
+from slut_proxy.utils.metrics import Metrics
+
+API_KEY = "sk-benchmark"
+CHUNK = b'event: new_chunk\ndata: {"text":" token"}\n\n'
+
+
+class LegacyAuthMiddleware(BaseHTTPMiddleware):
+    """The pre-ASGI implementation, minus the database round trip"""
+
+    async def dispatch(self, request: Request, call_next):
+        if request.url.path.startswith("/v2/generate"):
+            auth_header = request.headers.get("authorization")
+            if not auth_header or not auth_header.startswith("Bearer "):
+                return JSONResponse({"error": "Missing or invalid API key"}, status_code=401)
+            key_hash = hashlib.sha256(auth_header[7:].encode()).hexdigest()
+            permissions = request.state.key_cache.get(key_hash)
+            if not permissions:
+                return JSONResponse({"error": "Invalid API key"}, status_code=403)
+            request.state.api_key_permissions = permissions
+        return await call_next(request)
+
+
+def build(middleware: type, tokens: int) -> Starlette:
+    async def generate(_request: Request) -> StreamingResponse:
+        async def body():
+            for _ in range(tokens):
+                yield CHUNK
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    app = Starlette(routes=[Route("/v2/generate", generate, methods=["POST"])])
+    if middleware is AuthMiddleware:
+        app.add_middleware(AuthMiddleware, admin_key="admin")
+    else:
+        app.add_middleware(middleware)
+    return app
+
+
+async def run_once(app: Starlette, state: dict) -> int:
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": "/v2/generate",
+        "raw_path": b"/v2/generate",
+        "root_path": "",
+        "query_string": b"",
+        "headers": [(b"authorization", f"Bearer {API_KEY}".encode()), (b"accept", b"text/event-stream")],
+        "client": ("127.0.0.1", 1234),
+        "server": ("127.0.0.1", 8080),
+        "state": state.copy(),
+    }
+    chunks = 0
+    request_sent = False
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"{}", "more_body": False}
+        await trio.sleep_forever()
+
+    async def send(message):
+        nonlocal chunks
+        if message["type"] == "http.response.body" and message.get("body"):
+            chunks += 1
+
+    await app(scope, receive, send)
+    return chunks
+
+
+async def bench(name: str, middleware: type, tokens: int, rounds: int) -> float:
+    key_cache = ApiKeyCache()
+    key_cache.put(
+        hashlib.sha256(API_KEY.encode()).hexdigest(),
+        ApiKeyPermissions(allowed_providers=frozenset(), allowed_models=frozenset()),
+    )
+    state = {"key_cache": key_cache, "rate_limiter": RateLimiter(), "metrics": Metrics()}
+    app = build(middleware, tokens)
+
+    _ = await run_once(app, state)  # warm up
+    start = time.perf_counter()
+    total = 0
+    for _ in range(rounds):
+        total += await run_once(app, state)
+    elapsed = time.perf_counter() - start
+
+    rate = total / elapsed
+    print(f"{name:>24}: {rate:12,.0f} tokens/s ({elapsed:.3f}s for {total} chunks)")
+    return rate
+
+
+async def main(tokens: int, rounds: int):
+    before = await bench("BaseHTTPMiddleware", LegacyAuthMiddleware, tokens, rounds)
+    after = await bench("ASGI AuthMiddleware", AuthMiddleware, tokens, rounds)
+    print(f"{'speedup':>24}: {after / before:.2f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--tokens", type=int, default=2000, help="chunks per streamed response")
+    _ = parser.add_argument("--rounds", type=int, default=50, help="responses per middleware")
+    args = parser.parse_args()
+    trio.run(main, args.tokens, args.rounds)
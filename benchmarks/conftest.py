@@ -0,0 +1,123 @@
+"""
+Microbenchmark harness for `test_hot_paths.py`.
+
+Each benchmark is timed as the best of several rounds and expressed as a
+multiple of a fixed pure-Python calibration workload timed in between, so
+baselines recorded on one machine hold on another. A benchmark more than
+`SLUT_BENCH_TOLERANCE` (default 0.2, i.e. 20%) slower than its baseline in
+`baselines.json` fails.
+
+    uv run pytest benchmarks                        # compare against the baselines
+    SLUT_BENCH_UPDATE=1 uv run pytest benchmarks    # record new baselines
+"""
+from collections.abc import Awaitable, Callable, Iterator
+import json
+import os
+from pathlib import Path
+import time
+
+import pytest
+import trio
+
+BASELINES = Path(__file__).with_name("baselines.json")
+TOLERANCE = float(os.environ.get("SLUT_BENCH_TOLERANCE", "0.2"))
+UPDATE = os.environ.get("SLUT_BENCH_UPDATE") == "1"
+
+ROUNDS = 7
+ROUND_TIME = 0.05 # seconds
+# Measurements over the tolerance are retaken, a real regression persists
+ATTEMPTS = 3
+
+
+def _iterations(run: Callable[[int], None]) -> int:
+    """Iterations of `run(iterations)` taking about `ROUND_TIME`"""
+    iterations = 1
+    while True:
+        started = time.process_time()
+        run(iterations)
+        elapsed = time.process_time() - started
+        if elapsed >= ROUND_TIME / 10:
+            return max(1, int(iterations * ROUND_TIME / elapsed))
+        iterations *= 4
+
+
+def _relative_time(run: Callable[[int], None]) -> tuple[float, float]:
+    """
+    Seconds per iteration of `run(iterations)` and the same as a multiple of
+    the calibration workload. Rounds of both are interleaved so they see the
+    same machine conditions, and the best round of each is kept.
+    """
+    iterations = _iterations(run)
+    calibration_iterations = _iterations(_calibration_workload)
+
+    best = calibration = float("inf")
+    for _ in range(ROUNDS):
+        started = time.process_time()
+        _calibration_workload(calibration_iterations)
+        calibration = min(calibration, (time.process_time() - started) / calibration_iterations)
+
+        started = time.process_time()
+        run(iterations)
+        best = min(best, (time.process_time() - started) / iterations)
+    return best, best / calibration
+
+
+def _calibration_workload(iterations: int):
+    for _ in range(iterations):
+        values = {str(i): i for i in range(50)}
+        _ = sorted(values.items(), key=lambda item: -item[1])
+        _ = "".join(values)
+
+
+class Bench:
+    def __init__(self, baselines: dict[str, float], results: dict[str, float]):
+        self.baselines = baselines
+        self.results = results
+
+    def __call__(self, name: str, fn: Callable[[], object]):
+        """Times a function against its baseline"""
+        def run(iterations: int):
+            for _ in range(iterations):
+                fn()
+        self._check(name, run)
+
+    def run_async(self, name: str, fn: Callable[[], Awaitable[object]]):
+        """Times an async function against its baseline, all iterations in one trio run"""
+        async def loop(iterations: int):
+            for _ in range(iterations):
+                await fn()
+        self._check(name, lambda iterations: trio.run(loop, iterations))
+
+    def _check(self, name: str, run: Callable[[int], None]):
+        baseline = self.baselines.get(name)
+        for _ in range(ATTEMPTS):
+            seconds, relative = _relative_time(run)
+            print(f"{name}: {seconds * 1e6:.2f}us ({relative:.4f}x calibration)")
+            if UPDATE or baseline is None or relative <= baseline * (1 + TOLERANCE):
+                break
+        self.results[name] = relative
+        if UPDATE:
+            return
+
+        if baseline is None:
+            pytest.skip(f"no baseline for {name}, record one with SLUT_BENCH_UPDATE=1")
+        if relative > baseline * (1 + TOLERANCE):
+            pytest.fail(
+                f"{name} regressed: {relative:.4f}x calibration against a baseline of {baseline:.4f}x "
+                f"({(relative / baseline - 1) * 100:+.1f}%, tolerance {TOLERANCE * 100:.0f}%)"
+            )
+
+
+@pytest.fixture(scope="session")
+def _bench_session() -> Iterator[tuple[dict[str, float], dict[str, float]]]:
+    baselines: dict[str, float] = json.loads(BASELINES.read_text()) if BASELINES.exists() else {}
+    results: dict[str, float] = {}
+    yield baselines, results
+
+    if UPDATE and results:
+        BASELINES.write_text(json.dumps({**baselines, **results}, indent=2, sort_keys=True) + "\n")
+
+
+@pytest.fixture
+def bench(_bench_session: tuple[dict[str, float], dict[str, float]]) -> Bench:
+    return Bench(*_bench_session)
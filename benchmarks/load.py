@@ -0,0 +1,313 @@
+"""
+End-to-end load benchmark of the proxy against a local mock upstream.
+
+The mock upstream (`mock_upstream.py`) and the proxy (`build_app` behind
+hypercorn) each run in their own process, so the load generator here
+doesn't compete with them and the proxy's CPU time can be read on its own.
+Requests go to `/v2/generate` or `/v1/completions` at a fixed concurrency.
+
+Reports requests/s, latency and time to first token percentiles and proxy
+CPU per request, optionally saved as JSON and compared with an earlier run:
+
+    uv run python benchmarks/load.py --endpoint completions --stream --concurrency 64 --output after.json --compare before.json
+"""
+import argparse
+from collections.abc import Callable
+import contextlib
+import datetime
+import multiprocessing
+import multiprocessing.connection
+import os
+import socket
+import tempfile
+import time
+
+import httpx
+import msgspec
+import trio
+from hypercorn.config import Config as HyperConfig
+from hypercorn.trio import serve  # pyright: ignore[reportUnknownVariableType]
+
+import mock_upstream
+from slut_proxy.models.config import AvailableProvider, Config, HealthCheckConfig, ModelConfig, ProviderConfig, ProxyConfig
+
+# Forking from inside trio.run would carry the parent's run over
+_mp = multiprocessing.get_context("spawn")
+
+ADMIN_KEY = "benchmark-admin"
+PROMPT = "The quick brown fox jumps over the lazy dog. " * 8
+
+
+class UpstreamSettings(msgspec.Struct):
+    tokens: int
+    token_rate: float
+    latency: float
+    error_rate: float
+
+
+class Percentiles(msgspec.Struct):
+    mean: float
+    p50: float
+    p95: float
+    p99: float
+    max: float
+
+
+class LoadReport(msgspec.Struct):
+    started_at: str
+    endpoint: str
+    stream: bool
+    concurrency: int
+    upstream: UpstreamSettings
+    requests: int
+    errors: int
+    duration: float # seconds
+    requests_per_second: float
+    latency_ms: Percentiles | None
+    # Streams only, up to the first body chunk
+    ttft_ms: Percentiles | None
+    proxy_cpu_ms_per_request: float
+
+
+def _percentiles(values: list[float]) -> Percentiles | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def rank(p: float) -> float:
+        # Nearest rank
+        return ordered[max(0, min(len(ordered) - 1, int(p * len(ordered) + 0.5) - 1))] * 1000
+
+    return Percentiles(
+        mean=sum(ordered) / len(ordered) * 1000,
+        p50=rank(0.50),
+        p95=rank(0.95),
+        p99=rank(0.99),
+        max=ordered[-1] * 1000,
+    )
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _proxy_config(upstream_port: int) -> Config:
+    return Config(
+        proxy=ProxyConfig(admin_key=ADMIN_KEY, slow_request_threshold=None),
+        providers=[ProviderConfig(
+            name="mock",
+            type=AvailableProvider.OPENAI_COMPATIBLE,
+            base_url=f"http://127.0.0.1:{upstream_port}/v1",
+            health=HealthCheckConfig(enabled=False),
+            max_connections=None,
+            max_keepalive_connections=None,
+        )],
+        models=[ModelConfig(name="bench", model_id="mock", provider="mock")],
+    )
+
+
+def _serve_proxy(config: Config, port: int, workdir: str, conn: multiprocessing.connection.Connection):
+    # The proxy keeps its database in the working directory
+    os.chdir(workdir)
+    trio.run(_proxy_main, config, port, conn)
+
+
+async def _proxy_main(config: Config, port: int, conn: multiprocessing.connection.Connection):
+    from slut_proxy.app import build_app
+
+    hyper = HyperConfig()
+    hyper.bind = [f"127.0.0.1:{port}"]
+    hyper.loglevel = "WARNING"
+    shutdown = trio.Event()
+    async with trio.open_nursery() as nursery:
+        nursery.start_soon(lambda: serve(build_app(config), hyper, shutdown_trigger=shutdown.wait))  # pyright: ignore[reportArgumentType]
+        # Answers CPU time queries from the benchmark until told to stop
+        while (command := await trio.to_thread.run_sync(conn.recv)) != "stop":
+            if command == "cpu":
+                conn.send(time.process_time())
+        shutdown.set()
+
+
+async def _wait_until_up(url: str):
+    async with httpx.AsyncClient() as client:
+        for _ in range(200):
+            try:
+                _ = await client.get(url)
+                return
+            except httpx.TransportError:
+                await trio.sleep(0.05)
+    raise RuntimeError(f"{url} did not come up")
+
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, endpoint: str, stream: bool, api_key: str):
+        self.client = client
+        self.stream = stream
+        self.headers = {"Authorization": f"Bearer {api_key}"}
+        if endpoint == "generate":
+            self.path = "/v2/generate"
+            self.body = {"model": "bench", "prompt": PROMPT}
+            if stream:
+                self.headers["Accept"] = "text/event-stream"
+        else:
+            self.path = "/v1/completions"
+            self.body = {"model": "bench", "prompt": PROMPT, "stream": stream}
+
+    async def one(self) -> tuple[bool, float, float | None]:
+        """Sends a request, returning whether it succeeded, its latency and TTFT"""
+        started = time.perf_counter()
+        ttft: float | None = None
+        try:
+            async with self.client.stream("POST", self.path, json=self.body, headers=self.headers) as response:
+                async for _ in response.aiter_raw():
+                    if ttft is None and self.stream:
+                        ttft = time.perf_counter() - started
+                ok = response.is_success
+        except httpx.HTTPError:
+            ok = False
+        return ok, time.perf_counter() - started, ttft
+
+    async def run(self, requests: int, concurrency: int) -> tuple[list[float], list[float], int, float]:
+        latencies: list[float] = []
+        ttfts: list[float] = []
+        errors = 0
+        remaining = requests
+
+        async def worker():
+            nonlocal remaining, errors
+            while remaining > 0:
+                remaining -= 1
+                ok, latency, ttft = await self.one()
+                if not ok:
+                    errors += 1
+                    continue
+                latencies.append(latency)
+                if ttft is not None:
+                    ttfts.append(ttft)
+
+        started = time.perf_counter()
+        async with trio.open_nursery() as nursery:
+            for _ in range(concurrency):
+                nursery.start_soon(worker)
+        return latencies, ttfts, errors, time.perf_counter() - started
+
+
+@contextlib.contextmanager
+def _process(target: Callable[..., None], *args: object):
+    process = _mp.Process(target=target, args=args, daemon=True)
+    process.start()
+    try:
+        yield process
+    finally:
+        process.join(timeout=10)
+        if process.is_alive():
+            process.terminate()
+
+
+async def benchmark(args: argparse.Namespace) -> LoadReport:
+    upstream = UpstreamSettings(tokens=args.tokens, token_rate=args.token_rate, latency=args.latency, error_rate=args.error_rate)
+    upstream_port = _free_port()
+    proxy_port = _free_port()
+    mock = _mp.Process(
+        target=mock_upstream.run,
+        args=(upstream_port, upstream.tokens, upstream.token_rate, upstream.latency, upstream.error_rate),
+        daemon=True,
+    )
+    mock.start()
+    parent_conn, child_conn = _mp.Pipe()
+
+    try:
+        with tempfile.TemporaryDirectory() as workdir, \
+                _process(_serve_proxy, _proxy_config(upstream_port), proxy_port, workdir, child_conn):
+            try:
+                await _wait_until_up(f"http://127.0.0.1:{upstream_port}/v1/models")
+                await _wait_until_up(f"http://127.0.0.1:{proxy_port}/v2/models")
+
+                limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{proxy_port}", limits=limits, timeout=120) as client:
+                    response = await client.post(
+                        "/v2/admin/api_keys",
+                        json={"allowed_providers": ["mock"], "allowed_models": []},
+                        headers={"Authorization": f"Bearer {ADMIN_KEY}"},
+                    )
+                    response.raise_for_status()
+                    generator = LoadGenerator(client, args.endpoint, args.stream, response.json()["key"])
+
+                    _ = await generator.run(args.warmup, args.concurrency)
+                    parent_conn.send("cpu")
+                    cpu_before = parent_conn.recv()
+                    latencies, ttfts, errors, duration = await generator.run(args.requests, args.concurrency)
+                    parent_conn.send("cpu")
+                    cpu_after = parent_conn.recv()
+            finally:
+                parent_conn.send("stop")
+    finally:
+        mock.terminate()
+        mock.join()
+
+    return LoadReport(
+        started_at=datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        endpoint=args.endpoint,
+        stream=args.stream,
+        concurrency=args.concurrency,
+        upstream=upstream,
+        requests=args.requests,
+        errors=errors,
+        duration=duration,
+        requests_per_second=args.requests / duration,
+        latency_ms=_percentiles(latencies),
+        ttft_ms=_percentiles(ttfts),
+        proxy_cpu_ms_per_request=(cpu_after - cpu_before) / args.requests * 1000,
+    )
+
+
+def _print_report(report: LoadReport):
+    print(f"{report.endpoint} ({'stream' if report.stream else 'sync'}), concurrency {report.concurrency}")
+    print(f"{'requests':>16}: {report.requests} ({report.errors} errors) in {report.duration:.2f}s")
+    print(f"{'requests/s':>16}: {report.requests_per_second:,.1f}")
+    for name, percentiles in (("latency ms", report.latency_ms), ("ttft ms", report.ttft_ms)):
+        if percentiles is not None:
+            print(f"{name:>16}: p50 {percentiles.p50:.2f}  p95 {percentiles.p95:.2f}  p99 {percentiles.p99:.2f}  max {percentiles.max:.2f}")
+    print(f"{'proxy cpu ms/req':>16}: {report.proxy_cpu_ms_per_request:.3f}")
+
+
+def _compare(before: LoadReport, after: LoadReport):
+    def row(name: str, old: float | None, new: float | None):
+        if old is None or new is None:
+            return
+        change = (new - old) / old * 100 if old else 0.0
+        print(f"{name:>24}: {old:12.3f} -> {new:12.3f} ({change:+.1f}%)")
+
+    print(f"compared with the run of {before.started_at}")
+    row("requests/s", before.requests_per_second, after.requests_per_second)
+    for name in ("p50", "p95", "p99"):
+        row(f"latency {name} ms", getattr(before.latency_ms, name, None), getattr(after.latency_ms, name, None))
+        row(f"ttft {name} ms", getattr(before.ttft_ms, name, None), getattr(after.ttft_ms, name, None))
+    row("proxy cpu ms/req", before.proxy_cpu_ms_per_request, after.proxy_cpu_ms_per_request)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--endpoint", choices=("generate", "completions"), default="generate")
+    _ = parser.add_argument("--stream", action="store_true", help="request SSE streams")
+    _ = parser.add_argument("--concurrency", type=int, default=32, help="requests in flight")
+    _ = parser.add_argument("--requests", type=int, default=2000, help="measured requests")
+    _ = parser.add_argument("--warmup", type=int, default=100, help="unmeasured requests sent first")
+    _ = parser.add_argument("--tokens", type=int, default=64, help="tokens per upstream completion")
+    _ = parser.add_argument("--token-rate", type=float, default=0.0, help="upstream tokens per second, 0 for no delay")
+    _ = parser.add_argument("--latency", type=float, default=0.0, help="upstream seconds before answering")
+    _ = parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream requests failing with a 500")
+    _ = parser.add_argument("--output", help="save the report as JSON")
+    _ = parser.add_argument("--compare", help="a saved report to compare with")
+    args = parser.parse_args()
+
+    report = trio.run(benchmark, args)
+    _print_report(report)
+    if args.compare:
+        with open(args.compare, "rb") as f:
+            _compare(msgspec.json.decode(f.read(), type=LoadReport), report)
+    if args.output:
+        with open(args.output, "wb") as f:
+            f.write(msgspec.json.format(msgspec.json.encode(report)))
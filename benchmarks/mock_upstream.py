@@ -0,0 +1,136 @@
+"""
+A local OpenAI-compatible upstream for benchmarks.
+
+Serves `/v1/completions` (plain and SSE) and `/v1/models` as a bare ASGI app,
+so it costs as little CPU as possible next to the proxy being measured.
+Latency, token rate and error rate are configurable.
+
+    uv run python benchmarks/mock_upstream.py [--port N] [--tokens N] [--token-rate N] [--latency S] [--error-rate P]
+"""
+import argparse
+import random
+
+import msgspec
+import trio
+from hypercorn.config import Config as HyperConfig
+from hypercorn.trio import serve  # pyright: ignore[reportUnknownVariableType]
+
+
+class _CompletionRequest(msgspec.Struct):
+    stream: bool = False
+
+
+_request_decoder = msgspec.json.Decoder(_CompletionRequest)
+_encoder = msgspec.json.Encoder()
+
+_MODELS = _encoder.encode({"object": "list", "data": [{"id": "mock", "object": "model"}]})
+_ERROR = _encoder.encode({"error": {"message": "injected failure", "type": "server_error"}})
+
+
+class MockUpstream:
+    """
+    Answers every completion with `tokens` tokens after `latency` seconds,
+    streaming them `token_rate` per second (0 sends them all at once), and
+    fails a random `error_rate` fraction of requests with a 500.
+    """
+
+    def __init__(self, tokens: int = 64, token_rate: float = 0.0, latency: float = 0.0, error_rate: float = 0.0):
+        self.tokens = tokens
+        self.token_rate = token_rate
+        self.latency = latency
+        self.error_rate = error_rate
+
+        text = " tok" * tokens
+        usage = {"prompt_tokens": 8, "completion_tokens": tokens}
+        self._completion = _encoder.encode({
+            "id": "cmpl-mock",
+            "object": "text_completion",
+            "model": "mock",
+            "choices": [{"index": 0, "text": text, "finish_reason": "length"}],
+            "usage": usage,
+        })
+        self._chunk = b"data: " + _encoder.encode({
+            "id": "cmpl-mock",
+            "object": "text_completion",
+            "choices": [{"index": 0, "text": " tok", "finish_reason": None}],
+        }) + b"\n\n"
+        self._last_chunk = b"data: " + _encoder.encode({
+            "id": "cmpl-mock",
+            "object": "text_completion",
+            "choices": [{"index": 0, "text": "", "finish_reason": "length"}],
+            "usage": usage,
+        }) + b"\n\ndata: [DONE]\n\n"
+
+    async def __call__(self, scope, receive, send):  # pyright: ignore[reportMissingParameterType]
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                if message["type"] == "lifespan.startup":
+                    await send({"type": "lifespan.startup.complete"})
+                elif message["type"] == "lifespan.shutdown":
+                    await send({"type": "lifespan.shutdown.complete"})
+                    return
+
+        path = scope["path"]
+        if scope["method"] == "GET" and path.endswith("/models"):
+            return await _respond(send, 200, _MODELS)
+        if scope["method"] != "POST" or not path.endswith("/completions"):
+            return await _respond(send, 404, b'{"error": "not found"}')
+
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                break
+        request = _request_decoder.decode(body)
+
+        if self.latency:
+            await trio.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            return await _respond(send, 500, _ERROR)
+
+        if not request.stream:
+            if self.token_rate:
+                await trio.sleep(self.tokens / self.token_rate)
+            return await _respond(send, 200, self._completion)
+
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"text/event-stream"), (b"cache-control", b"no-cache")],
+        })
+        for _ in range(self.tokens):
+            if self.token_rate:
+                await trio.sleep(1 / self.token_rate)
+            await send({"type": "http.response.body", "body": self._chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": self._last_chunk, "more_body": False})
+
+
+async def _respond(send, status: int, body: bytes):  # pyright: ignore[reportMissingParameterType]
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+def run(port: int, tokens: int, token_rate: float, latency: float, error_rate: float):
+    """Serves the mock on localhost until interrupted"""
+    config = HyperConfig()
+    config.bind = [f"127.0.0.1:{port}"]
+    config.loglevel = "WARNING"
+    app = MockUpstream(tokens=tokens, token_rate=token_rate, latency=latency, error_rate=error_rate)
+    trio.run(serve, app, config)  # pyright: ignore[reportArgumentType]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    _ = parser.add_argument("--port", type=int, default=9000)
+    _ = parser.add_argument("--tokens", type=int, default=64, help="tokens per completion")
+    _ = parser.add_argument("--token-rate", type=float, default=0.0, help="tokens per second while streaming, 0 for no delay")
+    _ = parser.add_argument("--latency", type=float, default=0.0, help="seconds before answering")
+    _ = parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests failing with a 500")
+    args = parser.parse_args()
+    run(args.port, args.tokens, args.token_rate, args.latency, args.error_rate)
@@ -0,0 +1,177 @@
+"""
+Microbenchmarks of the functions every request or streamed token goes
+through. See `conftest.py` for how they are timed and compared.
+"""
+from collections.abc import AsyncIterator
+import contextlib
+import hashlib
+
+import httpx
+import msgspec
+
+from slut_proxy.middleware import AuthMiddleware, ApiKeyCache, ApiKeyPermissions, RateLimiter
+from slut_proxy.models.compat import OpenAICompletionRequest, unsupported_fields
+from slut_proxy.models.config import AvailableProvider, AvailableSampler, Config, ModelConfig, ProviderConfig, ProxyConfig
+from slut_proxy.models.slut import Samplers, StopReason, TextGenerationRequest, TextGenerationResponse
+from slut_proxy.providers.openai import OpenAIProvider
+from slut_proxy.providers.sse import encode_events
+from slut_proxy.storage import ApiKeyRepository, Database
+from slut_proxy.utils.metrics import Metrics
+from slut_proxy.utils.requests import decode_body
+from slut_proxy.utils.responses import MsgspecJSONResponse
+
+from conftest import Bench
+
+API_KEY = "sk-benchmark"
+KEY_HASH = hashlib.sha256(API_KEY.encode()).hexdigest()
+PERMISSIONS = ApiKeyPermissions(allowed_providers=frozenset({"bench"}), allowed_models=frozenset(), key_hash=KEY_HASH)
+
+PROVIDER = ProviderConfig(
+    name="bench",
+    type=AvailableProvider.OPENAI_COMPATIBLE,
+    base_url="http://127.0.0.1:1/v1",
+    supported_parameters=["max_tokens", "stop", "seed"],
+    supported_samplers=[AvailableSampler.TEMPERATURE, AvailableSampler.TOP_P],
+)
+MODEL = ModelConfig(name="bench", model_id="bench-upstream", provider="bench")
+REQUEST = TextGenerationRequest(
+    prompt="The quick brown fox jumps over the lazy dog. " * 8,
+    model="bench",
+    samplers=Samplers(temperature=0.7, top_p=0.9),
+    stop_sequences=["\n\n"],
+)
+
+STREAM_TOKENS = 64
+UPSTREAM_STREAM = [
+    b'data: {"id":"cmpl-1","object":"text_completion","created":1,"model":"bench-upstream","choices":[{"index":0,"text":" tok","finish_reason":null}]}\n\n'
+    for _ in range(STREAM_TOKENS)
+] + [b"data: [DONE]\n\n"]
+
+
+class _StubCursor:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_exc_info: object):
+        pass
+
+    async def fetchone(self) -> tuple[str, str, float, None, None]:
+        return ('["bench"]', "[]", 1.0, None, None)
+
+
+class _StubConnection:
+    async def execute(self, _sql: str, _params: tuple[str, ...]) -> _StubCursor:
+        return _StubCursor()
+
+
+def _stub_database() -> Database:
+    """The real reader pool and repository path, over a connection that answers at once"""
+    db = Database(":memory:", readers=1)
+    db._idle_send.send_nowait(_StubConnection())  # pyright: ignore[reportPrivateUsage, reportArgumentType]
+    return db
+
+
+async def _downstream(_scope, _receive, _send):  # pyright: ignore[reportMissingParameterType]
+    pass
+
+
+async def _receive():
+    return {"type": "http.request", "body": b"", "more_body": False}
+
+
+async def _send(_message):  # pyright: ignore[reportMissingParameterType]
+    pass
+
+
+def _auth_bench(bench: Bench, name: str, cached: bool):
+    key_cache = ApiKeyCache()
+    state = {"api_keys": ApiKeyRepository(_stub_database()), "key_cache": key_cache, "rate_limiter": RateLimiter(), "metrics": Metrics()}
+    middleware = AuthMiddleware(_downstream, admin_key="admin")
+    headers = [(b"accept", b"application/json"), (b"authorization", f"Bearer {API_KEY}".encode())]
+
+    async def call():
+        if not cached:
+            key_cache.invalidate(KEY_HASH)
+        scope = {"type": "http", "method": "POST", "path": "/v2/generate", "headers": headers, "state": dict(state)}
+        await middleware(scope, _receive, _send)
+
+    bench.run_async(name, call)
+
+
+def test_auth_cached_key(bench: Bench):
+    _auth_bench(bench, "auth_cached_key", cached=True)
+
+
+def test_auth_database_lookup(bench: Bench):
+    _auth_bench(bench, "auth_database_lookup", cached=False)
+
+
+def test_openai_completion_request(bench: Bench):
+    body = msgspec.json.encode({
+        "model": "bench", "prompt": REQUEST.prompt, "max_tokens": 128, "temperature": 0.7, "top_p": 0.9, "stop": ["\n"], "n": 1, "logit_bias": {}
+    })
+    unsupported = unsupported_fields(MODEL, PROVIDER)
+
+    # From the raw body, as the route gets it
+    def decode():
+        completion_request = decode_body(body, OpenAICompletionRequest)
+        completion_request.drop_unsupported(unsupported)
+
+    bench("openai_completion_request", decode)
+
+
+def test_openai_prepare_request(bench: Bench):
+    provider = OpenAIProvider(PROVIDER)
+    bench("openai_prepare_request", lambda: provider.prepare_request(MODEL, REQUEST))
+
+
+def test_openai_parse_response(bench: Bench):
+    provider = OpenAIProvider(PROVIDER)
+    body = msgspec.json.encode({
+        "id": "cmpl-1",
+        "object": "text_completion",
+        "created": 1,
+        "model": "bench-upstream",
+        "choices": [{"index": 0, "text": " tok" * 256, "finish_reason": "length", "logprobs": None}],
+        "usage": {"prompt_tokens": 80, "completion_tokens": 256, "total_tokens": 336},
+    })
+    bench("openai_parse_response", lambda: provider.parse_response(body))
+
+
+class _UpstreamStream(httpx.AsyncByteStream):
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for chunk in UPSTREAM_STREAM:
+            yield chunk
+
+
+def _upstream(_request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=_UpstreamStream())
+
+
+def test_sse_relay(bench: Bench):
+    # The provider's own relay and retry path, over an upstream answering in memory
+    provider = OpenAIProvider(PROVIDER)
+    provider.client = httpx.AsyncClient(transport=httpx.MockTransport(_upstream))
+
+    async def relay():
+        async with contextlib.aclosing(encode_events(provider.stream_events(MODEL, REQUEST))) as events:
+            async for _ in events:
+                pass
+
+    bench.run_async(f"sse_relay_{STREAM_TOKENS}_tokens", relay)
+
+
+def test_msgspec_json_response_render(bench: Bench):
+    response = MsgspecJSONResponse(TextGenerationResponse(text=" tok" * 256, stop_reason=StopReason.MAX_TOKENS))
+    content = response._content
+    bench("msgspec_json_response_render", lambda: response.render(content))
+
+
+def test_config_get_model(bench: Bench):
+    config = Config(
+        proxy=ProxyConfig(admin_key="admin"),
+        providers=[PROVIDER],
+        models=[ModelConfig(name=f"model-{i}", model_id=f"upstream-{i}", provider="bench") for i in range(500)],
+    )
+    # The last model is the slowest to find by a scan
+    bench("config_get_model_500", lambda: config.get_model("model-499"))
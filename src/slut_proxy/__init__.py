@@ -4,21 +4,17 @@ import trio
 from hypercorn.config import Config as HyperConfig
 from hypercorn.trio import serve # pyright: ignore[reportUnknownVariableType]
 
-def main(hypercorn_config: HyperConfig, slut_config: Config):
+def main(hypercorn_config: HyperConfig, slut_config: Config, config_path: str | None = None):
     from .app import build_app
 
-    app = build_app(slut_config)
+    app = build_app(slut_config, config_path)
 
     _ = trio.run(serve, app, hypercorn_config) # pyright: ignore[reportArgumentType]
 
-# FIXME: real cli
 def cli_entrypoint():
-    hyper = HyperConfig()
-    hyper.bind = ["localhost:8080"]
+    from .serve import cli
 
-    conf = Config.from_toml("config.toml")
-
-    main(hyper, conf)
+    cli()
 
 if __name__ == "__main__":
     cli_entrypoint()
\ No newline at end of file
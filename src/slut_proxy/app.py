@@ -1,8 +1,9 @@
 from collections.abc import AsyncIterator
 import contextlib
+import os
 from typing import TypedDict
 
-import anyio_sqlite
+import trio
 from starlette.applications import Starlette
 from starlette.requests import Request
 from starlette.responses import JSONResponse
@@ -10,22 +11,114 @@ from starlette.routing import Route
 
 from .models.config import Config
 from .routes import build_routes
-from .migrations import do_migration
-from .middleware import AuthMiddleware
+from .middleware import AuthMiddleware, ApiKeyCache, RateLimiter, StateSync, TimingMiddleware
+from .providers import ProviderError
+from .providers.cache import ResponseCache
+from .providers.coalesce import Coalescer
+from .providers.registry import ProviderRegistry
+from .providers.usage import UsageLog
+from .reload import ConfigReloader
+from .storage import ApiKeyRepository, Database
+from .utils.metrics import Metrics
+from .utils.requests import RequestError
 
 class State(TypedDict):
-    db: anyio_sqlite.Connection  # pyright: ignore[reportMissingTypeArgument]
+    db: Database
+    api_keys: ApiKeyRepository
+    key_cache: ApiKeyCache
+    rate_limiter: RateLimiter
+    state_sync: StateSync
+    providers: ProviderRegistry
+    response_cache: ResponseCache
+    coalescer: Coalescer | None
+    usage_log: UsageLog
+    metrics: Metrics
+    reloader: ConfigReloader | None
 
-def build_app(slut_config: Config):
+def build_app(slut_config: Config, config_path: str | None = None, shared_state: bool = False):
+    """
+    `config_path` is where `slut_config` came from, for reloads. With
+    `shared_state`, key invalidations and rate limits are kept in step with
+    other worker processes serving the same database.
+    """
     @contextlib.asynccontextmanager
     async def lifespan(_app) -> AsyncIterator[State]:
-        async with anyio_sqlite.connect("slut_proxy.db", isolation_level=None) as con:
-            await do_migration(con)
-            yield {"db": con}
+        async with Database("slut_proxy.db", readers=slut_config.proxy.database_readers) as db, trio.open_nursery() as db_nursery:
+            # Outlives the tasks below, which write a last time as they stop
+            await db_nursery.start(db.run)
 
-    app = Starlette(debug=True, routes=build_routes(slut_config), lifespan=lifespan)
+            key_cache = ApiKeyCache(
+                max_size=slut_config.proxy.auth_cache_size,
+                ttl=slut_config.proxy.auth_cache_ttl,
+                negative_max_size=slut_config.proxy.auth_negative_cache_size,
+                negative_ttl=slut_config.proxy.auth_negative_cache_ttl,
+            )
+            rate_limiter = RateLimiter(slut_config.proxy.rate_limit_flush_interval, shared=shared_state)
+            await rate_limiter.load(db)
+            usage_log = UsageLog(slut_config.proxy.usage)
+            metrics = Metrics(worker=str(os.getpid()) if shared_state else None)
+            state_sync = StateSync(key_cache, rate_limiter, enabled=shared_state, interval=slut_config.proxy.state_sync_interval, metrics=metrics)
+
+            async with ResponseCache(slut_config.proxy.cache) as response_cache:
+                coalescer = Coalescer() if slut_config.proxy.coalesce_requests else None
+                providers = ProviderRegistry(slut_config, response_cache, coalescer, rate_limiter, usage_log, metrics)
+                try:
+                    await providers.prewarm()
+                    async with trio.open_nursery() as nursery:
+                        await nursery.start(providers.run)
+                        nursery.start_soon(rate_limiter.run, db)
+                        await nursery.start(state_sync.run, db)
+                        nursery.start_soon(usage_log.run, db)
+                        if coalescer is not None:
+                            await nursery.start(coalescer.run)
+                        reloader = ConfigReloader(config_path, providers) if config_path is not None else None
+                        if reloader is not None:
+                            await nursery.start(reloader.run)
+                            state_sync.on_reload = reloader.request
+                        yield {
+                            "db": db,
+                            "api_keys": ApiKeyRepository(db),
+                            "key_cache": key_cache,
+                            "rate_limiter": rate_limiter,
+                            "state_sync": state_sync,
+                            "providers": providers,
+                            "response_cache": response_cache,
+                            "coalescer": coalescer,
+                            "usage_log": usage_log,
+                            "metrics": metrics,
+                            "reloader": reloader,
+                        }
+                        nursery.cancel_scope.cancel()
+                finally:
+                    await providers.aclose()
+            db_nursery.cancel_scope.cancel()
+
+    async def provider_error(request: Request, exc: Exception) -> JSONResponse:
+        assert isinstance(exc, ProviderError)
+        if request.url.path.startswith("/v1/"):
+            return JSONResponse({"error": {"message": exc.message, "type": "upstream_error"}}, status_code=exc.status_code, headers=exc.headers)
+        return JSONResponse({"error": exc.message}, status_code=exc.status_code, headers=exc.headers)
+
+    async def request_error(request: Request, exc: Exception) -> JSONResponse:
+        assert isinstance(exc, RequestError)
+        if request.url.path.startswith("/v1/"):
+            return JSONResponse({"error": {"message": exc.message, "type": "invalid_request_error", "param": exc.param}}, status_code=exc.status_code)
+        return JSONResponse({"error": exc.message, "param": exc.param}, status_code=exc.status_code)
+
+    app = Starlette(
+        debug=True,
+        routes=build_routes(slut_config),
+        lifespan=lifespan,
+        exception_handlers={ProviderError: provider_error, RequestError: request_error},
+    )
     
     # Add authentication middleware
     app.add_middleware(AuthMiddleware, admin_key=slut_config.proxy.admin_key)
+    # Outermost, so auth is timed too
+    app.add_middleware(
+        TimingMiddleware,
+        server_timing=slut_config.proxy.server_timing,
+        slow_request_threshold=slut_config.proxy.slow_request_threshold,
+    )
 
     return app
\ No newline at end of file
@@ -1,3 +1,7 @@
 from .auth import AuthMiddleware
+from .key_cache import ApiKeyCache, ApiKeyPermissions
+from .rate_limit import RateLimiter, RateLimitUsage
+from .sync import StateSync
+from .timing import TimingMiddleware
 
-__all__ = ["AuthMiddleware"]
\ No newline at end of file
+__all__ = ["AuthMiddleware", "ApiKeyCache", "ApiKeyPermissions", "RateLimiter", "RateLimitUsage", "StateSync", "TimingMiddleware"]
\ No newline at end of file
@@ -1,66 +1,143 @@
 import hashlib
-import json
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
+import time
+from enum import Enum
+from typing import TYPE_CHECKING
 from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-class AuthMiddleware(BaseHTTPMiddleware):
-    def __init__(self, app, admin_key: str):
-        super().__init__(app)
+from .key_cache import ApiKeyCache, ApiKeyPermissions
+from .rate_limit import RateLimiter, rate_limit_headers
+from ..utils.metrics import Metrics
+from ..utils import timing
+
+if TYPE_CHECKING:
+    from ..storage import ApiKeyRepository
+
+class AuthScope(Enum):
+    PUBLIC = 0
+    ADMIN = 1
+    API_KEY = 2
+
+# Checked in order, first matching prefix wins
+AUTH_PREFIXES: tuple[tuple[str, AuthScope], ...] = (
+    ("/v2/admin/", AuthScope.ADMIN),
+    ("/v2/generate", AuthScope.API_KEY),
+    ("/v1/completions", AuthScope.API_KEY),
+)
+
+def classify(path: str) -> AuthScope:
+    for prefix, auth_scope in AUTH_PREFIXES:
+        if path.startswith(prefix):
+            return auth_scope
+    return AuthScope.PUBLIC
+
+def _bearer_token(scope: Scope) -> str | None:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            if value.startswith(b"Bearer "):
+                return value[7:].decode("latin-1")  # Remove "Bearer " prefix
+            return None
+    return None
+
+class AuthMiddleware:
+    """
+    Pure ASGI authentication layer.
+
+    Unlike `BaseHTTPMiddleware` this never wraps the response: once a request
+    is authorized the downstream app gets the original `receive` and `send`,
+    so streamed bodies are relayed without an extra task or memory stream.
+    Permissions of API key requests are attached to `scope["state"]`.
+    """
+
+    def __init__(self, app: ASGIApp, admin_key: str):
+        self.app = app
         self.admin_key = admin_key
-    
-    async def dispatch(self, request: Request, call_next):
-        # Skip auth for OPTIONS requests
-        if request.method == "OPTIONS":
-            return await call_next(request)
-        
-        # Check if this is an admin endpoint
-        if request.url.path.startswith("/v2/admin/"):
-            auth_header = request.headers.get("authorization")
-            if not auth_header or not auth_header.startswith("Bearer "):
-                return JSONResponse(
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        # Skip auth for non-HTTP traffic (lifespan) and OPTIONS requests
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            return await self.app(scope, receive, send)
+
+        auth_scope = classify(scope["path"])
+        if auth_scope is AuthScope.PUBLIC:
+            return await self.app(scope, receive, send)
+
+        token = _bearer_token(scope)
+        metrics: Metrics = scope["state"]["metrics"]
+
+        if auth_scope is AuthScope.ADMIN:
+            if token is None:
+                metrics.auth.labels("missing").inc()
+                response = JSONResponse(
                     {"error": "Missing or invalid authorization header"},
                     status_code=401
                 )
-            
-            token = auth_header[7:]  # Remove "Bearer " prefix
+                return await response(scope, receive, send)
+
             if token != self.admin_key:
-                return JSONResponse(
+                metrics.auth.labels("invalid").inc()
+                response = JSONResponse(
                     {"error": "Invalid admin key"},
                     status_code=403
                 )
-        
-        # Check if this is a generate endpoint (needs API key)
-        if request.url.path.startswith("/v2/generate") or request.url.path.startswith("/v1/completions"):
-            auth_header = request.headers.get("authorization")
-            if not auth_header or not auth_header.startswith("Bearer "):
-                return JSONResponse(
-                    {"error": "Missing or invalid API key"},
-                    status_code=401
-                )
-            
-            api_key = auth_header[7:]  # Remove "Bearer " prefix
-            
-            # Validate API key against database
-            db = request.state.db  # pyright: ignore[reportMissingTypeArgument, reportAny]
-            key_hash = hashlib.sha256(api_key.encode()).hexdigest()
-            
-            async with await db.execute(
-                "SELECT allowed_providers, allowed_models FROM api_keys WHERE key_hash = ? AND is_active = 1",
-                (key_hash,)
-            ) as cur:
-                row = await cur.fetchone()
-                
-            if not row:
-                return JSONResponse(
-                    {"error": "Invalid API key"},
-                    status_code=403
-                )
-            
-            # Store the API key permissions in request state for use by endpoints
-            request.state.api_key_permissions = {
-                "allowed_providers": json.loads(row[0]),
-                "allowed_models": json.loads(row[1])
-            }
-        
-        return await call_next(request)
+                return await response(scope, receive, send)
+
+            metrics.auth.labels("admin").inc()
+            timing.mark("auth")
+            return await self.app(scope, receive, send)
+
+        if token is None:
+            metrics.auth.labels("missing").inc()
+            response = JSONResponse(
+                {"error": "Missing or invalid API key"},
+                status_code=401
+            )
+            return await response(scope, receive, send)
+
+        started = time.perf_counter()
+        permissions = await self.lookup(scope["state"], token)
+        metrics.auth_lookup.labels().observe(time.perf_counter() - started)
+        if permissions is None:
+            metrics.auth.labels("invalid").inc()
+            response = JSONResponse(
+                {"error": "Invalid API key"},
+                status_code=403
+            )
+            return await response(scope, receive, send)
+
+        rate_limiter: RateLimiter = scope["state"]["rate_limiter"]
+        usage = rate_limiter.acquire(permissions)
+        if usage is not None:
+            metrics.auth.labels("rate_limited").inc()
+            response = JSONResponse(
+                {"error": "Rate limit exceeded"},
+                status_code=429,
+                headers=rate_limit_headers(usage)
+            )
+            return await response(scope, receive, send)
+
+        metrics.auth.labels("ok").inc()
+        timing.mark("auth")
+        # Store the API key permissions in request state for use by endpoints
+        scope["state"]["api_key_permissions"] = permissions
+        return await self.app(scope, receive, send)
+
+    async def lookup(self, state: dict, api_key: str) -> ApiKeyPermissions | None:  # pyright: ignore[reportMissingTypeArgument]
+        """Validate an API key, hitting the database only on a cache miss"""
+        key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+        key_cache: ApiKeyCache = state["key_cache"]
+
+        permissions = key_cache.get(key_hash)
+        if permissions is False:
+            return None
+        if permissions is not None:
+            return permissions
+
+        api_keys: "ApiKeyRepository" = state["api_keys"]
+        permissions = await api_keys.permissions(key_hash)
+        if permissions is None:
+            key_cache.put_invalid(key_hash)
+            return None
+
+        key_cache.put(key_hash, permissions)
+        return permissions
@@ -0,0 +1,83 @@
+import time
+from collections import OrderedDict
+
+from msgspec import Struct
+
+
+class ApiKeyPermissions(Struct, frozen=True):
+    """
+    Parsed permissions of an active API key, as attached to the request state
+    """
+
+    allowed_providers: frozenset[str]
+    allowed_models: frozenset[str]
+    key_hash: str = ""
+    # Share of queued capacity relative to other keys
+    weight: float = 1.0
+    # Rate limits, `None` is unlimited
+    requests_per_second: float | None = None
+    tokens_per_minute: int | None = None
+
+
+class ApiKeyCache:
+    """
+    Bounded in-process LRU of key hash -> permissions.
+
+    Unknown hashes are remembered separately (negative cache) so floods of
+    invalid keys never reach the database. Entries expire after a TTL so
+    changes made to the database by other means are eventually picked up;
+    changes made through the admin API invalidate entries immediately.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 300.0, negative_max_size: int = 10000, negative_ttl: float = 30.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_max_size = negative_max_size
+        self.negative_ttl = negative_ttl
+
+        self._entries: OrderedDict[str, tuple[float, ApiKeyPermissions]] = OrderedDict()
+        self._negative: OrderedDict[str, float] = OrderedDict()
+
+    def get(self, key_hash: str) -> ApiKeyPermissions | None | bool:
+        """
+        Returns the cached permissions, `False` if the hash is known to be invalid,
+        or `None` on a cache miss.
+        """
+        now = time.monotonic()
+
+        entry = self._entries.get(key_hash)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key_hash)
+                return entry[1]
+            del self._entries[key_hash]
+
+        expires = self._negative.get(key_hash)
+        if expires is not None:
+            if expires > now:
+                return False
+            del self._negative[key_hash]
+
+        return None
+
+    def put(self, key_hash: str, permissions: ApiKeyPermissions):
+        _ = self._negative.pop(key_hash, None)
+        self._entries[key_hash] = (time.monotonic() + self.ttl, permissions)
+        self._entries.move_to_end(key_hash)
+        while len(self._entries) > self.max_size:
+            _ = self._entries.popitem(last=False)
+
+    def put_invalid(self, key_hash: str):
+        _ = self._entries.pop(key_hash, None)
+        self._negative[key_hash] = time.monotonic() + self.negative_ttl
+        self._negative.move_to_end(key_hash)
+        while len(self._negative) > self.negative_max_size:
+            _ = self._negative.popitem(last=False)
+
+    def invalidate(self, key_hash: str):
+        _ = self._entries.pop(key_hash, None)
+        _ = self._negative.pop(key_hash, None)
+
+    def clear(self):
+        self._entries.clear()
+        self._negative.clear()
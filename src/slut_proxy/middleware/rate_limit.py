@@ -0,0 +1,253 @@
+import math
+import time
+from typing import TYPE_CHECKING
+
+import anyio_sqlite
+import msgspec
+import trio
+
+from .key_cache import ApiKeyPermissions
+
+if TYPE_CHECKING:
+    from ..storage import Database
+
+
+# Buckets hold at most a minute's worth, older consumption no longer matters
+_PENDING_TTL = 60.0
+
+
+class RateLimitUsage(msgspec.Struct):
+    """Current consumption of a key, as exposed by the admin API and headers"""
+
+    requests_per_second: float | None = None
+    requests_remaining: float | None = None
+    tokens_per_minute: int | None = None
+    tokens_remaining: float | None = None
+    # Seconds until the exhausted limit allows another request
+    retry_after: float = 0.0
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens: float, updated: float):
+        self.tokens = tokens
+        self.updated = updated # monotonic
+
+    def refill(self, capacity: float, per_second: float, now: float):
+        self.tokens = min(capacity, self.tokens + (now - self.updated) * per_second)
+        self.updated = now
+
+
+class _KeyBuckets:
+    __slots__ = ("requests", "tokens")
+
+    def __init__(self, requests: TokenBucket, tokens: TokenBucket):
+        self.requests = requests
+        self.tokens = tokens
+
+
+class RateLimiter:
+    """
+    Per-key request/s and token/min limits, held in memory.
+
+    Requests take one token from a bucket holding a second's worth of
+    requests. Generated tokens are charged afterwards to a bucket holding a
+    minute's worth, which may go into debt; a key in debt is refused until
+    it refills. Bucket state is flushed to SQLite every `flush_interval`
+    seconds so limits survive restarts, never on the request path.
+
+    With `shared`, consumption is also noted for `StateSync` to pass on to
+    the other worker processes, whose consumption comes back through
+    `apply_consumed`.
+    """
+
+    def __init__(self, flush_interval: float = 10.0, shared: bool = False):
+        self.flush_interval = flush_interval
+        self._buckets: dict[str, _KeyBuckets] = {}
+        self._dirty: set[str] = set()
+        # Requests and tokens consumed here since they were last taken
+        self._consumed: dict[str, list[float]] | None = {} if shared else None
+        # Consumed elsewhere by keys this worker has no buckets for yet, as
+        # requests, tokens and when it was last added to
+        self._pending: dict[str, list[float]] = {}
+
+    def _buckets_for(self, permissions: ApiKeyPermissions, now: float) -> _KeyBuckets:
+        buckets = self._buckets.get(permissions.key_hash)
+        if buckets is None:
+            # New keys start full
+            buckets = self._buckets[permissions.key_hash] = _KeyBuckets(
+                TokenBucket(_request_capacity(permissions), now),
+                TokenBucket(float(permissions.tokens_per_minute or 0), now),
+            )
+            pending = self._pending.pop(permissions.key_hash, None)
+            if pending is not None and now - pending[2] < _PENDING_TTL:
+                buckets.requests.tokens -= pending[0]
+                buckets.tokens.tokens -= pending[1]
+        if permissions.requests_per_second is not None:
+            buckets.requests.refill(_request_capacity(permissions), permissions.requests_per_second, now)
+        else:
+            buckets.requests.updated = now
+        if permissions.tokens_per_minute is not None:
+            buckets.tokens.refill(permissions.tokens_per_minute, permissions.tokens_per_minute / 60, now)
+        else:
+            buckets.tokens.updated = now
+        return buckets
+
+    def acquire(self, permissions: ApiKeyPermissions) -> RateLimitUsage | None:
+        """Takes a request from the key's allowance, returns its usage if it is refused"""
+        if permissions.requests_per_second is None and permissions.tokens_per_minute is None:
+            return None
+
+        buckets = self._buckets_for(permissions, time.monotonic())
+        usage = self._usage(permissions, buckets)
+        if usage.retry_after > 0:
+            return usage
+
+        if permissions.requests_per_second is not None:
+            buckets.requests.tokens -= 1
+            self._dirty.add(permissions.key_hash)
+            self.note_consumed(permissions.key_hash, 1, 0)
+        return None
+
+    def charge(self, permissions: ApiKeyPermissions, tokens: int):
+        """Charges generated tokens, once they are known"""
+        if permissions.tokens_per_minute is None:
+            return
+        buckets = self._buckets_for(permissions, time.monotonic())
+        buckets.tokens.tokens -= tokens
+        self._dirty.add(permissions.key_hash)
+        self.note_consumed(permissions.key_hash, 0, tokens)
+
+    def note_consumed(self, key_hash: str, requests: float, tokens: float):
+        if self._consumed is None:
+            return
+        consumed = self._consumed.get(key_hash)
+        if consumed is None:
+            self._consumed[key_hash] = [requests, tokens]
+        else:
+            consumed[0] += requests
+            consumed[1] += tokens
+
+    def take_consumed(self) -> dict[str, list[float]]:
+        """Requests and tokens consumed per key since the last call"""
+        if self._consumed is None:
+            return {}
+        consumed, self._consumed = self._consumed, {}
+
+        # Pending consumption of keys still not seen here has refilled by now
+        now = time.monotonic()
+        for key_hash in [key_hash for key_hash, pending in self._pending.items() if now - pending[2] >= _PENDING_TTL]:
+            del self._pending[key_hash]
+        return consumed
+
+    def apply_consumed(self, key_hash: str, requests: float, tokens: float):
+        """Takes what another worker consumed out of this one's buckets"""
+        buckets = self._buckets.get(key_hash)
+        if buckets is None:
+            pending = self._pending.setdefault(key_hash, [0.0, 0.0, 0.0])
+            pending[0] += requests
+            pending[1] += tokens
+            pending[2] = time.monotonic()
+            return
+        buckets.requests.tokens -= requests
+        buckets.tokens.tokens -= tokens
+        self._dirty.add(key_hash)
+
+    def usage(self, permissions: ApiKeyPermissions) -> RateLimitUsage:
+        return self._usage(permissions, self._buckets_for(permissions, time.monotonic()))
+
+    def _usage(self, permissions: ApiKeyPermissions, buckets: _KeyBuckets) -> RateLimitUsage:
+        retry_after = 0.0
+        if permissions.requests_per_second is not None and buckets.requests.tokens < 1:
+            retry_after = (1 - buckets.requests.tokens) / permissions.requests_per_second
+        if permissions.tokens_per_minute is not None and buckets.tokens.tokens <= 0:
+            retry_after = max(retry_after, (1 - buckets.tokens.tokens) / (permissions.tokens_per_minute / 60))
+
+        return RateLimitUsage(
+            requests_per_second=permissions.requests_per_second,
+            requests_remaining=buckets.requests.tokens if permissions.requests_per_second is not None else None,
+            tokens_per_minute=permissions.tokens_per_minute,
+            tokens_remaining=buckets.tokens.tokens if permissions.tokens_per_minute is not None else None,
+            retry_after=retry_after,
+        )
+
+    def forget(self, key_hash: str):
+        """Drops a revoked key's state, it is deleted from SQLite on the next flush"""
+        _ = self._pending.pop(key_hash, None)
+        if self._buckets.pop(key_hash, None) is not None:
+            self._dirty.add(key_hash)
+
+    async def load(self, db: "Database"):
+        """Restores persisted buckets, refilling them for the time the proxy was down"""
+        offset = time.monotonic() - time.time()
+        async with db.reader() as con:
+            async with await con.execute(
+                "SELECT key_hash, request_tokens, token_tokens, updated_at FROM rate_limit_state"
+            ) as cur:
+                async for row in cur:
+                    updated = row[3] + offset
+                    self._buckets[row[0]] = _KeyBuckets(TokenBucket(row[1], updated), TokenBucket(row[2], updated))
+
+    async def flush(self, db: "Database"):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        offset = time.time() - time.monotonic()
+
+        upserts = []
+        deletes = []
+        for key_hash in dirty:
+            buckets = self._buckets.get(key_hash)
+            if buckets is None:
+                deletes.append((key_hash,))
+                continue
+            # Both buckets are refilled together, requests.updated stands for both
+            upserts.append((key_hash, buckets.requests.tokens, buckets.tokens.tokens, buckets.requests.updated + offset))
+
+        async def write(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+            _ = await con.executemany(
+                """INSERT INTO rate_limit_state (key_hash, request_tokens, token_tokens, updated_at)
+                   VALUES (?, ?, ?, ?)
+                   ON CONFLICT(key_hash) DO UPDATE SET
+                   request_tokens = excluded.request_tokens, token_tokens = excluded.token_tokens, updated_at = excluded.updated_at""",
+                upserts
+            )
+            _ = await con.executemany("DELETE FROM rate_limit_state WHERE key_hash = ?", deletes)
+
+        try:
+            await db.write(write)
+        except:
+            self._dirty |= dirty
+            raise
+
+    async def run(self, db: "Database"):
+        """Flushes every `flush_interval` seconds, and a last time when cancelled"""
+        try:
+            while True:
+                await trio.sleep(self.flush_interval)
+                try:
+                    await self.flush(db)
+                except anyio_sqlite.Error as e:
+                    print(f"Failed to persist rate limit state: {e!r}")
+        finally:
+            with trio.CancelScope(shield=True):
+                await self.flush(db)
+
+
+def _request_capacity(permissions: ApiKeyPermissions) -> float:
+    # A second's worth of requests, and at least one
+    return max(1.0, permissions.requests_per_second or 0)
+
+
+def rate_limit_headers(usage: RateLimitUsage) -> dict[str, str]:
+    """OpenAI-style `x-ratelimit-*` headers plus `Retry-After`"""
+    headers = {"Retry-After": str(max(1, math.ceil(usage.retry_after)))}
+    if usage.requests_per_second is not None:
+        headers["X-RateLimit-Limit-Requests"] = f"{usage.requests_per_second:g}/s"
+        headers["X-RateLimit-Remaining-Requests"] = str(max(0, math.floor(usage.requests_remaining or 0)))
+    if usage.tokens_per_minute is not None:
+        headers["X-RateLimit-Limit-Tokens"] = f"{usage.tokens_per_minute}/min"
+        headers["X-RateLimit-Remaining-Tokens"] = str(max(0, math.floor(usage.tokens_remaining or 0)))
+    headers["X-RateLimit-Reset"] = f"{usage.retry_after:.3f}s"
+    return headers
@@ -0,0 +1,187 @@
+from collections.abc import Callable
+import os
+import time
+from typing import TYPE_CHECKING
+
+import anyio_sqlite
+import msgspec
+import trio
+
+from .key_cache import ApiKeyCache
+from .rate_limit import RateLimiter
+from ..utils.metrics import Metrics
+
+if TYPE_CHECKING:
+    from ..storage import Database
+
+# Every worker has read an event well before this many seconds
+_EVENT_RETENTION = 60.0
+_PRUNE_EVERY = 100 # syncs
+# Metric samples are published at most this often (seconds), and those of a
+# worker not heard from in a few publications are left out
+_METRICS_INTERVAL = 5.0
+_METRICS_STALE_AFTER = 3
+
+
+class StateSync:
+    """
+    Keeps worker processes serving the same database in agreement on API
+    keys and rate limits.
+
+    Key invalidations made through the admin API are applied here at once
+    and published as events; rate limit consumption is published every
+    `interval` seconds. Each worker polls for the events of the others in
+    the same loop, so their caches and buckets trail by about an interval.
+    Config reloads through the admin API are published too, each other
+    worker reloads through `on_reload`. Metric samples are shared at a
+    slower pace, for `worker_metrics`. When not `enabled` (a single
+    process), changes only apply locally.
+    """
+
+    def __init__(
+        self,
+        key_cache: ApiKeyCache,
+        rate_limiter: RateLimiter,
+        enabled: bool = False,
+        interval: float = 0.5,
+        metrics: Metrics | None = None
+    ):
+        self.key_cache = key_cache
+        self.rate_limiter = rate_limiter
+        self.enabled = enabled
+        self.interval = interval
+        self.metrics = metrics
+        self.worker = str(os.getpid())
+        # Set once there is a config to reload
+        self.on_reload: Callable[[], None] | None = None
+        self._last_id = 0
+        self._syncs_since_prune = 0
+        self._metrics_interval = max(interval, _METRICS_INTERVAL)
+        self._metrics_published = -self._metrics_interval
+
+    async def invalidate(self, db: "Database", key_hash: str):
+        """Drops a changed key from the caches of every worker"""
+        self.key_cache.invalidate(key_hash)
+        await self._publish(db, "invalidate", key_hash)
+
+    async def revoke(self, db: "Database", key_hash: str):
+        """Drops a deleted key from the caches and rate limiters of every worker"""
+        self.key_cache.invalidate(key_hash)
+        self.rate_limiter.forget(key_hash)
+        await self._publish(db, "revoke", key_hash)
+
+    async def reloaded(self, db: "Database"):
+        """Has every other worker reload the config this one just reloaded"""
+        await self._publish(db, "reload", "")
+
+    async def worker_metrics(self, db: "Database") -> list[dict[str, list[str]]]:
+        """The latest metric samples of the other workers, by metric name"""
+        if not self.enabled:
+            return []
+        async with db.reader() as con:
+            async with await con.execute(
+                "SELECT samples FROM worker_metrics WHERE worker != ? AND updated_at >= ?",
+                (self.worker, time.time() - self._metrics_interval * _METRICS_STALE_AFTER)
+            ) as cur:
+                return [msgspec.json.decode(row[0], type=dict[str, list[str]]) async for row in cur]
+
+    async def _publish(self, db: "Database", kind: str, key_hash: str):
+        if not self.enabled:
+            return
+        now = time.time()
+
+        async def insert(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+            _ = await con.execute(
+                "INSERT INTO worker_events (created_at, worker, kind, key_hash) VALUES (?, ?, ?, ?)",
+                (now, self.worker, kind, key_hash)
+            )
+
+        await db.write(insert)
+
+    async def sync(self, db: "Database"):
+        """Publishes this worker's consumption and applies what the others did"""
+        consumed = self.rate_limiter.take_consumed()
+        prune = self._syncs_since_prune + 1 >= _PRUNE_EVERY
+        samples = None
+        if self.metrics is not None and time.monotonic() - self._metrics_published >= self._metrics_interval:
+            samples = msgspec.json.encode(self.metrics.samples()).decode()
+            self._metrics_published = time.monotonic()
+        if consumed or prune or samples is not None:
+            now = time.time()
+
+            async def write(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+                _ = await con.executemany(
+                    "INSERT INTO worker_events (created_at, worker, kind, key_hash, requests, tokens) VALUES (?, ?, 'consume', ?, ?, ?)",
+                    [(now, self.worker, key_hash, requests, tokens) for key_hash, (requests, tokens) in consumed.items()]
+                )
+                if samples is not None:
+                    _ = await con.execute(
+                        "INSERT OR REPLACE INTO worker_metrics (worker, updated_at, samples) VALUES (?, ?, ?)",
+                        (self.worker, now, samples)
+                    )
+                if prune:
+                    _ = await con.execute("DELETE FROM worker_events WHERE created_at < ?", (now - _EVENT_RETENTION,))
+                    _ = await con.execute(
+                        "DELETE FROM worker_metrics WHERE updated_at < ?",
+                        (now - self._metrics_interval * _METRICS_STALE_AFTER,)
+                    )
+
+            try:
+                await db.write(write)
+            except:
+                # Published with the next sync instead
+                for key_hash, (requests, tokens) in consumed.items():
+                    self.rate_limiter.note_consumed(key_hash, requests, tokens)
+                raise
+
+        self._syncs_since_prune = 0 if prune else self._syncs_since_prune + 1
+
+        reload = False
+        async with db.reader() as con:
+            async with await con.execute(
+                "SELECT id, worker, kind, key_hash, requests, tokens FROM worker_events WHERE id > ? ORDER BY id",
+                (self._last_id,)
+            ) as cur:
+                async for row in cur:
+                    self._last_id = row[0]
+                    if row[1] == self.worker:
+                        continue
+                    if row[2] == "consume":
+                        self.rate_limiter.apply_consumed(row[3], row[4], row[5])
+                    elif row[2] == "revoke":
+                        self.key_cache.invalidate(row[3])
+                        self.rate_limiter.forget(row[3])
+                    elif row[2] == "reload":
+                        reload = True
+                    else:
+                        self.key_cache.invalidate(row[3])
+        # Several reloads in one go amount to one
+        if reload and self.on_reload is not None:
+            self.on_reload()
+
+    async def run(self, db: "Database", task_status: trio.TaskStatus[None] = trio.TASK_STATUS_IGNORED):
+        """Syncs every `interval` seconds, and publishes a last time when cancelled"""
+        if not self.enabled:
+            task_status.started()
+            return
+
+        # Earlier events are already reflected in the database this worker loads from
+        async with db.reader() as con:
+            async with await con.execute("SELECT COALESCE(MAX(id), 0) FROM worker_events") as cur:
+                row = await cur.fetchone()
+                self._last_id = row[0] if row else 0
+        task_status.started()
+
+        try:
+            while True:
+                await trio.sleep(self.interval)
+                try:
+                    await self.sync(db)
+                except anyio_sqlite.Error as e:
+                    print(f"Failed to sync state with the other workers: {e!r}")
+        finally:
+            with trio.CancelScope(shield=True):
+                try:
+                    await self.sync(db)
+                except anyio_sqlite.Error as e:
+                    print(f"Failed to sync state with the other workers: {e!r}")
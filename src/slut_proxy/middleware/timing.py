@@ -0,0 +1,80 @@
+import msgspec
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..utils.timing import start_timing
+
+
+class SlowRequest(msgspec.Struct):
+    method: str
+    path: str
+    status: int
+    model: str | None
+    total_ms: float
+    # Phase name and milliseconds, in the order they were recorded
+    phases: list[tuple[str, float]]
+
+
+_slow_request_encoder = msgspec.json.Encoder()
+
+
+def _is_event_stream(headers: list[tuple[bytes, bytes]]) -> bool:
+    for name, value in headers:
+        if name == b"content-type":
+            return value.startswith(b"text/event-stream")
+    return False
+
+
+class TimingMiddleware:
+    """
+    Times the phases of each request.
+
+    A `RequestTiming` is made current for the request, so the auth
+    middleware, routes and providers can record into it. The phases are sent
+    as a `Server-Timing` header, or for event streams (where headers leave
+    before the work is done) as a trailing `: server-timing` SSE comment.
+    Requests slower than `slow_request_threshold` are logged as JSON.
+    """
+
+    def __init__(self, app: ASGIApp, server_timing: bool = True, slow_request_threshold: float | None = None):
+        self.app = app
+        self.server_timing = server_timing
+        self.slow_request_threshold = slow_request_threshold
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        timing = start_timing()
+        status = 500
+        streaming = False
+
+        async def send_timed(message: Message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                streaming = _is_event_stream(headers)
+                if self.server_timing and not streaming:
+                    headers.append((b"server-timing", timing.server_timing().encode()))
+                    message = {**message, "headers": headers}
+            elif streaming and self.server_timing and message["type"] == "http.response.body" and not message.get("more_body", False):
+                await send({
+                    "type": "http.response.body",
+                    "body": f": server-timing {timing.server_timing()}\n\n".encode(),
+                    "more_body": True,
+                })
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_timed)
+        finally:
+            total = timing.total()
+            if self.slow_request_threshold is not None and total >= self.slow_request_threshold:
+                print("Slow request: " + _slow_request_encoder.encode(SlowRequest(
+                    method=scope["method"],
+                    path=scope["path"],
+                    status=status,
+                    model=timing.model,
+                    total_ms=round(total * 1000, 1),
+                    phases=[(name, round(duration * 1000, 1)) for name, duration in timing.phases],
+                )).decode())
@@ -0,0 +1,10 @@
+import anyio_sqlite
+
+async def do_migration(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+    # Per-key weight for fair queuing when providers are at capacity
+    await con.execute("""
+        ALTER TABLE api_keys 
+        ADD COLUMN weight REAL NOT NULL DEFAULT 1.0
+    """)
+    
+    print("Added weight column to api_keys table")
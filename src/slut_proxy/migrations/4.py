@@ -0,0 +1,18 @@
+import anyio_sqlite
+
+async def do_migration(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+    # Per-key rate limits, NULL means unlimited
+    await con.execute("ALTER TABLE api_keys ADD COLUMN requests_per_second REAL")
+    await con.execute("ALTER TABLE api_keys ADD COLUMN tokens_per_minute INTEGER")
+
+    # Token bucket state, flushed periodically so limits survive restarts
+    await con.execute("""
+        CREATE TABLE rate_limit_state (
+            key_hash TEXT PRIMARY KEY,
+            request_tokens REAL NOT NULL,
+            token_tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    """)
+    
+    print("Added rate limit columns and state table")
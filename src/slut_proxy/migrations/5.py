@@ -0,0 +1,37 @@
+import anyio_sqlite
+
+async def do_migration(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+    # Raw usage records, written in batches by the usage log
+    await con.execute("""
+        CREATE TABLE usage_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            key_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency_ms INTEGER NOT NULL,
+            status INTEGER NOT NULL
+        )
+    """)
+    await con.execute("CREATE INDEX idx_usage_log_created ON usage_log(created_at)")
+
+    # Hourly rollups, maintained in the same transaction as the raw inserts
+    await con.execute("""
+        CREATE TABLE usage_hourly (
+            hour INTEGER NOT NULL,
+            key_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            provider TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            errors INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            completion_tokens INTEGER NOT NULL,
+            latency_ms INTEGER NOT NULL,
+            PRIMARY KEY (hour, key_hash, model, provider)
+        )
+    """)
+    await con.execute("CREATE INDEX idx_usage_hourly_key ON usage_hourly(key_hash, hour)")
+    
+    print("Created usage_log and usage_hourly tables")
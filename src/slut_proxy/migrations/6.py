@@ -0,0 +1,18 @@
+import anyio_sqlite
+
+async def do_migration(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+    # Changes worker processes pass to each other: key invalidations and
+    # revocations, and rate limit consumption. Pruned after a minute
+    await con.execute("""
+        CREATE TABLE worker_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            created_at REAL NOT NULL,
+            worker TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            key_hash TEXT NOT NULL,
+            requests REAL NOT NULL DEFAULT 0,
+            tokens REAL NOT NULL DEFAULT 0
+        )
+    """)
+    
+    print("Created worker_events table")
@@ -0,0 +1,14 @@
+import anyio_sqlite
+
+async def do_migration(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+    # Each worker process's latest metric samples, so any of them can serve
+    # the metrics of all
+    await con.execute("""
+        CREATE TABLE worker_metrics (
+            worker TEXT PRIMARY KEY,
+            updated_at REAL NOT NULL,
+            samples TEXT NOT NULL
+        )
+    """)
+    
+    print("Created worker_metrics table")
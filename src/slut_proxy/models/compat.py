@@ -1,16 +1,17 @@
-from typing import Self, ClassVar, Any
-import msgspec
+from typing import Self, ClassVar
 from msgspec import Struct as MsgStruct
 from starlette.requests import Request
 
+from ..utils.requests import DEFAULT_MAX_BODY_SIZE, decode_request
 from ..utils.responses import MsgspecJSONResponse
+from .config import ModelConfig, ProviderConfig
 
 
 class Struct(MsgStruct):
     @classmethod
-    async def from_request(cls, request: Request) -> Self:
-        body = await request.json()
-        return msgspec.json.decode(body, type=cls)
+    async def from_request(cls, request: Request, max_size: int = DEFAULT_MAX_BODY_SIZE) -> Self:
+        """Decodes the raw body, raising a `RequestError` if it isn't a valid one"""
+        return await decode_request(request, cls, max_size)
 
     async def to_response(self, status: int = 200) -> MsgspecJSONResponse:
         return MsgspecJSONResponse(self, status_code=status)
@@ -50,24 +51,60 @@ class OpenAICompletionResponse(Struct):
     usage: OpenAICompletionUsage
 
 
+class OpenAICompletionChunkChoice(Struct):
+    text: str
+    index: int
+    finish_reason: str | None = None
+    logprobs: dict | None = None
+
+
+class OpenAICompletionChunk(Struct):
+    id: str
+    created: int
+    model: str
+    choices: list[OpenAICompletionChunkChoice]
+    object: str = "text_completion"
+
+
 class OpenAICompletionRequest(Struct, dict=True, kw_only=True):
     model: str
     prompt: str | list[str]
-    other_fields: Any
-    provider_config: Any
     max_tokens: int | None = None
     
-    # Canonical samplers, others are added as dict
+    # Canonical samplers
     temperature: float | None = None
     top_p: float | None = None
     frequency_penalty: float | None = None
     presence_penalty: float | None = None
 
     stop: str | list[str] | None = None
-    stream: bool = False
+    seed: int | None = None
 
-    def __post_init__(self):
-        for field in self.__struct_fields__:
-            if field in self.other_fields and (field in self.provider_config.supported_parameters or field in self.provider_config.supported_samplers):
-                setattr(self, field, self.other_fields[field])
-                del self.other_fields[field]
+    # Handled by the proxy itself, so they never depend on upstream support
+    stream: bool = False
+    n: int = 1
+
+    def drop_unsupported(self, unsupported: tuple[str, ...]):
+        """Resets the fields a model doesn't take, see `unsupported_fields`"""
+        for field in unsupported:
+            setattr(self, field, None)
+
+
+# Fields that are only honoured if the model supports them
+_GATED_FIELDS = ("max_tokens", "temperature", "top_p", "frequency_penalty", "presence_penalty", "stop", "seed")
+# OpenAI fields supported under their SLUT name
+_PARAMETER_ALIASES = {"stop": "stop_sequences", "max_tokens": "max_new_tokens"}
+
+
+def unsupported_fields(model: ModelConfig, provider: ProviderConfig) -> tuple[str, ...]:
+    """
+    The `OpenAICompletionRequest` fields a model doesn't take. The model's
+    own lists of parameters and samplers win over its provider's.
+    """
+    parameters = model.supported_parameters if model.supported_parameters else provider.supported_parameters
+    samplers = model.supported_samplers if model.supported_samplers else provider.supported_samplers
+    supported = {*parameters, *(sampler.value for sampler in samplers)}
+    return tuple(
+        field for field in _GATED_FIELDS
+        if field not in supported and _PARAMETER_ALIASES.get(field) not in supported
+    )
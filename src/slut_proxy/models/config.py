@@ -14,18 +14,112 @@ class AvailableSampler(Enum):
     TOP_P = "top_p"
     MIN_P = "min_p"
     REP_PEN = "repetition_penalty"
+    FREQ_PEN = "frequency_penalty"
+    PRES_PEN = "presence_penalty"
+
+class BalancingStrategy(Enum):
+    ROUND_ROBIN = "round_robin"
+    LEAST_OUTSTANDING = "least_outstanding"
+    PEAK_EWMA = "peak_ewma"
+    PREFIX_AFFINITY = "prefix_affinity"
+
+class UpstreamEndpoint(Struct):
+    base_url: str
+    api_key: str | None = None # falls back to the provider's key
+    weight: float = 1.0
+
+class HealthCheckConfig(Struct):
+    # Background probes, disable to rely on passive signals only
+    enabled: bool = True
+    interval: float = 10.0
+    timeout: float = 2.0
+    path: str | None = None # defaults to the provider type's cheapest endpoint
+
+    # Consecutive failures (probes or requests) before an endpoint is skipped
+    failure_threshold: int = 3
+    # How long an endpoint is skipped before a trial request is let through
+    open_duration: float = 30.0
+
+class AffinityConfig(Struct):
+    # Characters (or token ids) of the prompt that decide the upstream
+    prefix_length: int = 512
+    # An endpoint takes at most this factor over its fair share of in-flight
+    # requests before its prefixes spill over to the next one on the ring
+    load_factor: float = 1.25
+    virtual_nodes: int = 100 # ring points per unit of weight
+
+class AdmissionConfig(Struct):
+    # Generations in flight at once, the rest wait in a bounded queue
+    max_concurrency: int
+    max_queue: int = 100
+    queue_timeout: float = 30.0 # seconds before a waiting request gets a 429
+
+class RetryConfig(Struct):
+    max_attempts: int = 3
+    # Retries allowed as a fraction of requests, plus a small floor
+    budget_ratio: float = 0.2
+    min_retries_per_second: float = 1.0
 
 class ProviderConfig(Struct):
     name: str
     type: AvailableProvider
 
-    base_url: str
+    # Either a single base_url or a list of endpoints to balance across
+    base_url: str | None = None
     api_key: str | None = None
+    endpoints: list[UpstreamEndpoint] = []
+    balancing: BalancingStrategy = BalancingStrategy.ROUND_ROBIN
+    ewma_decay: float = 10.0 # seconds, for peak_ewma
+    affinity: AffinityConfig = msgspec.field(default_factory=AffinityConfig) # for prefix_affinity
+    health: HealthCheckConfig = msgspec.field(default_factory=HealthCheckConfig)
+    retry: RetryConfig = msgspec.field(default_factory=RetryConfig)
+    # Optional limit on generations in flight against this provider
+    admission: AdmissionConfig | None = None
+
+    # Upstream connection pool, shared by every request to this provider
+    max_connections: int | None = 100
+    max_keepalive_connections: int | None = 20
+    keepalive_expiry: float | None = 30.0
+    http2: bool = False # requires the `http2` extra
+    prewarm_connections: int = 0 # connections opened at startup
+    prewarm_timeout: float = 5.0 # seconds startup and reloads wait on them at most
+    connect_timeout: float = 10.0
+    timeout: float | None = 300.0
+
+    # llama.cpp: keep the KV cache of each prompt on the server between
+    # requests. The server sends a prompt to an idle slot whose cache it
+    # matches best, so prompts sharing a prefix reuse it without queueing
+    # behind each other on one slot
+    cache_prompt: bool = True
 
     # The following are optional and will only be used if models do not have their own specific configs
     supported_parameters: list[str] = []
     supported_samplers: list[AvailableSampler] = []
 
+    def __post_init__(self):
+        if self.base_url is None and not self.endpoints:
+            raise ValueError(f"Provider {self.name} needs a base_url or endpoints")
+        for endpoint in self.endpoints:
+            if endpoint.weight <= 0:
+                raise ValueError(f"Endpoint {endpoint.base_url} of provider {self.name} needs a positive weight")
+        if self.affinity.prefix_length <= 0 or self.affinity.load_factor < 1:
+            raise ValueError(f"Provider {self.name} needs a positive affinity prefix_length and a load_factor of at least 1")
+
+    def upstreams(self) -> list[UpstreamEndpoint]:
+        if self.endpoints:
+            return self.endpoints
+        return [UpstreamEndpoint(base_url=self.base_url)]  # pyright: ignore[reportArgumentType]
+
+class HedgeConfig(Struct):
+    # Seconds to wait on the first attempt before sending a second one
+    delay: float = 1.0
+    # Once enough latencies are observed, wait for this percentile instead
+    adaptive: bool = True
+    percentile: float = 0.95
+    min_delay: float = 0.05
+    # Hedges allowed as a fraction of requests, so they can't double upstream load
+    max_ratio: float = 0.1
+
 class ModelConfig(Struct):
     name: str # what is served
     model_id: str # what is requested on the provider
@@ -34,26 +128,100 @@ class ModelConfig(Struct):
     supported_parameters: list[str] | None = None
     supported_samplers: list[AvailableSampler] | None = None
 
+    # Opt-in request hedging for non-streaming generations
+    hedge: HedgeConfig | None = None
+    # Optional limit on generations in flight for this model, within the provider's
+    admission: AdmissionConfig | None = None
+
+class CacheConfig(Struct):
+    # Caches deterministic generations (temperature 0 or a fixed seed)
+    enabled: bool = False
+    max_bytes: int = 64 * 1024 * 1024
+    ttl: float | None = None # seconds
+    # Optional persistent SQLite tier that survives restarts
+    disk_path: str | None = None
+    disk_max_entries: int = 100000
+
+class UsageConfig(Struct):
+    # Per-request usage records, written behind the request path
+    enabled: bool = True
+    queue_size: int = 10000 # records beyond this are dropped rather than waited on
+    batch_size: int = 500
+    flush_interval: float = 1.0 # seconds
+    raw_retention_days: float | None = 30.0 # hourly rollups are kept forever
+
 class ProxyConfig(Struct):
     admin_key: str
 
-class Config(Struct):
+    # In-memory API key cache; revocations through the admin API apply immediately
+    auth_cache_size: int = 10000
+    auth_cache_ttl: float = 300.0
+    auth_negative_cache_size: int = 10000
+    auth_negative_cache_ttl: float = 30.0
+    # Per-key rate limit state is kept in memory and persisted this often
+    rate_limit_flush_interval: float = 10.0
+    # With several worker processes, how often they exchange key
+    # invalidations and rate limit consumption (seconds)
+    state_sync_interval: float = 0.5
+    # Read-only SQLite connections for key lookups and admin queries; writes
+    # all go through one connection
+    database_readers: int = 4
+
+    cache: CacheConfig = msgspec.field(default_factory=CacheConfig)
+    usage: UsageConfig = msgspec.field(default_factory=UsageConfig)
+    # Identical deterministic generations in flight share one upstream call
+    coalesce_requests: bool = True
+
+    # /v1/completions list prompts and n > 1 fan out into one generation per choice
+    max_completion_choices: int = 128
+    completion_fanout_concurrency: int = 8 # upstream calls in flight per request
+
+    # Phase timings are sent as a Server-Timing header (an SSE comment for streams)
+    server_timing: bool = True
+    # Requests taking longer (in seconds) are logged with their phase timings
+    slow_request_threshold: float | None = 10.0
+
+    # Larger request bodies are refused with a 413
+    max_request_body_size: int = 8 * 1024 * 1024
+
+    # Upstream pools replaced by a config reload are closed once their
+    # requests finish, or after this many seconds
+    reload_drain_timeout: float = 600.0
+
+    def __post_init__(self):
+        if self.database_readers < 1:
+            raise ValueError("proxy.database_readers needs to be at least 1")
+
+class Config(Struct, dict=True):
     proxy: ProxyConfig
     providers: list[ProviderConfig]
     models: list[ModelConfig]
 
+    def __post_init__(self):
+        # Indexed once, lookups happen several times per request; the first
+        # entry of a name wins, as it did when these were scanned
+        self._models_by_name: dict[str, ModelConfig] = {}
+        for model in self.models:
+            self._models_by_name.setdefault(model.name, model)
+        self._providers_by_name: dict[str, ProviderConfig] = {}
+        for provider in self.providers:
+            self._providers_by_name.setdefault(provider.name, provider)
+        for model in self.models:
+            if model.provider not in self._providers_by_name:
+                raise ValueError(f"Model {model.name} uses provider {model.provider}, which does not exist")
+
     @classmethod
     def from_toml(cls, filename: str) -> Self:
         return msgspec.toml.decode(open(filename).read(-1), type=cls)
 
     def get_model(self, name: str) -> ModelConfig:
-        for model in self.models:
-            if model.name == name:
-                return model
-        raise Exception(f"Model {name} does not exist!")
+        model = self._models_by_name.get(name)
+        if model is None:
+            raise KeyError(f"Model {name} does not exist!")
+        return model
 
     def get_provider(self, name: str) -> ProviderConfig:
-        for provider in self.providers:
-            if provider.name == name:
-                return provider
-        raise Exception(f"Provider {name} does not exist!")
+        provider = self._providers_by_name.get(name)
+        if provider is None:
+            raise KeyError(f"Provider {name} does not exist!")
+        return provider
@@ -4,14 +4,15 @@ import msgspec
 from msgspec import Struct as MsgStruct
 from starlette.requests import Request
 
+from ..utils.requests import DEFAULT_MAX_BODY_SIZE, decode_request
 from ..utils.responses import MsgspecJSONResponse
 from .config import AvailableSampler, ModelConfig, ProviderConfig
 
 class Struct(MsgStruct):
     @classmethod
-    async def from_request(cls, request: Request) -> Self:
-        body = await request.json()
-        return msgspec.json.decode(body, type=cls)
+    async def from_request(cls, request: Request, max_size: int = DEFAULT_MAX_BODY_SIZE) -> Self:
+        """Decodes the raw body, raising a `RequestError` if it isn't a valid one"""
+        return await decode_request(request, cls, max_size)
 
     async def to_response(self, status: int = 200) -> MsgspecJSONResponse:
         return MsgspecJSONResponse(self, status_code=status)
@@ -46,16 +47,26 @@ class Samplers(Struct):
     top_p: float | None = None
     min_p: float | None = None
     repetition_penalty: float | None = None
+    frequency_penalty: float | None = None
+    presence_penalty: float | None = None
 
 class TextGenerationRequest(Struct):
     prompt: str | list[int]
     model: str
     samplers: Samplers | None = None
     stop_sequences: list[str | int | list[int]] | None = None
+    seed: int | None = None
+    max_new_tokens: int | None = None
 
-class TextGenerationResponse(Struct):
+class Usage(Struct):
+    prompt_tokens: int
+    completion_tokens: int
+
+class TextGenerationResponse(Struct, omit_defaults=True):
     text: str
     stop_reason: StopReason
+    # Token counts, when the upstream reports them
+    usage: Usage | None = None
 
 class NewChunkEvent(Struct):
     text: str
@@ -64,6 +75,30 @@ class ApiKeyInfo(Struct):
     key: str
     allowed_providers: list[str]
     allowed_models: list[str]
+    weight: float = 1.0
+
+class ApiKeyPage(Struct):
+    data: list[ApiKeyInfo]
+    # Passed back as `cursor` for the next page, null on the last one
+    next_cursor: str | None = None
+
+class ApiKeyCreateReq(Struct):
+    allowed_providers: list[str]
+    allowed_models: list[str]
+    weight: float = 1.0
+    # Omitted or null means unlimited
+    requests_per_second: float | None = None
+    tokens_per_minute: int | None = None
+
+class ApiKeyWeightReq(Struct):
+    key: str
+    weight: float
+
+class ApiKeyRateLimitReq(Struct):
+    key: str
+    # Omitted or null lifts the limit
+    requests_per_second: float | None = None
+    tokens_per_minute: int | None = None
 
 class ApiKeyReq(Struct):
     key: str
@@ -1,49 +1,686 @@
 from abc import ABC, abstractmethod
-from typing import Dict, Any, Union
+from collections.abc import AsyncGenerator, AsyncIterator, Callable
+import contextlib
+import time
+from typing import Dict, Any, Self, TypeVar, Union
 import httpx
-from starlette.responses import JSONResponse, StreamingResponse
+import trio
 
+from .admission import AdmissionQueue
+from .balancer import Balancer, Endpoint
+from .cache import CacheStatus, ResponseCache, replay, request_key
+from .coalesce import Coalescer
+from .health import RetryBudget
+from .hedging import Hedger
+from .sse import Primed, encode_events, prime
+from .usage import UsageLog, UsageRecord
+from ..middleware import ApiKeyPermissions, RateLimiter
 from ..models.config import ProviderConfig, ModelConfig
-from ..models.slut import TextGenerationRequest, TextGenerationResponse, StopReason
+from ..models.slut import TextGenerationRequest, TextGenerationResponse, NewChunkEvent, StopReason, Usage
+from ..utils.metrics import Metrics
+from ..utils import timing
+from ..utils.responses import ClosingStreamingResponse, MsgspecJSONResponse
+from ..utils.tokens import estimate_tokens, usage_of
+
+T = TypeVar("T")
+
+# Failed requests are counted, but not charged
+_NO_USAGE = Usage(prompt_tokens=0, completion_tokens=0)
+
+
+class ProviderError(Exception):
+    """
+    An upstream failure that is reported to the client as a JSON error
+    """
+
+    def __init__(self, status_code: int, message: str, headers: dict[str, str] | None = None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.message = message
+        self.headers = headers
+
+
+class _RetryableError(Exception):
+    pass
+
+
+class EventStream:
+    """
+    The events of a streamed generation, from `BaseProvider.stream`. The
+    upstream stays open and the generation counts as in flight until
+    `aclose`, which must be called even if the events were never iterated.
+    """
+
+    __slots__ = ("_events", "_source", "_on_close", "_iterated", "_closed")
+
+    def __init__(
+        self,
+        events: AsyncGenerator[NewChunkEvent | TextGenerationResponse, None],
+        source: Primed[NewChunkEvent | TextGenerationResponse],
+        on_close: Callable[[bool], None]
+    ):
+        self._events = events
+        self._source = source
+        self._on_close = on_close
+        self._iterated = False
+        self._closed = False
+
+    def __aiter__(self) -> Self:
+        return self
+
+    async def __anext__(self) -> NewChunkEvent | TextGenerationResponse:
+        self._iterated = True
+        return await anext(self._events)
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            # The source too, `events` only closes it once started
+            await self._events.aclose()
+            await self._source.aclose()
+        finally:
+            self._on_close(self._iterated)
+
+
+def _is_retryable_status(status_code: int) -> bool:
+    return status_code >= 500 or status_code == 429
 
 
 class BaseProvider(ABC):
+    # Cheap endpoint requested when prewarming connections and probing health
+    probe_path: str = "/models"
+
     def __init__(self, config: ProviderConfig):
         self.config = config
-        self.client = httpx.AsyncClient()
-    
+        self.balancer = Balancer(config)
+        self.retry_budget = RetryBudget.from_config(config.retry)
+        self._hedgers: dict[str, Hedger] = {}
+        self.admission = AdmissionQueue(config.name, config.admission) if config.admission is not None else None
+        self.model_admission: dict[str, AdmissionQueue] = {}
+        # Shared across providers, attached by the registry
+        self.response_cache: ResponseCache | None = None
+        self.coalescer: Coalescer | None = None
+        self.rate_limiter: RateLimiter | None = None
+        self.usage_log: UsageLog | None = None
+        self.metrics: Metrics | None = None
+        # Generations being served, so a pool replaced by a reload can drain
+        self.in_flight = 0
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=config.max_connections,
+                max_keepalive_connections=config.max_keepalive_connections,
+                keepalive_expiry=config.keepalive_expiry,
+            ),
+            timeout=httpx.Timeout(config.timeout, connect=config.connect_timeout),
+            http2=config.http2,
+        )
+
     @abstractmethod
-    async def generate(
-        self, 
+    async def fetch(
+        self,
         model_config: ModelConfig,
-        request: TextGenerationRequest,
-        stream: bool = False
-    ) -> Union[TextGenerationResponse, StreamingResponse]:
+        request: TextGenerationRequest
+    ) -> TextGenerationResponse:
+        """Runs a non-streaming generation against the upstream"""
         pass
-    
+
     @abstractmethod
     def prepare_request(
-        self, 
+        self,
         model_config: ModelConfig,
         request: TextGenerationRequest
     ) -> Dict[str, Any]:
         pass
-    
+
     @abstractmethod
     def parse_response(
-        self, 
-        response_data: Dict[str, Any]
+        self,
+        response_data: bytes
     ) -> TextGenerationResponse:
         pass
-    
-    def _get_auth_headers(self) -> Dict[str, str]:
+
+    @abstractmethod
+    def stream_events(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest
+    ) -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+        """
+        Relays a streamed generation as `NewChunkEvent`s, always finishing
+        with the complete `TextGenerationResponse`
+        """
+        pass
+
+    async def complete(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest,
+        permissions: ApiKeyPermissions | None = None
+    ) -> tuple[TextGenerationResponse, CacheStatus]:
+        started = time.monotonic()
+        self.in_flight += 1
+        try:
+            result, cache_status = await self._complete(model_config, request, permissions)
+        except ProviderError as e:
+            self._record_usage(model_config, started, permissions, _NO_USAGE, e.status_code)
+            raise
+        finally:
+            self.in_flight -= 1
+        self._record_response(model_config, request, result, started, permissions)
+        return result, cache_status
+
+    async def stream(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest,
+        permissions: ApiKeyPermissions | None = None
+    ) -> tuple[EventStream, CacheStatus]:
+        """
+        Starts a streamed generation. The upstream is connected to before
+        returning, so failures surface while a proper status can still be sent.
+        """
+        started = time.monotonic()
+        self.in_flight += 1
+        try:
+            events, cache_status = await self._open_stream(model_config, request, permissions)
+        except BaseException as e:
+            self.in_flight -= 1
+            if isinstance(e, ProviderError):
+                self._record_usage(model_config, started, permissions, _NO_USAGE, e.status_code)
+            raise
+
+        def closed(iterated: bool):
+            self.in_flight -= 1
+            if not iterated:
+                # Abandoned before a single event was relayed, `_recorded` never ran
+                usage = Usage(estimate_tokens(request.prompt), 0)
+                self._record_usage(model_config, started, permissions, usage, 499)
+
+        recorded = self._recorded(events, model_config, request, started, permissions)
+        return EventStream(recorded, events, closed), cache_status
+
+    def _record_response(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest,
+        response: TextGenerationResponse,
+        started: float,
+        permissions: ApiKeyPermissions | None
+    ):
+        status = 502 if response.stop_reason == StopReason.ERROR else 200
+        self._record_usage(model_config, started, permissions, usage_of(request.prompt, response), status)
+
+    def _record_usage(
+        self,
+        model_config: ModelConfig,
+        started: float,
+        permissions: ApiKeyPermissions | None,
+        usage: Usage,
+        status: int
+    ):
+        """Accounts a generation to the key that asked for it"""
+        latency = time.monotonic() - started
+        if self.metrics is not None:
+            self.metrics.generations.labels(model_config.name, self.config.name, str(status)).inc()
+            self.metrics.latency.labels(model_config.name, self.config.name).observe(latency)
+        if permissions is not None and self.rate_limiter is not None:
+            self.rate_limiter.charge(permissions, usage.prompt_tokens + usage.completion_tokens)
+        if self.usage_log is not None:
+            self.usage_log.record(UsageRecord(
+                created_at=time.time(),
+                key_hash=permissions.key_hash if permissions is not None else "",
+                model=model_config.name,
+                provider=self.config.name,
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+                latency_ms=round(latency * 1000),
+                status=status,
+            ))
+
+    async def _recorded(
+        self,
+        events: Primed[NewChunkEvent | TextGenerationResponse],
+        model_config: ModelConfig,
+        request: TextGenerationRequest,
+        started: float,
+        permissions: ApiKeyPermissions | None
+    ) -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+        # Streams that fail or are abandoned are accounted for what was sent,
+        # 499 being nginx's status for a client that went away
+        parts: list[str] = []
+        status: int | None = 499
+        active = time_to_first_token = inter_token_latency = None
+        if self.metrics is not None:
+            labels = (model_config.name, self.config.name)
+            active = self.metrics.active_streams.labels(*labels)
+            time_to_first_token = self.metrics.time_to_first_token.labels(*labels)
+            inter_token_latency = self.metrics.inter_token_latency.labels(*labels)
+            active.inc()
+        last_chunk: float | None = None
+        try:
+            async with contextlib.aclosing(events):
+                async for event in events:
+                    if isinstance(event, TextGenerationResponse):
+                        self._record_response(model_config, request, event, started, permissions)
+                        status = None
+                    else:
+                        parts.append(event.text)
+                        if time_to_first_token is not None and inter_token_latency is not None:
+                            now = time.monotonic()
+                            if last_chunk is None:
+                                time_to_first_token.observe(now - started)
+                            else:
+                                inter_token_latency.observe(now - last_chunk)
+                            last_chunk = now
+                    yield event
+        except ProviderError as e:
+            status = e.status_code
+            raise
+        finally:
+            if active is not None:
+                active.dec()
+            if status is not None:
+                usage = Usage(estimate_tokens(request.prompt), estimate_tokens("".join(parts)))
+                self._record_usage(model_config, started, permissions, usage, status)
+
+    async def _complete(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest,
+        permissions: ApiKeyPermissions | None
+    ) -> tuple[TextGenerationResponse, CacheStatus]:
+        key = request_key(model_config, request)
+        cache = self.response_cache
+        cache_status = CacheStatus.BYPASS
+        if cache is not None and cache.admits(key):
+            assert key is not None
+            looked_up = time.monotonic()
+            cached = await cache.get(key)
+            timing.add("cache", time.monotonic() - looked_up)
+            if cached is not None:
+                return cached, CacheStatus.HIT
+            cache_status = CacheStatus.MISS
+
+        async def fetch_once() -> AsyncIterator[TextGenerationResponse]:
+            async with self._admit(model_config, permissions):
+                result = await self.fetch(model_config, request)
+            if cache is not None and cache_status is CacheStatus.MISS:
+                await cache.put(key, result)  # pyright: ignore[reportArgumentType]
+            yield result
+
+        result: TextGenerationResponse | None = None
+        async with contextlib.aclosing(self._subscribe(("complete", key), fetch_once)) as results:
+            async for result in results:
+                pass
+        assert result is not None
+        return result, cache_status
+
+    async def _open_stream(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest,
+        permissions: ApiKeyPermissions | None
+    ) -> tuple[Primed[NewChunkEvent | TextGenerationResponse], CacheStatus]:
+        key = request_key(model_config, request)
+        cache = self.response_cache
+        cache_status = CacheStatus.BYPASS
+        if cache is not None and cache.admits(key):
+            assert key is not None
+            looked_up = time.monotonic()
+            cached = await cache.get(key)
+            timing.add("cache", time.monotonic() - looked_up)
+            if cached is not None:
+                return await prime(replay(cached)), CacheStatus.HIT
+            cache_status = CacheStatus.MISS
+
+        async def admitted_events() -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+            # The slot is held until the stream ends
+            async with self._admit(model_config, permissions):
+                async with contextlib.aclosing(self.stream_events(model_config, request)) as events:
+                    async for event in events:
+                        yield event
+
+        def start() -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+            events = admitted_events()
+            if cache is not None and cache_status is CacheStatus.MISS:
+                return cache.record(key, events)  # pyright: ignore[reportArgumentType]
+            return events
+
+        return await prime(self._subscribe(("stream", key), start)), cache_status  # pyright: ignore[reportArgumentType]
+
+    @contextlib.asynccontextmanager
+    async def _admit(self, model_config: ModelConfig, permissions: ApiKeyPermissions | None) -> AsyncIterator[None]:
+        """Waits for a slot on the model's and then the provider's admission queue, if limited"""
+        key, weight = (permissions.key_hash, permissions.weight) if permissions is not None else ("", 1.0)
+        queued = time.monotonic()
+        async with contextlib.AsyncExitStack() as stack:
+            if model_config.admission is not None:
+                queue = self.model_admission.get(model_config.name)
+                if queue is None:
+                    queue = self.model_admission[model_config.name] = AdmissionQueue(model_config.name, model_config.admission)
+                await stack.enter_async_context(queue.admit(key, weight))
+            if self.admission is not None:
+                await stack.enter_async_context(self.admission.admit(key, weight))
+            if model_config.admission is not None or self.admission is not None:
+                waited = time.monotonic() - queued
+                timing.add("queue", waited)
+                if self.metrics is not None:
+                    self.metrics.queue_wait.labels(model_config.name, self.config.name).observe(waited)
+            yield
+
+    def _subscribe(self, key: tuple[str, bytes | None], start: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """Joins an identical deterministic generation already in flight, if any"""
+        if self.coalescer is None or key[1] is None:
+            return start()
+        return self.coalescer.subscribe(key, start)
+
+    async def generate(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest,
+        stream: bool = False,
+        permissions: ApiKeyPermissions | None = None
+    ) -> Union[MsgspecJSONResponse, ClosingStreamingResponse]:
+        if stream:
+            events, cache_status = await self.stream(model_config, request, permissions)
+            return ClosingStreamingResponse(
+                encode_events(events),
+                events.aclose,
+                media_type="text/event-stream",
+                headers={
+                    "Cache-Control": "no-cache",
+                    "Connection": "keep-alive",
+                    "X-Cache": cache_status.value,
+                }
+            )
+
+        result, cache_status = await self.complete(model_config, request, permissions)
+        return MsgspecJSONResponse(result, headers={"X-Cache": cache_status.value})
+
+    def _get_auth_headers(self, endpoint: Endpoint) -> Dict[str, str]:
         headers = {}
-        if self.config.api_key:
-            headers["Authorization"] = f"Bearer {self.config.api_key}"
+        if endpoint.api_key:
+            headers["Authorization"] = f"Bearer {endpoint.api_key}"
         return headers
-    
+
+    def _headers(self, endpoint: Endpoint) -> Dict[str, str]:
+        headers = self._get_auth_headers(endpoint)
+        headers["Content-Type"] = "application/json"
+        return headers
+
+    def _pick(
+        self,
+        tried: list[Endpoint],
+        last_error: Exception | None,
+        affinity_key: int | None = None
+    ) -> tuple[Endpoint, bool]:
+        """Dispatches to an endpoint, returns it and whether this is its half-open trial"""
+        endpoint = self.balancer.pick(tried, affinity_key)
+        if endpoint is None:
+            if last_error is not None:
+                raise ProviderError(502, f"Upstream request failed: {last_error!r}")
+            raise ProviderError(503, f"No healthy upstream available for provider {self.config.name}")
+        return endpoint, endpoint.circuit.on_dispatch()
+
+    def _may_retry(self, tried: list[Endpoint]) -> bool:
+        return len(tried) < self.config.retry.max_attempts and self.retry_budget.withdraw()
+
+    def _trace_extensions(self) -> dict[str, Any]:
+        # Connection setup is only traced for requests being timed
+        request_timing = timing.current_timing()
+        if request_timing is None:
+            return {}
+        return {"trace": timing.connect_tracer(request_timing)}
+
+    def _observe_upstream(self, endpoint: Endpoint, status: str):
+        if self.metrics is not None:
+            self.metrics.upstream_responses.labels(self.config.name, endpoint.base_url, status).inc()
+
+    async def _check_status(self, endpoint: Endpoint, response: httpx.Response):
+        self._observe_upstream(endpoint, str(response.status_code))
+        if response.is_success:
+            return
+        body = (await response.aread()).decode(errors="replace")
+        if _is_retryable_status(response.status_code):
+            raise _RetryableError(f"upstream returned {response.status_code}: {body}")
+        # The upstream is fine, the request isn't
+        endpoint.record_success()
+        raise ProviderError(response.status_code, f"Upstream rejected the request: {body}")
+
+    async def _post(
+        self,
+        path: str,
+        content: bytes,
+        tried: list[Endpoint] | None = None,
+        affinity_key: int | None = None,
+        hedge: bool = False
+    ) -> httpx.Response:
+        """
+        POSTs to an upstream endpoint, moving on to other endpoints on
+        connection errors and 5xx/429 responses while the retry budget allows.
+        Endpoints are appended to `tried` as they are attempted. A `hedge`
+        attempt is extra load already, it neither earns retries nor retries.
+        """
+        if not hedge:
+            self.retry_budget.deposit()
+        if tried is None:
+            tried = []
+        last_error: Exception | None = None
+        while True:
+            endpoint, trial = self._pick(tried, last_error, affinity_key)
+            tried.append(endpoint)
+            started = endpoint.acquire()
+            try:
+                response = await self.client.post(
+                    f"{endpoint.base_url}{path}",
+                    content=content,
+                    headers=self._headers(endpoint),
+                    extensions=self._trace_extensions()
+                )
+                endpoint.observe(started, self.balancer.decay)
+                timing.add("upstream", time.monotonic() - started)
+                await self._check_status(endpoint, response)
+            except (httpx.TransportError, _RetryableError) as e:
+                if isinstance(e, httpx.TransportError):
+                    self._observe_upstream(endpoint, "error")
+                endpoint.record_failure(repr(e))
+                if hedge or not self._may_retry(tried):
+                    raise ProviderError(502, f"Upstream request failed: {e!r}")
+                last_error = e
+                continue
+            finally:
+                endpoint.release()
+                # A trial cancelled before its outcome must not block the endpoint for good
+                if trial:
+                    endpoint.circuit.abandon_trial()
+
+            endpoint.record_success()
+            return response
+
+    async def _post_hedged(
+        self,
+        model_config: ModelConfig,
+        path: str,
+        content: bytes,
+        affinity_key: int | None = None
+    ) -> httpx.Response:
+        """
+        `_post` with optional hedging: if the first attempt hasn't answered
+        within the model's hedge delay, a second one is sent to another
+        endpoint. The first response wins and the other attempt is cancelled.
+        """
+        if model_config.hedge is None or len(self.balancer.endpoints) < 2:
+            return await self._post(path, content, affinity_key=affinity_key)
+
+        hedger = self._hedgers.get(model_config.name)
+        if hedger is None:
+            hedger = self._hedgers[model_config.name] = Hedger(model_config.hedge)
+
+        hedger.begin()
+        primary_tried: list[Endpoint] = []
+        primary_done = trio.Event()
+        winner: httpx.Response | None = None
+        errors: list[ProviderError] = []
+
+        async def attempt(tried: list[Endpoint], primary: bool):
+            nonlocal winner
+            started = time.monotonic()
+            failed = False
+            try:
+                response = await self._post(path, content, tried, affinity_key, hedge=not primary)
+            except ProviderError as e:
+                failed = True
+                errors.append(e)
+                return
+            finally:
+                if primary:
+                    primary_done.set()
+                    # Only the primary is observed, and also when a hedge won and
+                    # cancelled it, or the delay would only ever learn fast answers
+                    if not failed:
+                        hedger.latencies.observe(time.monotonic() - started)
+
+            if winner is None:
+                winner = response
+                nursery.cancel_scope.cancel()
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(attempt, primary_tried, True)
+            with trio.move_on_after(hedger.delay()):
+                await primary_done.wait()
+            if not primary_done.is_set() and hedger.may_hedge():
+                if self.metrics is not None:
+                    self.metrics.hedges.labels(model_config.name, self.config.name).inc()
+                # Start from the endpoints the first attempt already used
+                nursery.start_soon(attempt, list(primary_tried), False)
+
+        if winner is None:
+            raise errors[0]
+        return winner
+
+    @contextlib.asynccontextmanager
+    async def _stream(self, path: str, content: bytes, affinity_key: int | None = None) -> AsyncIterator[httpx.Response]:
+        """
+        Opens a streamed POST with the same retry rules as `_post`. Retries
+        only happen until the response is handed out; once the caller starts
+        relaying the body, failures are final.
+        """
+        self.retry_budget.deposit()
+        tried: list[Endpoint] = []
+        last_error: Exception | None = None
+        while True:
+            endpoint, trial = self._pick(tried, last_error, affinity_key)
+            tried.append(endpoint)
+            started = endpoint.acquire()
+            relaying = False
+            try:
+                async with self.client.stream(
+                    "POST",
+                    f"{endpoint.base_url}{path}",
+                    content=content,
+                    headers=self._headers(endpoint),
+                    extensions=self._trace_extensions()
+                ) as response:
+                    # Streams are balanced on time to first byte
+                    endpoint.observe(started, self.balancer.decay)
+                    relay_started = time.monotonic()
+                    timing.add("ttfb", relay_started - started)
+                    await self._check_status(endpoint, response)
+
+                    relaying = True
+                    try:
+                        yield response
+                    finally:
+                        timing.add("relay", time.monotonic() - relay_started)
+                endpoint.record_success()
+                return
+            except (httpx.TransportError, _RetryableError) as e:
+                if isinstance(e, httpx.TransportError):
+                    self._observe_upstream(endpoint, "error")
+                endpoint.record_failure(repr(e))
+                if relaying:
+                    raise ProviderError(502, f"Upstream stream failed: {e!r}")
+                if not self._may_retry(tried):
+                    raise ProviderError(502, f"Upstream request failed: {e!r}")
+                last_error = e
+            finally:
+                endpoint.release()
+                # A trial cancelled before its outcome must not block the endpoint for good
+                if trial:
+                    endpoint.circuit.abandon_trial()
+
+    async def _probe(self, endpoint: Endpoint):
+        health = self.config.health
+        try:
+            response = await self.client.get(
+                f"{endpoint.base_url}{health.path or self.probe_path}",
+                headers=self._get_auth_headers(endpoint),
+                timeout=health.timeout
+            )
+        except httpx.HTTPError as e:
+            endpoint.record_failure(f"health check failed: {e!r}")
+            return
+
+        if _is_retryable_status(response.status_code):
+            endpoint.record_failure(f"health check returned {response.status_code}")
+        else:
+            endpoint.record_success()
+
+    async def run_health_checks(self):
+        """Probes every endpoint each `health.interval` seconds, forever"""
+        if not self.config.health.enabled:
+            return
+        while True:
+            async with trio.open_nursery() as nursery:
+                for endpoint in self.balancer.endpoints:
+                    nursery.start_soon(self._probe, endpoint)
+            await trio.sleep(self.config.health.interval)
+
+    async def prewarm(self):
+        """
+        Open `prewarm_connections` keep-alive connections to every upstream
+        endpoint, giving up after `prewarm_timeout` seconds
+        """
+        async def connect(endpoint: Endpoint):
+            try:
+                _ = await self.client.get(
+                    f"{endpoint.base_url}{self.probe_path}",
+                    headers=self._get_auth_headers(endpoint)
+                )
+            except httpx.HTTPError as e:
+                print(f"Failed to prewarm connection to {endpoint.base_url} ({self.config.name}): {e!r}")
+
+        # Concurrent requests force distinct connections into the pool. A slow
+        # upstream must not hold up startup or a reload for a whole request timeout
+        with trio.move_on_after(self.config.prewarm_timeout) as scope:
+            async with trio.open_nursery() as nursery:
+                for endpoint in self.balancer.endpoints:
+                    for _ in range(self.config.prewarm_connections):
+                        nursery.start_soon(connect, endpoint)
+        if scope.cancelled_caught:
+            print(f"Gave up prewarming connections for {self.config.name} after {self.config.prewarm_timeout}s")
+
+    async def drain(self, timeout: float):
+        """
+        Closes the upstream pool once generations in flight are done, or
+        after `timeout` seconds. Used on providers a reload replaced.
+        """
+        with trio.move_on_after(timeout):
+            while True:
+                # Also gives requests that picked this provider right before
+                # it was replaced the time to get going
+                await trio.sleep(1)
+                if self.in_flight == 0:
+                    break
+        await self.aclose()
+
+    async def aclose(self):
+        await self.client.aclose()
+
     async def __aenter__(self):
         return self
-    
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.client.aclose()
\ No newline at end of file
+        await self.aclose()
@@ -0,0 +1,133 @@
+from collections.abc import AsyncIterator
+import contextlib
+import heapq
+import itertools
+import math
+import time
+
+import msgspec
+import trio
+
+from ..models.config import AdmissionConfig
+
+
+class AdmissionStats(msgspec.Struct):
+    active: int = 0
+    waiting: int = 0
+    admitted: int = 0
+    # Shed because the queue was full
+    rejected: int = 0
+    # Gave up after waiting `queue_timeout`
+    timed_out: int = 0
+
+
+class _Waiter:
+    __slots__ = ("event", "admitted", "abandoned")
+
+    def __init__(self):
+        self.event = trio.Event()
+        self.admitted = False
+        self.abandoned = False
+
+
+class AdmissionQueue:
+    """
+    Concurrency limit with a bounded wait queue in front of it.
+
+    Waiting requests are served by weighted fair queuing across API keys:
+    each request gets a virtual finish tag of `1 / weight` past the later of
+    the queue's virtual time and its key's previous tag, and the smallest
+    tag goes first. A key flooding the queue only pushes its own tags back,
+    so light keys still get through at their share.
+    """
+
+    def __init__(self, name: str, config: AdmissionConfig):
+        self.name = name
+        self.config = config
+        self.stats = AdmissionStats()
+
+        self._queue: list[tuple[float, int, _Waiter]] = []
+        self._sequence = itertools.count()
+        self._virtual_time = 0.0
+        self._finish_tags: dict[str, float] = {}
+        self._hold_time = 1.0 # seconds, EWMA of how long a slot is held
+
+    @contextlib.asynccontextmanager
+    async def admit(self, key: str, weight: float) -> AsyncIterator[None]:
+        """
+        Holds a slot for the duration of the block, raising a 429
+        `ProviderError` if the queue is full or the wait times out
+        """
+        if self.stats.active < self.config.max_concurrency and self.stats.waiting == 0:
+            self.stats.active += 1
+        else:
+            await self._wait(key, weight)
+        self.stats.admitted += 1
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_time += 0.2 * (time.monotonic() - started - self._hold_time)
+            self._release()
+
+    def retry_after(self) -> int:
+        """Seconds until the queue has likely drained enough to take a request"""
+        return max(1, math.ceil((self.stats.waiting + 1) * self._hold_time / self.config.max_concurrency))
+
+    def _rejection(self, message: str):
+        from . import ProviderError
+        return ProviderError(429, message, headers={"Retry-After": str(self.retry_after())})
+
+    async def _wait(self, key: str, weight: float):
+        if self.stats.waiting >= self.config.max_queue:
+            self.stats.rejected += 1
+            raise self._rejection(f"Too many requests queued for {self.name}")
+
+        tag = max(self._virtual_time, self._finish_tags.get(key, 0.0)) + 1.0 / weight
+        self._finish_tags[key] = tag
+        waiter = _Waiter()
+        heapq.heappush(self._queue, (tag, next(self._sequence), waiter))
+        self.stats.waiting += 1
+
+        try:
+            with trio.move_on_after(self.config.queue_timeout):
+                await waiter.event.wait()
+        except BaseException:
+            # Cancelled right as a slot was handed over, pass it on
+            if waiter.admitted:
+                self._release()
+            else:
+                self._abandon(waiter)
+            raise
+
+        if not waiter.admitted:
+            self._abandon(waiter)
+            self.stats.timed_out += 1
+            raise self._rejection(f"Timed out waiting for capacity on {self.name}")
+
+    def _abandon(self, waiter: _Waiter):
+        # Left in the heap and skipped once it comes up
+        waiter.abandoned = True
+        self.stats.waiting -= 1
+        self._forget_if_idle()
+
+    def _release(self):
+        self.stats.active -= 1
+        while self._queue:
+            tag, _, waiter = heapq.heappop(self._queue)
+            if waiter.abandoned:
+                continue
+            self._virtual_time = tag
+            waiter.admitted = True
+            self.stats.waiting -= 1
+            self.stats.active += 1
+            waiter.event.set()
+            break
+        self._forget_if_idle()
+
+    def _forget_if_idle(self):
+        # Tags only order requests that wait together, keep them bounded
+        if self.stats.waiting == 0:
+            self._queue.clear()
+            self._finish_tags.clear()
@@ -0,0 +1,99 @@
+from array import array
+from bisect import bisect
+from collections.abc import Collection
+import hashlib
+import math
+from typing import TYPE_CHECKING
+
+import msgspec
+
+from ..models.config import AffinityConfig
+
+if TYPE_CHECKING:
+    from .balancer import Endpoint
+
+
+def _hash(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def prefix_key(prompt: str | list[int], prefix_length: int) -> int:
+    """Hash of the first `prefix_length` characters or token ids of a prompt"""
+    if isinstance(prompt, str):
+        return _hash(b"s" + prompt[:prefix_length].encode())
+    return _hash(b"t" + array("q", prompt[:prefix_length]).tobytes())
+
+
+class AffinityStats(msgspec.Struct):
+    # Requests sent to the endpoint owning their prefix on the ring
+    hits: int = 0
+    # Requests moved to another endpoint because the owner was over its load bound
+    load_spills: int = 0
+    # Requests moved to another endpoint because the owner was unhealthy
+    health_spills: int = 0
+
+
+class PrefixAffinity:
+    """
+    Consistent hashing with bounded loads over a provider's endpoints.
+
+    Requests sharing a prompt prefix land on the same endpoint, so upstreams
+    can reuse the KV cache built for it. Each endpoint takes at most
+    `load_factor` times its weighted share of in-flight requests; past that,
+    its prefixes walk the ring to the next endpoint with room.
+    """
+
+    def __init__(self, config: AffinityConfig, endpoints: list["Endpoint"]):
+        self.prefix_length = config.prefix_length
+        self.load_factor = config.load_factor
+        self.endpoints = endpoints
+        self.stats = AffinityStats()
+        self._total_weight = sum(endpoint.weight for endpoint in endpoints)
+
+        ring: list[tuple[int, int]] = []
+        for index, endpoint in enumerate(endpoints):
+            for replica in range(max(1, round(config.virtual_nodes * endpoint.weight))):
+                ring.append((_hash(f"{endpoint.base_url}#{replica}".encode()), index))
+        ring.sort()
+        self._points = [point for point, _ in ring]
+        self._owners = [index for _, index in ring]
+
+    def key(self, prompt: str | list[int]) -> int:
+        return prefix_key(prompt, self.prefix_length)
+
+    def _capacity(self, endpoint: "Endpoint", in_flight: int) -> int:
+        return math.ceil(self.load_factor * (in_flight + 1) * endpoint.weight / self._total_weight)
+
+    def choose(self, key: int, candidates: Collection["Endpoint"], count: bool = True) -> "Endpoint | None":
+        """
+        Walks the ring from `key` to the first candidate below its load bound.
+        Returns `None` if no candidate has room.
+        """
+        in_flight = sum(endpoint.outstanding for endpoint in self.endpoints)
+        start = bisect(self._points, key)
+        size = len(self._owners)
+
+        owner: "Endpoint | None" = None
+        seen: set[int] = set()
+        for offset in range(size):
+            index = self._owners[(start + offset) % size]
+            if index in seen:
+                if len(seen) == len(self.endpoints):
+                    break
+                continue
+            seen.add(index)
+            endpoint = self.endpoints[index]
+            if owner is None:
+                owner = endpoint
+            if endpoint not in candidates or endpoint.outstanding >= self._capacity(endpoint, in_flight):
+                continue
+
+            if count:
+                if endpoint is owner:
+                    self.stats.hits += 1
+                elif owner in candidates:
+                    self.stats.load_spills += 1
+                else:
+                    self.stats.health_spills += 1
+            return endpoint
+        return None
@@ -0,0 +1,121 @@
+from collections.abc import Collection
+import math
+import random
+import time
+
+from .affinity import PrefixAffinity
+from .health import CircuitBreaker, CircuitState
+from ..models.config import BalancingStrategy, HealthCheckConfig, ProviderConfig, UpstreamEndpoint
+
+
+class Endpoint:
+    """
+    One upstream server of a provider, with the in-memory load signals the
+    balancer picks on
+    """
+
+    __slots__ = ("base_url", "api_key", "weight", "circuit", "outstanding", "ewma", "_last_observed", "_current_weight")
+
+    def __init__(self, config: UpstreamEndpoint, default_api_key: str | None, health: HealthCheckConfig):
+        self.base_url = config.base_url
+        self.api_key = config.api_key if config.api_key is not None else default_api_key
+        self.weight = config.weight
+        self.circuit = CircuitBreaker(health)
+
+        self.outstanding = 0
+        self.ewma = 0.0 # seconds
+        self._last_observed = time.monotonic()
+        self._current_weight = 0.0 # smooth weighted round robin state
+
+    def acquire(self) -> float:
+        """Marks a request as in flight, returns its start time"""
+        self.outstanding += 1
+        return time.monotonic()
+
+    def release(self):
+        self.outstanding -= 1
+
+    def observe(self, started: float, decay: float):
+        """
+        Feeds a latency sample into the peak-sensitive EWMA: a slower sample
+        replaces the average outright, faster ones decay it over `decay` seconds
+        """
+        now = time.monotonic()
+        rtt = now - started
+        if rtt > self.ewma:
+            self.ewma = rtt
+        else:
+            w = math.exp(-(now - self._last_observed) / decay)
+            self.ewma = self.ewma * w + rtt * (1 - w)
+        self._last_observed = now
+
+    def record_success(self):
+        if self.circuit.state is not CircuitState.CLOSED:
+            print(f"Upstream {self.base_url} recovered")
+        self.circuit.record_success()
+
+    def record_failure(self, reason: str):
+        if self.circuit.record_failure():
+            print(f"Upstream {self.base_url} marked unhealthy: {reason}")
+
+    def cost(self) -> float:
+        return self.ewma * (self.outstanding + 1) / self.weight
+
+
+class Balancer:
+    def __init__(self, config: ProviderConfig):
+        self.strategy = config.balancing
+        self.decay = config.ewma_decay
+        self.endpoints = [Endpoint(upstream, config.api_key, config.health) for upstream in config.upstreams()]
+        self._offset = 0 # rotates ties for least_outstanding
+        self.affinity = (
+            PrefixAffinity(config.affinity, self.endpoints)
+            if self.strategy is BalancingStrategy.PREFIX_AFFINITY else None
+        )
+
+    def affinity_key(self, prompt: str | list[int]) -> int | None:
+        """The routing key of a prompt, `None` unless balancing on prefix affinity"""
+        if self.affinity is None or len(self.endpoints) < 2:
+            return None
+        return self.affinity.key(prompt)
+
+    def pick(self, exclude: Collection[Endpoint] = (), affinity_key: int | None = None) -> Endpoint | None:
+        """
+        Chooses an endpoint among those with a closed (or trial-ready) circuit,
+        returns `None` if every endpoint is unhealthy or excluded. The caller
+        dispatches to it with `circuit.on_dispatch()`.
+        """
+        endpoints = [e for e in self.endpoints if e.circuit.available() and e not in exclude]
+        if not endpoints:
+            return None
+
+        endpoint = None
+        if self.affinity is not None and affinity_key is not None:
+            # Retries and hedges are already off the preferred endpoint, keep them out of the stats
+            endpoint = self.affinity.choose(affinity_key, endpoints, count=not exclude)
+        if endpoint is None:
+            endpoint = self._choose(endpoints)
+        return endpoint
+
+    def _choose(self, endpoints: list[Endpoint]) -> Endpoint:
+        if len(endpoints) == 1:
+            return endpoints[0]
+
+        if self.strategy in (BalancingStrategy.LEAST_OUTSTANDING, BalancingStrategy.PREFIX_AFFINITY):
+            self._offset = (self._offset + 1) % len(endpoints)
+            rotated = endpoints[self._offset:] + endpoints[:self._offset]
+            return min(rotated, key=lambda e: (e.outstanding + 1) / e.weight)
+
+        if self.strategy is BalancingStrategy.PEAK_EWMA:
+            # Power of two choices, weighted so heavier endpoints are sampled more
+            a, b = random.choices(endpoints, weights=[e.weight for e in endpoints], k=2)
+            return a if a.cost() <= b.cost() else b
+
+        # Smooth weighted round robin, spreads heavy endpoints evenly over the cycle
+        best = endpoints[0]
+        for endpoint in endpoints:
+            endpoint._current_weight += endpoint.weight
+            if endpoint._current_weight > best._current_weight:
+                best = endpoint
+        best._current_weight -= sum(endpoint.weight for endpoint in endpoints)
+        return best
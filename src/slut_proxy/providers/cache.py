@@ -0,0 +1,190 @@
+from collections import OrderedDict
+from collections.abc import AsyncIterator
+import contextlib
+from enum import Enum
+import hashlib
+import time
+
+import anyio_sqlite
+import msgspec
+
+from ..models.config import CacheConfig, ModelConfig
+from ..models.slut import TextGenerationRequest, TextGenerationResponse, NewChunkEvent, StopReason
+
+# Rough per-entry bookkeeping cost on top of key and value bytes
+_ENTRY_OVERHEAD = 128
+
+_encoder = msgspec.json.Encoder()
+_response_decoder = msgspec.json.Decoder(TextGenerationResponse)
+
+
+class CacheStatus(Enum):
+    HIT = "HIT"
+    MISS = "MISS"
+    BYPASS = "BYPASS"
+
+
+def is_deterministic(request: TextGenerationRequest) -> bool:
+    if request.seed is not None:
+        return True
+    return request.samplers is not None and request.samplers.temperature == 0
+
+
+def request_key(model_config: ModelConfig, request: TextGenerationRequest) -> bytes | None:
+    """
+    Canonical hash of the upstream model, prompt, samplers, seed, stop
+    sequences and token limit of a request, or `None` if the request isn't
+    deterministic
+    """
+    if not is_deterministic(request):
+        return None
+    canonical = _encoder.encode((
+        model_config.provider,
+        model_config.model_id,
+        request.prompt,
+        request.samplers,
+        request.seed,
+        request.stop_sequences,
+        request.max_new_tokens,
+    ))
+    return hashlib.blake2b(canonical, digest_size=16).digest()
+
+
+class CacheStats(msgspec.Struct):
+    hits: int = 0
+    misses: int = 0
+    bypasses: int = 0
+    disk_hits: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+
+class ResponseCache:
+    """
+    Cache of deterministic generations, keyed on `request_key`.
+
+    Entries live in an in-memory LRU bounded by `max_bytes`, backed by an
+    optional SQLite tier that survives restarts.
+    """
+
+    def __init__(self, config: CacheConfig):
+        self.config = config
+        self.stats = CacheStats()
+
+        self._entries: OrderedDict[bytes, tuple[float | None, bytes]] = OrderedDict()
+        self._disk: anyio_sqlite.Connection | None = None  # pyright: ignore[reportMissingTypeArgument]
+        self._disk_writes = 0
+        self._exit_stack = contextlib.AsyncExitStack()
+
+    async def __aenter__(self):
+        if not self.config.enabled or self.config.disk_path is None:
+            return self
+        self._disk = await self._exit_stack.enter_async_context(
+            anyio_sqlite.connect(self.config.disk_path, isolation_level=None)
+        )
+        await self._disk.execute("""
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key BLOB PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                created_at REAL NOT NULL
+            )
+        """)
+        await self._disk.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_created ON response_cache(created_at)")
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self._disk = None
+        await self._exit_stack.aclose()
+
+    def admits(self, key: bytes | None) -> bool:
+        """Whether a request with this key can be served from the cache, counting bypasses"""
+        if not self.config.enabled or key is None:
+            self.stats.bypasses += 1
+            return False
+        return True
+
+    async def get(self, key: bytes) -> TextGenerationResponse | None:
+        now = time.time()
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at is None or expires_at > now:
+                self._entries.move_to_end(key)
+                self.stats.hits += 1
+                return _response_decoder.decode(value)
+            self._evict(key)
+
+        if self._disk is not None:
+            async with await self._disk.execute(
+                "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+            ) as cur:
+                row = await cur.fetchone()
+            if row and (row[1] is None or row[1] > now):
+                self._remember(key, row[1], row[0])
+                self.stats.hits += 1
+                self.stats.disk_hits += 1
+                return _response_decoder.decode(row[0])
+
+        self.stats.misses += 1
+        return None
+
+    async def put(self, key: bytes, response: TextGenerationResponse):
+        if response.stop_reason is StopReason.ERROR:
+            return
+
+        now = time.time()
+        expires_at = now + self.config.ttl if self.config.ttl is not None else None
+        value = _encoder.encode(response)
+        self._remember(key, expires_at, value)
+
+        if self._disk is not None:
+            await self._disk.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at, created_at) VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now)
+            )
+            self._disk_writes += 1
+            if self._disk_writes % 1000 == 0:
+                await self._trim_disk()
+
+    async def record(self, key: bytes, events: AsyncIterator[NewChunkEvent | TextGenerationResponse]) -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+        """Passes a stream through, caching its final response"""
+        async with contextlib.aclosing(events):  # pyright: ignore[reportArgumentType]
+            async for event in events:
+                if isinstance(event, TextGenerationResponse):
+                    await self.put(key, event)
+                yield event
+
+    async def _trim_disk(self):
+        assert self._disk is not None
+        await self._disk.execute("DELETE FROM response_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+        await self._disk.execute(
+            "DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.config.disk_max_entries,)
+        )
+
+    def _remember(self, key: bytes, expires_at: float | None, value: bytes):
+        size = len(key) + len(value) + _ENTRY_OVERHEAD
+        if size > self.config.max_bytes:
+            return
+        if key in self._entries:
+            self._evict(key)
+
+        self._entries[key] = (expires_at, value)
+        self.stats.entries += 1
+        self.stats.bytes += size
+        while self.stats.bytes > self.config.max_bytes:
+            self._evict(next(iter(self._entries)))
+
+    def _evict(self, key: bytes):
+        _, value = self._entries.pop(key)
+        self.stats.entries -= 1
+        self.stats.bytes -= len(key) + len(value) + _ENTRY_OVERHEAD
+
+
+async def replay(response: TextGenerationResponse) -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+    """Replays a cached response as a stream"""
+    if response.text:
+        yield NewChunkEvent(text=response.text)
+    yield response
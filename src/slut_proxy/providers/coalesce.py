@@ -0,0 +1,123 @@
+from collections.abc import AsyncIterator, Callable, Hashable
+import contextlib
+from typing import Generic, TypeVar
+
+import msgspec
+import trio
+
+T = TypeVar("T")
+
+
+class CoalescingStats(msgspec.Struct):
+    # Upstream calls started
+    flights: int = 0
+    # Requests that attached to a call already in flight instead
+    joined: int = 0
+    # Calls cancelled because every subscriber left
+    abandoned: int = 0
+
+
+class _Flight(Generic[T]):
+    __slots__ = ("events", "done", "error", "subscribers", "cancel_scope", "_changed")
+
+    def __init__(self):
+        self.events: list[T] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.subscribers = 0
+        self.cancel_scope = trio.CancelScope()
+        self._changed = trio.Event()
+
+    def notify(self):
+        self._changed.set()
+        self._changed = trio.Event()
+
+    async def wait(self):
+        await self._changed.wait()
+
+
+class Coalescer:
+    """
+    Singleflight for identical in-flight generations.
+
+    The first request for a key starts the upstream call in a background
+    task; later ones subscribe to it. Every subscriber replays the events
+    buffered so far, then follows the live ones. The call is cancelled only
+    once its last subscriber has left.
+    """
+
+    def __init__(self):
+        self.stats = CoalescingStats()
+        self._flights: dict[Hashable, _Flight] = {}  # pyright: ignore[reportMissingTypeArgument]
+        self._nursery: trio.Nursery | None = None
+
+    async def run(self, task_status: trio.TaskStatus[None] = trio.TASK_STATUS_IGNORED):
+        """Hosts the upstream calls, until cancelled"""
+        async with trio.open_nursery() as nursery:
+            self._nursery = nursery
+            task_status.started()
+            try:
+                await trio.sleep_forever()
+            finally:
+                self._nursery = None
+
+    def subscribe(self, key: Hashable | None, start: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+        """
+        Follows the call for `key`, using `start` to begin it if none is in
+        flight. A `None` key, or a coalescer that isn't running, just calls `start`.
+        """
+        if key is None or self._nursery is None:
+            return start()
+
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight()
+            self._nursery.start_soon(self._fly, key, flight, start)
+            self.stats.flights += 1
+        else:
+            self.stats.joined += 1
+        # Counted right away, so nobody leaving in between cancels the call
+        flight.subscribers += 1
+        return self._follow(key, flight)
+
+    async def _fly(self, key: Hashable, flight: _Flight[T], start: Callable[[], AsyncIterator[T]]):
+        from . import ProviderError
+
+        completed = False
+        try:
+            with flight.cancel_scope:
+                async with contextlib.aclosing(start()) as events:  # pyright: ignore[reportArgumentType]
+                    async for event in events:
+                        flight.events.append(event)
+                        flight.notify()
+                completed = True
+        except Exception as e:
+            flight.error = e
+        finally:
+            if not completed and flight.error is None:
+                flight.error = ProviderError(503, "Generation was cancelled")
+            flight.done = True
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+            flight.notify()
+
+    async def _follow(self, key: Hashable, flight: _Flight[T]) -> AsyncIterator[T]:
+        index = 0
+        try:
+            while True:
+                while index < len(flight.events):
+                    yield flight.events[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.wait()
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                self.stats.abandoned += 1
+                flight.cancel_scope.cancel()
+                # A new request for the key starts over instead of joining a dying call
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
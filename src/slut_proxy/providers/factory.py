@@ -1,8 +1,12 @@
 from . import BaseProvider
+from .llama_cpp import LlamaCppProvider
 from .openai import OpenAIProvider
+from ..models.config import AvailableProvider
 
 def create_provider(config):
-    if config.type.value == "openai":
+    if config.type is AvailableProvider.OPENAI_COMPATIBLE:
         return OpenAIProvider(config)
+    elif config.type is AvailableProvider.LLAMA_CPP:
+        return LlamaCppProvider(config)
     else:
-        raise ValueError(f"Unsupported provider type: {config.type}")
\ No newline at end of file
+        raise ValueError(f"Unsupported provider type: {config.type}")
@@ -0,0 +1,115 @@
+import time
+from enum import Enum
+
+from ..models.config import HealthCheckConfig, RetryConfig
+
+
+class CircuitState(Enum):
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint circuit breaker.
+
+    Closed endpoints take traffic. After `failure_threshold` consecutive
+    failures the circuit opens and the endpoint is skipped without costing a
+    timeout. Once `open_duration` has passed a single trial request is let
+    through (half-open); its outcome closes or re-opens the circuit.
+    """
+
+    __slots__ = ("failure_threshold", "open_duration", "state", "failures", "_opened_at", "_trial_in_flight")
+
+    def __init__(self, config: HealthCheckConfig):
+        self.failure_threshold = config.failure_threshold
+        self.open_duration = config.open_duration
+
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+
+    def available(self) -> bool:
+        """Whether a request may be sent now, without side effects"""
+        if self.state is CircuitState.CLOSED:
+            return True
+        if self.state is CircuitState.OPEN:
+            return time.monotonic() - self._opened_at >= self.open_duration
+        return not self._trial_in_flight
+
+    def on_dispatch(self) -> bool:
+        """
+        Called once a request has been routed to this endpoint, returns
+        whether it is the half-open trial
+        """
+        if self.state is CircuitState.OPEN:
+            self.state = CircuitState.HALF_OPEN
+        if self.state is CircuitState.HALF_OPEN:
+            self._trial_in_flight = True
+            return True
+        return False
+
+    def abandon_trial(self):
+        """
+        Called once the trial request is done with this endpoint. A trial that
+        ended without an outcome (cancelled, or failing for reasons of its
+        own) lets the next request try instead
+        """
+        self._trial_in_flight = False
+
+    def record_success(self):
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self._trial_in_flight = False
+
+    def record_failure(self) -> bool:
+        """Returns whether this failure opened the circuit"""
+        self.failures += 1
+        self._trial_in_flight = False
+        if self.state is CircuitState.HALF_OPEN or self.failures >= self.failure_threshold:
+            opened = self.state is not CircuitState.OPEN
+            self.state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+            return opened
+        return False
+
+
+class RetryBudget:
+    """
+    Token bucket limiting retries to a fraction of the request rate, so a
+    struggling upstream doesn't get its load multiplied by retries.
+
+    Every request deposits `budget_ratio` tokens, the bucket also refills
+    at `min_retries_per_second`, and each retry withdraws a whole token.
+    """
+
+    __slots__ = ("ratio", "min_per_second", "max_tokens", "tokens", "_last_refill")
+
+    def __init__(self, ratio: float, min_per_second: float, max_tokens: float | None = None):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        # Roughly ten seconds worth of the floor, so bursts can't bank retries
+        self.max_tokens = max_tokens if max_tokens is not None else max(10.0 * min_per_second, 1.0)
+        self.tokens = self.max_tokens
+        self._last_refill = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config: RetryConfig) -> "RetryBudget":
+        return cls(config.budget_ratio, config.min_retries_per_second)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + (now - self._last_refill) * self.min_per_second)
+        self._last_refill = now
+
+    def deposit(self):
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        self._refill()
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            return True
+        return False
@@ -0,0 +1,62 @@
+from .health import RetryBudget
+from ..models.config import HedgeConfig
+
+
+class LatencyTracker:
+    """
+    Ring buffer of recent latencies with a lazily refreshed percentile
+    """
+
+    def __init__(self, percentile: float, size: int = 256, refresh_every: int = 32):
+        self.percentile = percentile
+        self.size = size
+        self.refresh_every = refresh_every
+
+        self._samples: list[float] = []
+        self._next = 0
+        self._since_refresh = 0
+        self._cached: float | None = None
+
+    def observe(self, latency: float):
+        if len(self._samples) < self.size:
+            self._samples.append(latency)
+        else:
+            self._samples[self._next] = latency
+            self._next = (self._next + 1) % self.size
+        self._since_refresh += 1
+
+    def value(self, min_samples: int = 20) -> float | None:
+        if len(self._samples) < min_samples:
+            return None
+        if self._cached is None or self._since_refresh >= self.refresh_every:
+            ordered = sorted(self._samples)
+            self._cached = ordered[min(len(ordered) - 1, int(len(ordered) * self.percentile))]
+            self._since_refresh = 0
+        return self._cached
+
+
+class Hedger:
+    """
+    Per-model hedging state: when to hedge, and whether the hedge rate cap
+    still has room
+    """
+
+    def __init__(self, config: HedgeConfig):
+        self.config = config
+        self.latencies = LatencyTracker(config.percentile)
+        # Every request earns `max_ratio` of a hedge; no floor
+        self.budget = RetryBudget(config.max_ratio, 0.0, max_tokens=max(1.0, 10.0 * config.max_ratio))
+
+    def delay(self) -> float:
+        if self.config.adaptive:
+            observed = self.latencies.value()
+            if observed is not None:
+                return max(self.config.min_delay, observed)
+        return self.config.delay
+
+    def begin(self):
+        """Called for every request that may be hedged, earns it hedge budget"""
+        self.budget.deposit()
+
+    def may_hedge(self) -> bool:
+        return self.budget.withdraw()
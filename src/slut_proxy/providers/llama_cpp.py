@@ -0,0 +1,144 @@
+from collections.abc import AsyncIterator
+from typing import Dict, Any
+import msgspec
+from msgspec import Struct
+
+from . import BaseProvider, ProviderError
+from .sse import iter_sse_data
+from ..models.config import ModelConfig
+from ..models.slut import TextGenerationRequest, TextGenerationResponse, NewChunkEvent, StopReason, Usage
+
+
+class LlamaCppCompletion(Struct):
+    """
+    The parts of a llama.cpp `/completion` response (or streamed chunk) we use.
+    Older servers report `stopped_*` flags instead of `stop_type`.
+    """
+
+    content: str = ""
+    stop: bool = False
+    stop_type: str | None = None
+    stopped_limit: bool = False
+    tokens_evaluated: int | None = None
+    tokens_predicted: int | None = None
+    error: msgspec.Raw | None = None
+
+
+_completion_decoder = msgspec.json.Decoder(LlamaCppCompletion)
+_request_encoder = msgspec.json.Encoder()
+
+
+def _usage(completion: LlamaCppCompletion) -> Usage | None:
+    if completion.tokens_evaluated is None or completion.tokens_predicted is None:
+        return None
+    return Usage(prompt_tokens=completion.tokens_evaluated, completion_tokens=completion.tokens_predicted)
+
+
+def _stop_reason(completion: LlamaCppCompletion) -> StopReason:
+    if completion.error is not None:
+        return StopReason.ERROR
+    if completion.stop_type == "limit" or completion.stopped_limit:
+        return StopReason.MAX_TOKENS
+    return StopReason.END_OF_GENERATION
+
+
+class LlamaCppProvider(BaseProvider):
+    """
+    Talks to a llama.cpp server's native `/completion` endpoint, so token id
+    prompts go through without a tokenize round trip and the server's prompt
+    cache can be used.
+    """
+
+    probe_path = "/health"
+
+    def prepare_request(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest
+    ) -> Dict[str, Any]:
+        # A llama.cpp server hosts a single model, model_id is informational
+        provider_request: Dict[str, Any] = {
+            "prompt": request.prompt,
+            "cache_prompt": self.config.cache_prompt,
+        }
+
+        if request.samplers:
+            if request.samplers.temperature is not None:
+                provider_request["temperature"] = request.samplers.temperature
+            if request.samplers.top_p is not None:
+                provider_request["top_p"] = request.samplers.top_p
+            if request.samplers.min_p is not None:
+                provider_request["min_p"] = request.samplers.min_p
+            if request.samplers.repetition_penalty is not None:
+                provider_request["repeat_penalty"] = request.samplers.repetition_penalty
+            if request.samplers.frequency_penalty is not None:
+                provider_request["frequency_penalty"] = request.samplers.frequency_penalty
+            if request.samplers.presence_penalty is not None:
+                provider_request["presence_penalty"] = request.samplers.presence_penalty
+
+        if request.stop_sequences:
+            if not all(isinstance(stop, str) for stop in request.stop_sequences):
+                raise ProviderError(400, "llama.cpp only supports text stop sequences")
+            provider_request["stop"] = request.stop_sequences
+
+        if request.seed is not None:
+            provider_request["seed"] = request.seed
+
+        if request.max_new_tokens is not None:
+            provider_request["n_predict"] = request.max_new_tokens
+
+        return provider_request
+
+    def parse_response(
+        self,
+        response_data: bytes
+    ) -> TextGenerationResponse:
+        completion = _completion_decoder.decode(response_data)
+        return TextGenerationResponse(text=completion.content, stop_reason=_stop_reason(completion), usage=_usage(completion))
+
+    async def fetch(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest
+    ) -> TextGenerationResponse:
+        provider_request = self.prepare_request(model_config, request)
+        response = await self._post_hedged(
+            model_config,
+            "/completion",
+            _request_encoder.encode(provider_request),
+            self.balancer.affinity_key(request.prompt)
+        )
+        return self.parse_response(response.content)
+
+    async def stream_events(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest
+    ) -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+        provider_request = self.prepare_request(model_config, request)
+        provider_request["stream"] = True
+
+        async with self._stream(
+            "/completion",
+            _request_encoder.encode(provider_request),
+            self.balancer.affinity_key(request.prompt)
+        ) as response:
+            parts: list[str] = []
+            stop_reason = StopReason.END_OF_GENERATION
+            usage: Usage | None = None
+            async for data in iter_sse_data(response.aiter_bytes()):
+                try:
+                    chunk = _completion_decoder.decode(data)
+                except msgspec.DecodeError:
+                    continue
+
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield NewChunkEvent(text=chunk.content)
+                # llama.cpp has no [DONE] sentinel, the last chunk is flagged instead
+                if chunk.stop or chunk.error is not None:
+                    stop_reason = _stop_reason(chunk)
+                    usage = _usage(chunk)
+                    break
+
+        yield TextGenerationResponse(text="".join(parts), stop_reason=stop_reason, usage=usage)
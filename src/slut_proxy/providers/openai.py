@@ -1,30 +1,50 @@
-import json
-from typing import Dict, Any, Union
-import httpx
-from starlette.responses import JSONResponse, StreamingResponse
+from collections.abc import AsyncIterator
+from typing import Dict, Any
+import msgspec
+from msgspec import Struct
 
 from . import BaseProvider
-from ..models.config import ProviderConfig, ModelConfig
-from ..models.slut import TextGenerationRequest, TextGenerationResponse, StopReason
-from ..utils.responses import MsgspecJSONResponse
+from .sse import DONE_SENTINEL, iter_sse_data
+from ..models.config import ModelConfig
+from ..models.slut import TextGenerationRequest, TextGenerationResponse, NewChunkEvent, StopReason, Usage
+
+
+class UpstreamChoice(Struct):
+    text: str = ""
+    finish_reason: str | None = None
+
+
+class UpstreamUsage(Struct):
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+class UpstreamCompletion(Struct):
+    """
+    The parts of an OpenAI `/completions` response (or streamed chunk) we use
+    """
+
+    choices: list[UpstreamChoice] = []
+    usage: UpstreamUsage | None = None
+
+
+_completion_decoder = msgspec.json.Decoder(UpstreamCompletion)
+_request_encoder = msgspec.json.Encoder()
+
+def _usage(usage: UpstreamUsage | None) -> Usage | None:
+    if usage is None:
+        return None
+    return Usage(prompt_tokens=usage.prompt_tokens, completion_tokens=usage.completion_tokens)
+
+_STOP_REASONS = {
+    "stop": StopReason.END_OF_GENERATION,
+    "length": StopReason.MAX_TOKENS,
+}
 
 
 class OpenAIProvider(BaseProvider):
-    async def generate(
-        self, 
-        model_config: ModelConfig,
-        request: TextGenerationRequest,
-        stream: bool = False
-    ) -> Union[TextGenerationResponse, StreamingResponse]:
-        provider_request = self.prepare_request(model_config, request)
-        
-        if stream:
-            return await self._handle_streaming_response(provider_request)
-        else:
-            return await self._handle_sync_response(provider_request)
-    
     def prepare_request(
-        self, 
+        self,
         model_config: ModelConfig,
         request: TextGenerationRequest
     ) -> Dict[str, Any]:
@@ -32,102 +52,94 @@ class OpenAIProvider(BaseProvider):
             "model": model_config.model_id,
             "prompt": request.prompt,
         }
-        
+
         if request.samplers:
-            if "temperature" in request.samplers:
-                provider_request["temperature"] = request.samplers["temperature"]
-            if "top_p" in request.samplers:
-                provider_request["top_p"] = request.samplers["top_p"]
-            if "min_p" in request.samplers:
+            if request.samplers.temperature is not None:
+                provider_request["temperature"] = request.samplers.temperature
+            if request.samplers.top_p is not None:
+                provider_request["top_p"] = request.samplers.top_p
+            if request.samplers.min_p is not None:
                 provider_request["min_p"] = request.samplers.min_p
-            if "repetition_penalty" in request.samplers:
+            if request.samplers.repetition_penalty is not None:
                 provider_request["repetition_penalty"] = request.samplers.repetition_penalty
-        
+            if request.samplers.frequency_penalty is not None:
+                provider_request["frequency_penalty"] = request.samplers.frequency_penalty
+            if request.samplers.presence_penalty is not None:
+                provider_request["presence_penalty"] = request.samplers.presence_penalty
+
         if request.stop_sequences:
             provider_request["stop"] = request.stop_sequences
-        
+
+        if request.seed is not None:
+            provider_request["seed"] = request.seed
+
+        if request.max_new_tokens is not None:
+            provider_request["max_tokens"] = request.max_new_tokens
+
         return provider_request
-    
+
     def parse_response(
-        self, 
-        response_data: Dict[str, Any]
+        self,
+        response_data: bytes
     ) -> TextGenerationResponse:
-        text = response_data.get("choices", [{}])[0].get("text", "")
-        
-        finish_reason = response_data.get("choices", [{}])[0].get("finish_reason", "stop")
-        if finish_reason == "length":
-            stop_reason = StopReason.MAX_TOKENS
-        elif finish_reason == "stop":
-            stop_reason = StopReason.END_OF_GENERATION
-        else:
-            stop_reason = StopReason.ERROR
-        
-        return TextGenerationResponse(text=text, stop_reason=stop_reason)
-    
-    async def _handle_sync_response(
-        self, 
-        provider_request: Dict[str, Any]
-    ) -> MsgspecJSONResponse:
-        response = await self.client.post(
-            f"{self.config.base_url}/completions",
-            json=provider_request,
-            headers=self._get_auth_headers()
+        completion = _completion_decoder.decode(response_data)
+        choice = completion.choices[0] if completion.choices else UpstreamChoice(finish_reason="stop")
+
+        return TextGenerationResponse(
+            text=choice.text,
+            stop_reason=_STOP_REASONS.get(choice.finish_reason or "stop", StopReason.ERROR),
+            usage=_usage(completion.usage)
+        )
+
+    async def fetch(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest
+    ) -> TextGenerationResponse:
+        provider_request = self.prepare_request(model_config, request)
+        response = await self._post_hedged(
+            model_config,
+            "/completions",
+            _request_encoder.encode(provider_request),
+            self.balancer.affinity_key(request.prompt)
         )
-        response.raise_for_status()
-        
-        provider_data = response.json()
-        result = self.parse_response(provider_data)
-        return MsgspecJSONResponse(result)
-    
-    async def _handle_streaming_response(
-        self, 
-        provider_request: Dict[str, Any]
-    ) -> StreamingResponse:
+        return self.parse_response(response.content)
+
+    async def stream_events(
+        self,
+        model_config: ModelConfig,
+        request: TextGenerationRequest
+    ) -> AsyncIterator[NewChunkEvent | TextGenerationResponse]:
+        provider_request = self.prepare_request(model_config, request)
         provider_request["stream"] = True
-        
-        async def generate_stream():
-            async with self.client.stream(
-                "POST",
-                f"{self.config.base_url}/completions",
-                json=provider_request,
-                headers=self._get_auth_headers()
-            ) as response:
-                response.raise_for_status()
-                
-                accumulated_text = ""
-                async for line in response.aiter_lines():
-                    if line.startswith("data: "):
-                        data = line[6:]
-                        if data == "[DONE]":
-                            final_event = {
-                                "event": "done",
-                                "data": json.dumps({
-                                    "text": accumulated_text,
-                                    "stop_reason": "end_of_generation_reached"
-                                })
-                            }
-                            yield f"event: {final_event['event']}\ndata: {final_event['data']}\n\n"
-                            break
-                        
-                        try:
-                            chunk_data = json.loads(data)
-                            if "choices" in chunk_data and chunk_data["choices"]:
-                                delta = chunk_data["choices"][0].get("text", "")
-                                if delta:
-                                    accumulated_text += delta
-                                    chunk_event = {
-                                        "event": "new_chunk",
-                                        "data": json.dumps({"text": delta})
-                                    }
-                                    yield f"event: {chunk_event['event']}\ndata: {chunk_event['data']}\n\n"
-                        except json.JSONDecodeError:
-                            continue
-        
-        return StreamingResponse(
-            generate_stream(),
-            media_type="text/event-stream",
-            headers={
-                "Cache-Control": "no-cache",
-                "Connection": "keep-alive",
-            }
-        )
\ No newline at end of file
+
+        async with self._stream(
+            "/completions",
+            _request_encoder.encode(provider_request),
+            self.balancer.affinity_key(request.prompt)
+        ) as response:
+            parts: list[str] = []
+            stop_reason = StopReason.END_OF_GENERATION
+            usage: UpstreamUsage | None = None
+            async for data in iter_sse_data(response.aiter_bytes()):
+                if data == DONE_SENTINEL:
+                    break
+
+                try:
+                    chunk = _completion_decoder.decode(data)
+                except msgspec.DecodeError:
+                    continue
+                # Some servers report usage on the last chunk
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+
+                choice = chunk.choices[0]
+                if choice.text:
+                    parts.append(choice.text)
+                    yield NewChunkEvent(text=choice.text)
+                if choice.finish_reason:
+                    stop_reason = _STOP_REASONS.get(choice.finish_reason, StopReason.ERROR)
+
+        yield TextGenerationResponse(text="".join(parts), stop_reason=stop_reason, usage=_usage(usage))
@@ -0,0 +1,212 @@
+import msgspec
+import trio
+
+from . import BaseProvider
+from .cache import ResponseCache
+from .coalesce import Coalescer
+from .usage import UsageLog
+from ..middleware import RateLimiter
+from ..utils.metrics import Metrics
+from .factory import create_provider
+from ..models.config import Config, ProviderConfig
+
+
+class ConfigReloadError(Exception):
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.message = message
+
+
+class ReloadSummary(msgspec.Struct):
+    providers_added: list[str] = []
+    providers_changed: list[str] = []
+    providers_removed: list[str] = []
+    models_added: list[str] = []
+    models_changed: list[str] = []
+    models_removed: list[str] = []
+    # [proxy] settings are read at startup, changing them takes a restart
+    restart_required: list[str] = []
+
+
+class ProviderSnapshot:
+    """
+    A config and the providers serving it. Reloads swap in a new snapshot as
+    a whole, so a request that took one sees a consistent view throughout.
+    """
+
+    __slots__ = ("config", "providers")
+
+    def __init__(self, config: Config, providers: dict[str, BaseProvider]):
+        self.config = config
+        self.providers = providers
+
+    def get(self, name: str) -> BaseProvider:
+        provider = self.providers.get(name)
+        if provider is None:
+            raise KeyError(f"Provider {name} does not exist!")
+        return provider
+
+
+def _diff(old: dict[str, object], new: dict[str, object]) -> tuple[list[str], list[str], list[str]]:
+    added = [name for name in new if name not in old]
+    changed = [name for name in new if name in old and old[name] != new[name]]
+    removed = [name for name in old if name not in new]
+    return added, changed, removed
+
+
+class ProviderRegistry:
+    """
+    Long-lived provider instances, one pooled upstream client per provider.
+
+    Built once in the app lifespan; requests borrow providers from here
+    instead of creating (and tearing down) a client each. On a config reload
+    only providers whose config changed get a new pool, the replaced ones
+    drain in the background.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        response_cache: ResponseCache | None = None,
+        coalescer: Coalescer | None = None,
+        rate_limiter: RateLimiter | None = None,
+        usage_log: UsageLog | None = None,
+        metrics: Metrics | None = None
+    ):
+        self.response_cache = response_cache
+        self.coalescer = coalescer
+        self.rate_limiter = rate_limiter
+        self.usage_log = usage_log
+        self.metrics = metrics
+
+        self.current = ProviderSnapshot(config, {
+            provider.name: self._create(provider) for provider in config.providers
+        })
+        self._nursery: trio.Nursery | None = None
+        self._health_checks: dict[BaseProvider, trio.CancelScope] = {}
+        self._draining: set[BaseProvider] = set()
+        self._reloading = trio.Lock()
+
+    def _create(self, config: ProviderConfig) -> BaseProvider:
+        provider = create_provider(config)
+        provider.response_cache = self.response_cache
+        provider.coalescer = self.coalescer
+        provider.rate_limiter = self.rate_limiter
+        provider.usage_log = self.usage_log
+        provider.metrics = self.metrics
+        return provider
+
+    @property
+    def providers(self) -> dict[str, BaseProvider]:
+        return self.current.providers
+
+    def get(self, name: str) -> BaseProvider:
+        return self.current.get(name)
+
+    async def prewarm(self):
+        async with trio.open_nursery() as nursery:
+            for provider in self.providers.values():
+                nursery.start_soon(provider.prewarm)
+
+    async def run(self, task_status: trio.TaskStatus[None] = trio.TASK_STATUS_IGNORED):
+        """Runs health checks and drains replaced providers until cancelled"""
+        async with trio.open_nursery() as nursery:
+            self._nursery = nursery
+            for provider in self.providers.values():
+                self._start_health_checks(provider)
+            task_status.started()
+            try:
+                await trio.sleep_forever()
+            finally:
+                self._nursery = None
+
+    def _start_health_checks(self, provider: BaseProvider):
+        assert self._nursery is not None
+        scope = self._health_checks[provider] = trio.CancelScope()
+
+        async def run():
+            with scope:
+                await provider.run_health_checks()
+
+        self._nursery.start_soon(run)
+
+    def _retire(self, provider: BaseProvider, drain_timeout: float):
+        scope = self._health_checks.pop(provider, None)
+        if scope is not None:
+            scope.cancel()
+        self._draining.add(provider)
+
+        async def drain():
+            try:
+                await provider.drain(drain_timeout)
+            finally:
+                self._draining.discard(provider)
+
+        assert self._nursery is not None
+        self._nursery.start_soon(drain)
+
+    async def reload(self, config: Config) -> ReloadSummary:
+        """
+        Swaps in a new config. Providers whose config is unchanged are kept
+        with their pools and health state; new and changed ones are created
+        and prewarmed before the swap, replaced ones drain afterwards. A new
+        provider that can't be created raises `ConfigReloadError` and leaves
+        the current config in place.
+        """
+        async with self._reloading:
+            return await self._reload(config)
+
+    async def _reload(self, config: Config) -> ReloadSummary:
+        old = self.current
+        summary = ReloadSummary()
+        summary.restart_required = [
+            f"proxy.{name}" for name in old.config.proxy.__struct_fields__
+            if getattr(old.config.proxy, name) != getattr(config.proxy, name)
+        ]
+        if summary.restart_required:
+            config = Config(proxy=old.config.proxy, providers=config.providers, models=config.models)
+
+        summary.providers_added, summary.providers_changed, summary.providers_removed = _diff(
+            {provider.name: provider for provider in old.config.providers},
+            {provider.name: provider for provider in config.providers},
+        )
+        summary.models_added, summary.models_changed, summary.models_removed = _diff(
+            {model.name: model for model in old.config.models},
+            {model.name: model for model in config.models},
+        )
+
+        # Built before anything is swapped, so a provider that can't be (an
+        # unsupported type, http2 without its extra) rejects the whole config
+        fresh: dict[str, BaseProvider] = {}
+        try:
+            for name in summary.providers_added + summary.providers_changed:
+                fresh[name] = self._create(config.get_provider(name))
+        except Exception as e:
+            for provider in fresh.values():
+                await provider.aclose()
+            raise ConfigReloadError(f"Failed to set up provider {name}: {e!r}")
+        async with trio.open_nursery() as nursery:
+            for provider in fresh.values():
+                nursery.start_soon(provider.prewarm)
+
+        providers = {
+            provider.name: fresh.get(provider.name) or old.providers[provider.name]
+            for provider in config.providers
+        }
+        # Per-model admission queues and hedgers start over with the new settings
+        for name in summary.models_changed + summary.models_removed:
+            for provider in providers.values():
+                _ = provider.model_admission.pop(name, None)
+                _ = provider._hedgers.pop(name, None)
+
+        self.current = ProviderSnapshot(config, providers)
+
+        for provider in fresh.values():
+            self._start_health_checks(provider)
+        for name in summary.providers_changed + summary.providers_removed:
+            self._retire(old.providers[name], config.proxy.reload_drain_timeout)
+        return summary
+
+    async def aclose(self):
+        for provider in (*self.providers.values(), *self._draining):
+            await provider.aclose()
@@ -0,0 +1,124 @@
+from collections.abc import AsyncGenerator, AsyncIterable, AsyncIterator
+from typing import Generic, Self, TypeVar
+import msgspec
+
+from ..models.slut import NewChunkEvent, TextGenerationResponse
+
+DONE_SENTINEL = b"[DONE]"
+
+T = TypeVar("T")
+
+_encoder = msgspec.json.Encoder()
+
+# Event framing is constant, only the JSON payload is encoded per event
+_NEW_CHUNK_PREFIX = b"event: new_chunk\ndata: "
+_DONE_PREFIX = b"event: done\ndata: "
+_EVENT_SUFFIX = b"\n\n"
+
+
+class SSEParser:
+    """
+    Incremental server-sent events parser over raw bytes.
+
+    Feed it whatever the transport hands out; it returns the `data` payload
+    of every event completed by that chunk, still as bytes so it can go
+    straight into a msgspec decoder. Event names, ids and comments are ignored.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._data: list[bytes] = []
+
+    def feed(self, chunk: bytes) -> list[bytes]:
+        buffer = self._buffer
+        buffer += chunk
+
+        events: list[bytes] = []
+        start = 0
+        while True:
+            end = buffer.find(b"\n", start)
+            if end == -1:
+                break
+
+            line_end = end - 1 if end > start and buffer[end - 1] == 0x0D else end  # strip \r
+            if line_end == start:
+                # Blank line dispatches the event
+                if self._data:
+                    events.append(self._data[0] if len(self._data) == 1 else b"\n".join(self._data))
+                    self._data = []
+            elif buffer.startswith(b"data:", start):
+                value_start = start + 5
+                if value_start < line_end and buffer[value_start] == 0x20:
+                    value_start += 1
+                self._data.append(bytes(buffer[value_start:line_end]))
+
+            start = end + 1
+
+        del buffer[:start]
+        return events
+
+    def flush(self) -> list[bytes]:
+        """Returns an event left unterminated when the upstream closed the stream"""
+        events = self.feed(b"\n\n") if self._buffer else []
+        if self._data:
+            events.append(b"\n".join(self._data))
+            self._data = []
+        return events
+
+
+async def iter_sse_data(byte_stream: AsyncIterable[bytes]) -> AsyncIterator[bytes]:
+    """Yields the data payload of every event in an upstream byte stream"""
+    parser = SSEParser()
+    async for chunk in byte_stream:
+        for data in parser.feed(chunk):
+            yield data
+    for data in parser.flush():
+        yield data
+
+
+def encode_event(event: NewChunkEvent | TextGenerationResponse) -> bytes:
+    """Frames a SLUT streaming event for the wire"""
+    if isinstance(event, NewChunkEvent):
+        return b"".join((_NEW_CHUNK_PREFIX, _encoder.encode(event), _EVENT_SUFFIX))
+    return b"".join((_DONE_PREFIX, _encoder.encode(event), _EVENT_SUFFIX))
+
+
+async def encode_events(events: AsyncIterable[NewChunkEvent | TextGenerationResponse]) -> AsyncIterator[bytes]:
+    async for event in events:
+        yield encode_event(event)
+
+
+class Primed(Generic[T]):
+    """
+    An event stream whose first event was already taken. Closing it closes
+    the stream whether or not it was iterated, which a generator wrapping
+    the stream wouldn't do before its first step.
+    """
+
+    __slots__ = ("_first", "_events", "_taken")
+
+    def __init__(self, first: T, events: AsyncGenerator[T, None]):
+        self._first = first
+        self._events = events
+        self._taken = False
+
+    def __aiter__(self) -> Self:
+        return self
+
+    async def __anext__(self) -> T:
+        if not self._taken:
+            self._taken = True
+            return self._first
+        return await anext(self._events)
+
+    async def aclose(self):
+        await self._events.aclose()
+
+
+async def prime(events: AsyncGenerator[T, None]) -> Primed[T]:
+    """
+    Runs an event stream up to its first event, so connection errors and
+    retries happen before the response status has been sent
+    """
+    first = await anext(events)
+    return Primed(first, events)
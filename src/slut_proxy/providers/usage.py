@@ -0,0 +1,131 @@
+import time
+from typing import TYPE_CHECKING
+
+import anyio_sqlite
+import msgspec
+import trio
+
+from ..models.config import UsageConfig
+
+if TYPE_CHECKING:
+    from ..storage import Database
+
+
+class UsageRecord(msgspec.Struct, array_like=True, gc=False):
+    created_at: float # unix time
+    key_hash: str
+    model: str
+    provider: str
+    prompt_tokens: int
+    completion_tokens: int
+    latency_ms: int
+    status: int # HTTP status of the generation
+
+
+class UsageStats(msgspec.Struct):
+    recorded: int = 0
+    written: int = 0
+    # Dropped because the queue was full or the write failed
+    dropped: int = 0
+    batches: int = 0
+
+
+class UsageLog:
+    """
+    Write-behind usage accounting.
+
+    Requests hand their record to an in-memory channel without ever waiting;
+    a background task batches them into `usage_log` and folds them into the
+    `usage_hourly` rollups, one database write per flush.
+    """
+
+    def __init__(self, config: UsageConfig):
+        self.config = config
+        self.stats = UsageStats()
+        self._send, self._receive = trio.open_memory_channel[UsageRecord](config.queue_size)
+        self._batches_since_prune = 0
+
+    def record(self, record: UsageRecord):
+        if not self.config.enabled:
+            return
+        try:
+            self._send.send_nowait(record)
+            self.stats.recorded += 1
+        except trio.WouldBlock:
+            self.stats.dropped += 1
+
+    async def run(self, db: "Database"):
+        """Writes batches until cancelled, then writes what is still queued"""
+        batch: list[UsageRecord] = []
+        try:
+            while True:
+                batch.append(await self._receive.receive())
+                # Give the batch until the flush interval to fill up
+                with trio.move_on_after(self.config.flush_interval):
+                    while len(batch) < self.config.batch_size:
+                        batch.append(await self._receive.receive())
+                await self._write(db, batch)
+                batch = []
+        finally:
+            with trio.CancelScope(shield=True):
+                while True:
+                    try:
+                        batch.append(self._receive.receive_nowait())
+                    except trio.WouldBlock:
+                        break
+                if batch:
+                    await self._write(db, batch)
+
+    async def _write(self, db: "Database", batch: list[UsageRecord]):
+        rollups: dict[tuple[int, str, str, str], list[int]] = {}
+        for record in batch:
+            hour = int(record.created_at // 3600 * 3600)
+            rollup = rollups.get((hour, record.key_hash, record.model, record.provider))
+            if rollup is None:
+                rollup = rollups[(hour, record.key_hash, record.model, record.provider)] = [0, 0, 0, 0, 0]
+            rollup[0] += 1
+            rollup[1] += record.status >= 400
+            rollup[2] += record.prompt_tokens
+            rollup[3] += record.completion_tokens
+            rollup[4] += record.latency_ms
+
+        async def write(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+            _ = await con.executemany(
+                """INSERT INTO usage_log
+                   (created_at, key_hash, model, provider, prompt_tokens, completion_tokens, latency_ms, status)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                [msgspec.structs.astuple(record) for record in batch]
+            )
+            _ = await con.executemany(
+                """INSERT INTO usage_hourly
+                   (hour, key_hash, model, provider, requests, errors, prompt_tokens, completion_tokens, latency_ms)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                   ON CONFLICT(hour, key_hash, model, provider) DO UPDATE SET
+                   requests = requests + excluded.requests,
+                   errors = errors + excluded.errors,
+                   prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                   completion_tokens = completion_tokens + excluded.completion_tokens,
+                   latency_ms = latency_ms + excluded.latency_ms""",
+                [(*key, *totals) for key, totals in rollups.items()]
+            )
+            if prune:
+                _ = await con.execute(
+                    "DELETE FROM usage_log WHERE created_at < ?",
+                    (time.time() - self.config.raw_retention_days * 86400,)  # pyright: ignore[reportOptionalOperand]
+                )
+
+        self._batches_since_prune += 1
+        prune = self.config.raw_retention_days is not None and self._batches_since_prune >= 1000
+        if prune:
+            self._batches_since_prune = 0
+
+        try:
+            # One transaction, shared with whatever else is being written
+            await db.write(write)
+        except anyio_sqlite.Error as e:
+            print(f"Failed to write {len(batch)} usage records: {e!r}")
+            self.stats.dropped += len(batch)
+            return
+
+        self.stats.written += len(batch)
+        self.stats.batches += 1
@@ -0,0 +1,62 @@
+import signal
+
+import msgspec
+import trio
+
+from .models.config import Config
+from .providers.registry import ConfigReloadError, ProviderRegistry, ReloadSummary
+
+__all__ = ["ConfigReloadError", "ConfigReloader"]
+
+
+class ConfigReloader:
+    """
+    Re-reads the config file into the provider registry, on SIGHUP, when
+    asked through the admin API or when another worker was. A config that
+    fails to load or validate is rejected as a whole and the current one
+    stays in place.
+    """
+
+    def __init__(self, path: str, providers: ProviderRegistry):
+        self.path = path
+        self.providers = providers
+        # One pending request is enough, it reads the file as it is by then
+        self._requests_send, self._requests_receive = trio.open_memory_channel[None](1)
+
+    async def reload(self) -> ReloadSummary:
+        try:
+            config = Config.from_toml(self.path)
+        except (OSError, msgspec.MsgspecError, ValueError) as e:
+            raise ConfigReloadError(f"Failed to load {self.path}: {e}")
+
+        summary = await self.providers.reload(config)
+        print(f"Reloaded {self.path}: {msgspec.json.encode(summary).decode()}")
+        return summary
+
+    def request(self):
+        """Has `run` reload in the background"""
+        try:
+            self._requests_send.send_nowait(None)
+        except trio.WouldBlock:
+            pass
+
+    async def _reload_logged(self):
+        try:
+            _ = await self.reload()
+        except ConfigReloadError as e:
+            print(f"{e.message}, keeping the current config")
+
+    async def run(self, task_status: trio.TaskStatus[None] = trio.TASK_STATUS_IGNORED):
+        """Reloads on every SIGHUP, where the platform has it, and on `request`"""
+        async def watch_signals(task_status: trio.TaskStatus[None] = trio.TASK_STATUS_IGNORED):
+            with trio.open_signal_receiver(signal.SIGHUP) as signals:
+                task_status.started()
+                async for _ in signals:
+                    self.request()
+
+        async with trio.open_nursery() as nursery:
+            if hasattr(signal, "SIGHUP"):
+                await nursery.start(watch_signals)
+            task_status.started()
+            async for _ in self._requests_receive:
+                await self._reload_logged()
@@ -1,47 +1,82 @@
+import contextlib
 import time
 import uuid
+import msgspec
+import trio
 from starlette.requests import Request
-from starlette.responses import JSONResponse, StreamingResponse
+from starlette.responses import JSONResponse, Response, StreamingResponse
 from starlette.routing import Route
 
 from slut_proxy.models.compat import (
     OpenAIModel, OpenAIResponse, OpenAICompletionRequest, 
-    OpenAICompletionResponse, OpenAICompletionChoice, OpenAICompletionUsage
+    OpenAICompletionResponse, OpenAICompletionChoice, OpenAICompletionUsage,
+    OpenAICompletionChunk, OpenAICompletionChunkChoice, unsupported_fields
 )
-from slut_proxy.models.slut import TextGenerationRequest, Samplers
+from slut_proxy.models.slut import TextGenerationRequest, TextGenerationResponse, Samplers, NewChunkEvent, StopReason
 from slut_proxy.models.config import Config
-from slut_proxy.utils.responses import MsgspecJSONResponse
-from slut_proxy.providers.factory import create_provider
+from slut_proxy.utils.metrics import Metrics
+from slut_proxy.utils.requests import RequestError
+from slut_proxy.utils.timing import current_timing, mark
+from slut_proxy.utils.responses import ClosingStreamingResponse, MsgspecJSONResponse, PreEncodedJSON, ProducerStreamingResponse
+from slut_proxy.utils.tokens import usage_of
+from slut_proxy.providers import ProviderError
+from slut_proxy.providers.cache import CacheStatus
+from slut_proxy.providers.registry import ProviderRegistry
+
+_chunk_encoder = msgspec.json.Encoder()
+
+_FINISH_REASONS = {
+    StopReason.END_OF_GENERATION: "stop",
+    StopReason.MAX_TOKENS: "length",
+    StopReason.ERROR: "error",
+}
+
+class _ModelViews:
+    """The model list and each model's unsupported fields, worked out once per config"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        self.model_list = PreEncodedJSON(OpenAIResponse(
+            object="list",
+            data=[OpenAIModel(id=model.name, owned_by=config.get_provider(model.provider).name) for model in config.models]
+        ))
+        self.unsupported_fields: dict[str, tuple[str, ...]] = {}
+        for model in config.models:
+            if model.name not in self.unsupported_fields:
+                self.unsupported_fields[model.name] = unsupported_fields(model, config.get_provider(model.provider))
 
 def build_routes(config: Config) -> list[Route]:
-    async def get_models(request: Request) -> MsgspecJSONResponse:
+    views = _ModelViews(config)
+
+    def views_of(current: Config) -> _ModelViews:
+        # A reload swaps in a new config, and with it new views
+        nonlocal views
+        if views.config is not current:
+            views = _ModelViews(current)
+        return views
+
+    async def get_models(request: Request) -> Response:
         """Get models in OpenAI format"""
-        openai_models = []
-        
-        for model in config.models:
-            provider_config = config.get_provider(model.provider)
-            openai_model = OpenAIModel(
-                id=model.name,
-                owned_by=provider_config.name
-            )
-            openai_models.append(openai_model)
-        
-        response = OpenAIResponse(
-            object="list",
-            data=openai_models
-        )
-        
-        return MsgspecJSONResponse(response)
+        providers: ProviderRegistry = request.state.providers  # pyright: ignore[reportAny]
+        return views_of(providers.current.config).model_list.response(request)
 
     async def create_completion(request: Request) -> JSONResponse | StreamingResponse:
         """Create completion in OpenAI format"""
-        body = await request.json()
+        completion_request = await OpenAICompletionRequest.from_request(request, config.proxy.max_request_body_size)
+        mark("parse")
         
-        # Get model and provider config
-        model_config = config.get_model(body["model"])
-        provider_config = config.get_provider(model_config.provider)
+        # Get model and provider config, from the snapshot current as the
+        # request arrived even if a reload happens while it's served
+        providers: ProviderRegistry = request.state.providers  # pyright: ignore[reportAny]
+        snapshot = providers.current
+        try:
+            model_config = snapshot.config.get_model(completion_request.model)
+        except KeyError:
+            raise RequestError(f"Model {completion_request.model} does not exist", status_code=404, param="model")
+        metrics: Metrics = request.state.metrics  # pyright: ignore[reportAny]
+        metrics.requests.labels("/v1/completions", model_config.name).inc()
 
-        completion_request = OpenAICompletionRequest(model=body["model"], prompt=body["prompt"], other_fields=body, provider_config=provider_config)
+        completion_request.drop_unsupported(views_of(snapshot.config).unsupported_fields[model_config.name])
         
         # Check API key permissions
         api_permissions = getattr(request.state, 'api_key_permissions', None)
@@ -55,8 +90,8 @@ def build_routes(config: Config) -> list[Route]:
         # - If model is allowed but provider is not -> allow (200)
         # - If model isn't explicitly allowed but provider is -> allow (200) 
         # - If neither are allowed -> unauthorized (403)
-        model_allowed = completion_request.model in api_permissions["allowed_models"]
-        provider_allowed = model_config.provider in api_permissions["allowed_providers"]
+        model_allowed = completion_request.model in api_permissions.allowed_models
+        provider_allowed = model_config.provider in api_permissions.allowed_providers
         
         if not model_allowed and not provider_allowed:
             return JSONResponse(
@@ -70,11 +105,19 @@ def build_routes(config: Config) -> list[Route]:
             samplers.temperature = completion_request.temperature
         if completion_request.top_p is not None:
             samplers.top_p = completion_request.top_p
+        if completion_request.frequency_penalty is not None:
+            samplers.frequency_penalty = completion_request.frequency_penalty
+        if completion_request.presence_penalty is not None:
+            samplers.presence_penalty = completion_request.presence_penalty
         
-        # Handle prompt (convert list of prompts to first one)
-        prompt_text = completion_request.prompt
-        if isinstance(prompt_text, list):
-            prompt_text = prompt_text[0]
+        # A list prompt and n > 1 fan out into one generation per choice
+        prompts = completion_request.prompt if isinstance(completion_request.prompt, list) else [completion_request.prompt]
+        choice_count = len(prompts) * completion_request.n
+        if not prompts or completion_request.n < 1 or choice_count > config.proxy.max_completion_choices:
+            return JSONResponse(
+                {"error": {"message": f"Requests must ask for between 1 and {config.proxy.max_completion_choices} choices", "type": "invalid_request_error"}},
+                status_code=400
+            )
         
         # Handle stop sequences
         stop_sequences = None
@@ -84,34 +127,78 @@ def build_routes(config: Config) -> list[Route]:
             else:
                 stop_sequences = completion_request.stop
         
-        gen_request = TextGenerationRequest(
-            prompt=prompt_text,
-            model=completion_request.model,
-            samplers=samplers if any([samplers.temperature, samplers.top_p]) else None,
-            stop_sequences=stop_sequences
-        )
+        # Choices are ordered prompt by prompt, as OpenAI does
+        gen_requests = [
+            TextGenerationRequest(
+                prompt=prompt,
+                model=completion_request.model,
+                samplers=samplers if samplers != Samplers() else None,
+                stop_sequences=stop_sequences,
+                seed=completion_request.seed,
+                max_new_tokens=completion_request.max_tokens
+            )
+            for prompt in prompts
+            for _ in range(completion_request.n)
+        ]
         
-        # Create provider instance and generate response
-        async with create_provider(provider_config) as provider:
-            if completion_request.stream:
-                return await _stream_completion(provider, model_config, gen_request, completion_request)
-            else:
-                return await _create_completion_response(provider, model_config, gen_request, completion_request)
+        timing = current_timing()
+        if timing is not None:
+            timing.model = model_config.name
+            timing.mark("route")
+
+        # Generate with the long-lived provider from the registry
+        provider = snapshot.get(model_config.provider)
+        if completion_request.stream:
+            if len(gen_requests) > 1:
+                return _stream_completions(provider, model_config, gen_requests, completion_request, api_permissions)
+            return await _stream_completion(provider, model_config, gen_requests[0], completion_request, api_permissions)
+        else:
+            return await _create_completion_response(provider, model_config, gen_requests, completion_request, api_permissions)
 
-    async def _create_completion_response(provider, model_config, gen_request, completion_request):
+    async def _complete_all(provider, model_config, gen_requests, permissions) -> list[tuple[TextGenerationResponse, CacheStatus]]:
+        """Runs the generations concurrently, at most `completion_fanout_concurrency` at a time"""
+        if len(gen_requests) == 1:
+            return [await provider.complete(model_config, gen_requests[0], permissions)]
+
+        limiter = trio.CapacityLimiter(config.proxy.completion_fanout_concurrency)
+        results: list[tuple[TextGenerationResponse, CacheStatus] | None] = [None] * len(gen_requests)
+        errors: list[ProviderError] = []
+
+        async def run(index: int, gen_request: TextGenerationRequest):
+            async with limiter:
+                try:
+                    results[index] = await provider.complete(model_config, gen_request, permissions)
+                except ProviderError as e:
+                    # One failed choice fails the request, stop the others
+                    errors.append(e)
+                    nursery.cancel_scope.cancel()
+
+        async with trio.open_nursery() as nursery:
+            for index, gen_request in enumerate(gen_requests):
+                nursery.start_soon(run, index, gen_request)
+
+        if errors:
+            raise errors[0]
+        return results  # pyright: ignore[reportReturnType]
+
+    async def _create_completion_response(provider, model_config, gen_requests, completion_request, permissions):
         """Generate non-streaming completion response"""
-        response = await provider.generate(model_config, gen_request, stream=False)
+        results = await _complete_all(provider, model_config, gen_requests, permissions)
         
-        # Convert internal response to OpenAI format
-        choice = OpenAICompletionChoice(
-            text=response._content.text,
-            index=0,
-            finish_reason=response._content.stop_reason.value
-        )
+        # Convert internal responses to OpenAI format
+        choices = [
+            OpenAICompletionChoice(
+                text=result.text,
+                index=index,
+                finish_reason=_FINISH_REASONS[result.stop_reason]
+            )
+            for index, (result, _) in enumerate(results)
+        ]
         
-        # Simple token estimation (you may want to improve this)
-        prompt_tokens = len(gen_request.prompt.split()) if isinstance(gen_request.prompt, str) else len(str(gen_request.prompt))
-        completion_tokens = len(response._content.text.split())
+        # Upstream token counts where reported, estimates otherwise; each prompt counts once
+        usages = [usage_of(gen_request.prompt, result) for gen_request, (result, _) in zip(gen_requests, results)]
+        prompt_tokens = sum(usage.prompt_tokens for usage in usages[::completion_request.n])
+        completion_tokens = sum(usage.completion_tokens for usage in usages)
         
         usage = OpenAICompletionUsage(
             prompt_tokens=prompt_tokens,
@@ -123,56 +210,86 @@ def build_routes(config: Config) -> list[Route]:
             id=f"cmpl-{uuid.uuid4().hex[:8]}",
             created=int(time.time()),
             model=completion_request.model,
-            choices=[choice],
+            choices=choices,
             usage=usage
         )
         
-        return MsgspecJSONResponse(completion_response)
+        # Fanned out requests only count as a hit if every choice was one
+        cache_statuses = {cache_status for _, cache_status in results}
+        cache_status = cache_statuses.pop() if len(cache_statuses) == 1 else CacheStatus.MISS
+        return MsgspecJSONResponse(completion_response, headers={"X-Cache": cache_status.value})
+
+    def _encode_chunk(completion_id: str, created: int, model: str, index: int, event: NewChunkEvent | TextGenerationResponse) -> bytes:
+        if isinstance(event, NewChunkEvent):
+            choice = OpenAICompletionChunkChoice(text=event.text, index=index)
+        else:
+            # Final event, carries the stop reason
+            choice = OpenAICompletionChunkChoice(text="", index=index, finish_reason=_FINISH_REASONS[event.stop_reason])
 
-    async def _stream_completion(provider, model_config, gen_request, completion_request):
+        chunk = OpenAICompletionChunk(
+            id=completion_id,
+            created=created,
+            model=model,
+            choices=[choice]
+        )
+        return b"data: " + _chunk_encoder.encode(chunk) + b"\n\n"
+
+    async def _stream_completion(provider, model_config, gen_request, completion_request, permissions):
         """Generate streaming completion response"""
         completion_id = f"cmpl-{uuid.uuid4().hex[:8]}"
         created = int(time.time())
         
+        # Connect before answering so upstream failures still get a proper status
+        events, cache_status = await provider.stream(model_config, gen_request, permissions)
+
         async def stream_generator():
-            async for chunk in provider.generate(model_config, gen_request, stream=True):
-                if chunk.text:
-                    choice = OpenAICompletionChoice(
-                        text=chunk.text,
-                        index=0,
-                        finish_reason=""
-                    )
-                    
-                    stream_response = {
-                        "id": completion_id,
-                        "object": "text_completion",
-                        "created": created,
-                        "model": completion_request.model,
-                        "choices": [choice]
-                    }
-                    
-                    yield f"data: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created))}\n"
-                    yield f"data: {stream_response}\n\n"
-            
-            # Send final chunk
-            final_choice = OpenAICompletionChoice(
-                text="",
-                index=0,
-                finish_reason="stop"
-            )
-            
-            final_response = {
-                "id": completion_id,
-                "object": "text_completion", 
-                "created": created,
-                "model": completion_request.model,
-                "choices": [final_choice]
-            }
-            
-            yield f"data: {final_response}\n\n"
-            yield "data: [DONE]\n\n"
-        
-        return StreamingResponse(stream_generator(), media_type="text/plain")
+            async with contextlib.aclosing(events):
+                async for event in events:
+                    yield _encode_chunk(completion_id, created, completion_request.model, 0, event)
+
+            yield b"data: [DONE]\n\n"
+        
+        # Closes the stream even if the client leaves before the body starts
+        return ClosingStreamingResponse(
+            stream_generator(),
+            events.aclose,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Cache": cache_status.value}
+        )
+
+    def _stream_completions(provider, model_config, gen_requests, completion_request, permissions):
+        """
+        Generate a streaming completion response for several choices, with
+        their chunks interleaved as they arrive. The status is sent before
+        any upstream answers, so a failed choice ends with finish_reason "error".
+        """
+        completion_id = f"cmpl-{uuid.uuid4().hex[:8]}"
+        created = int(time.time())
+        limiter = trio.CapacityLimiter(config.proxy.completion_fanout_concurrency)
+
+        async def produce(send_channel: trio.MemorySendChannel[bytes]):
+            async def relay(index: int, gen_request: TextGenerationRequest):
+                async with limiter:
+                    try:
+                        events, _ = await provider.stream(model_config, gen_request, permissions)
+                        async with contextlib.aclosing(events):
+                            async for event in events:
+                                await send_channel.send(_encode_chunk(completion_id, created, completion_request.model, index, event))
+                    except ProviderError as e:
+                        print(f"Choice {index} of {completion_id} failed: {e.message}")
+                        failed = TextGenerationResponse(text="", stop_reason=StopReason.ERROR)
+                        await send_channel.send(_encode_chunk(completion_id, created, completion_request.model, index, failed))
+
+            async with trio.open_nursery() as nursery:
+                for index, gen_request in enumerate(gen_requests):
+                    nursery.start_soon(relay, index, gen_request)
+            await send_channel.send(b"data: [DONE]\n\n")
+
+        return ProducerStreamingResponse(
+            produce,
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache"}
+        )
 
     return [
         Route("/models", get_models, methods=["GET"]),
@@ -1,17 +1,45 @@
+import contextlib
 import secrets
 import hashlib
-import json
 from starlette.requests import Request
-from starlette.responses import JSONResponse, HTMLResponse
+from starlette.responses import JSONResponse, HTMLResponse, PlainTextResponse, StreamingResponse
 from starlette.routing import Route
 from starlette.staticfiles import StaticFiles
 
-import anyio_sqlite
+import msgspec
 
-from slut_proxy.models.slut import ApiKeyInfo, ApiKeyReq
+from slut_proxy.models.slut import ApiKeyCreateReq, ApiKeyPage, ApiKeyReq, ApiKeyWeightReq, ApiKeyRateLimitReq
 from slut_proxy.models.config import Config
+from slut_proxy.middleware import RateLimiter, StateSync
+from slut_proxy.providers.cache import ResponseCache
+from slut_proxy.providers.coalesce import CoalescingStats, Coalescer
+from slut_proxy.providers.registry import ProviderRegistry
+from slut_proxy.reload import ConfigReloader, ConfigReloadError
+from slut_proxy.storage import ApiKeyRepository, Database
+from slut_proxy.utils.metrics import Metrics
 from slut_proxy.utils.responses import MsgspecJSONResponse
 
+# Keys per page of the API key listing, by default and at most
+_DEFAULT_PAGE_SIZE = 100
+_MAX_PAGE_SIZE = 1000
+
+_ndjson_encoder = msgspec.json.Encoder()
+
+def _valid_limit(limit: object) -> bool:
+    return limit is None or (isinstance(limit, (int, float)) and limit > 0)
+
+# What usage can be grouped by, as the column grouped on; keys are reported by prefix
+_USAGE_GROUPS = {
+    "hour": "hour",
+    "key": "key_hash",
+    "model": "model",
+    "provider": "provider",
+}
+
+def _sort_key(entry: dict, group_by: list[str]) -> tuple:  # pyright: ignore[reportMissingTypeArgument]
+    # Nulls first, as SQLite orders them
+    return tuple((entry[group] is not None, entry[group] if entry[group] is not None else 0) for group in group_by)
+
 def build_routes(config: Config) -> list[Route]:
     async def admin_dashboard(request: Request) -> HTMLResponse:
         """Serve the admin dashboard HTML"""
@@ -35,129 +63,358 @@ def build_routes(config: Config) -> list[Route]:
                 status_code=400
             )
 
-        db: anyio_sqlite.Connection = request.state.db  # pyright: ignore[reportMissingTypeArgument, reportAny]
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
         
         # Hash the key for lookup
         key_hash = hashlib.sha256(key.encode()).hexdigest()
         
-        async with await db.execute(
-            "SELECT full_key, key_prefix, allowed_providers, allowed_models FROM api_keys WHERE key_hash = ? AND is_active = 1",
-            (key_hash,)
-        ) as cur:
-            row = await cur.fetchone()
-            
-        if not row:
+        api_key_info = await api_keys.get(key_hash)
+        if api_key_info is None:
             return JSONResponse(
                 {"error": "API key not found"},
                 status_code=404
             )
         
-        api_key_info = ApiKeyInfo(
-            key=row[0] if row[0] else row[1] + "...",  # Use full key if available, otherwise prefix
-            allowed_providers=json.loads(row[2]),
-            allowed_models=json.loads(row[3])
-        )
-        
         return MsgspecJSONResponse(api_key_info)
 
-    async def list_api_keys(request: Request) -> MsgspecJSONResponse:
-        """List all API keys"""
-        db: anyio_sqlite.Connection = request.state.db  # pyright: ignore[reportMissingTypeArgument, reportAny]
-        
-        api_keys = []
-        async with await db.execute(
-            "SELECT full_key, key_prefix, allowed_providers, allowed_models FROM api_keys WHERE is_active = 1"
-        ) as cur:
-            async for row in cur:
-                api_keys.append(ApiKeyInfo(
-                    key=row[0] if row[0] else row[1] + "...",
-                    allowed_providers=json.loads(row[2]),
-                    allowed_models=json.loads(row[3])
-                ))
-        
-        return MsgspecJSONResponse(api_keys)
+    async def list_api_keys(request: Request) -> JSONResponse | MsgspecJSONResponse | StreamingResponse:
+        """
+        List active API keys by creation, a page of `limit` at a time starting
+        after `cursor`, optionally only those allowing a `model` or `provider`.
+        With `Accept: application/x-ndjson` every key past `cursor` (up to
+        `limit` if given) is streamed instead, one JSON object per line.
+        """
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
+        model = request.query_params.get("model") or None
+        provider = request.query_params.get("provider") or None
+
+        cursor = request.query_params.get("cursor") or "0"
+        if not cursor.isdigit():
+            return JSONResponse(
+                {"error": "'cursor' must be a next_cursor from an earlier page"},
+                status_code=400
+            )
+        limit = request.query_params.get("limit")
+        if limit is not None and (not limit.isdigit() or not 0 < int(limit) <= _MAX_PAGE_SIZE):
+            return JSONResponse(
+                {"error": f"'limit' must be between 1 and {_MAX_PAGE_SIZE}"},
+                status_code=400
+            )
+
+        if "application/x-ndjson" in request.headers.get("accept", ""):
+            remaining = int(limit) if limit is not None else None
+
+            async def stream_keys():
+                nonlocal remaining
+                # Encoded a page at a time as pages come from the database
+                async with contextlib.aclosing(api_keys.walk(int(cursor), model, provider)) as pages:
+                    async for page in pages:
+                        if remaining is not None:
+                            page = page[:remaining]
+                            remaining -= len(page)
+                        yield _ndjson_encoder.encode_lines([info for _, info in page])
+                        if remaining == 0:
+                            return
+
+            return StreamingResponse(stream_keys(), media_type="application/x-ndjson")
+
+        page_size = int(limit) if limit is not None else _DEFAULT_PAGE_SIZE
+        # One more than asked for says whether there is a next page
+        page = await api_keys.page(int(cursor), page_size + 1, model, provider)
+        next_cursor = str(page[page_size - 1][0]) if len(page) > page_size else None
+        return MsgspecJSONResponse(ApiKeyPage(data=[info for _, info in page[:page_size]], next_cursor=next_cursor))
 
     async def create_api_key(request: Request) -> JSONResponse:
         """Create a new API key"""
-        body = await request.json()
+        key_req = await ApiKeyCreateReq.from_request(request)
         
-        # Validate required fields
-        if "allowed_providers" not in body or "allowed_models" not in body:
+        if key_req.weight <= 0:
             return JSONResponse(
-                {"error": "Missing required fields: allowed_providers and allowed_models"},
+                {"error": "weight must be a positive number"},
+                status_code=400
+            )
+        if not _valid_limit(key_req.requests_per_second) or not _valid_limit(key_req.tokens_per_minute):
+            return JSONResponse(
+                {"error": "Rate limits must be positive numbers or null"},
                 status_code=400
             )
         
-        db: anyio_sqlite.Connection = request.state.db  # pyright: ignore[reportMissingTypeArgument, reportAny]
+        db: Database = request.state.db  # pyright: ignore[reportAny]
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
         
         # Generate a proper API key
         new_key = f"sk-{secrets.token_urlsafe(32)}"
         key_hash = hashlib.sha256(new_key.encode()).hexdigest()
-        key_prefix = new_key[:8]
         
-        try:
-            await db.execute(
-                """INSERT INTO api_keys 
-                   (key_hash, key_prefix, full_key, allowed_providers, allowed_models) 
-                   VALUES (?, ?, ?, ?, ?)""",
-                (
-                    key_hash,
-                    key_prefix,
-                    new_key,
-                    json.dumps(body["allowed_providers"]),
-                    json.dumps(body["allowed_models"])
-                )
-            )
-            await db.commit()
-            
-            return JSONResponse(
-                {"key": new_key, "message": "API key created successfully"},
-                status_code=201
-            )
-        except anyio_sqlite.IntegrityError:
+        created = await api_keys.create(
+            new_key,
+            key_hash,
+            key_req.allowed_providers,
+            key_req.allowed_models,
+            weight=key_req.weight,
+            requests_per_second=key_req.requests_per_second,
+            tokens_per_minute=key_req.tokens_per_minute
+        )
+        if not created:
             return JSONResponse(
                 {"error": "Failed to create API key - duplicate hash"},
                 status_code=500
             )
 
+        # Drop any negative entry left by someone probing this key early
+        state_sync: StateSync = request.state.state_sync  # pyright: ignore[reportAny]
+        await state_sync.invalidate(db, key_hash)
+        
+        return JSONResponse(
+            {"key": new_key, "message": "API key created successfully"},
+            status_code=201
+        )
+
     async def delete_api_key(request: Request) -> JSONResponse:
         """Delete an API key"""
-        body = await request.json()
-        key_req = ApiKeyReq(**body)
+        key_req = await ApiKeyReq.from_request(request)
         
-        db: anyio_sqlite.Connection = request.state.db  # pyright: ignore[reportMissingTypeArgument, reportAny]
+        db: Database = request.state.db  # pyright: ignore[reportAny]
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
         
         # Hash the key for lookup
         key_hash = hashlib.sha256(key_req.key.encode()).hexdigest()
         
-        cursor = await db.execute(
-            "SELECT full_key FROM api_keys WHERE key_hash = ? AND is_active = 1",
-            (key_hash,)
+        deleted = await api_keys.deactivate(key_hash)
+        if deleted is None:
+            return JSONResponse(
+                {"error": "API key not found"},
+                status_code=404
+            )
+
+        # Revoke immediately rather than waiting for the cache TTL, in every worker
+        state_sync: StateSync = request.state.state_sync  # pyright: ignore[reportAny]
+        await state_sync.revoke(db, key_hash)
+        
+        return JSONResponse(
+            {"message": f"API key {deleted} deleted successfully"},
+            status_code=200
         )
-        row = await cursor.fetchone()
+
+    async def set_api_key_weight(request: Request) -> JSONResponse:
+        """Change the fair queuing weight of an API key"""
+        weight_req = await ApiKeyWeightReq.from_request(request)
+        if weight_req.weight <= 0:
+            return JSONResponse(
+                {"error": "weight must be a positive number"},
+                status_code=400
+            )
         
-        if not row:
+        db: Database = request.state.db  # pyright: ignore[reportAny]
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
+        key_hash = hashlib.sha256(weight_req.key.encode()).hexdigest()
+        
+        if not await api_keys.set_weight(key_hash, weight_req.weight):
             return JSONResponse(
                 {"error": "API key not found"},
                 status_code=404
             )
         
-        # Soft delete by setting is_active = 0
-        await db.execute(
-            "UPDATE api_keys SET is_active = 0 WHERE key_hash = ?",
-            (key_hash,)
+        state_sync: StateSync = request.state.state_sync  # pyright: ignore[reportAny]
+        await state_sync.invalidate(db, key_hash)
+        
+        return JSONResponse(
+            {"message": "API key weight updated successfully"},
+            status_code=200
         )
-        await db.commit()
+
+    async def set_api_key_rate_limits(request: Request) -> JSONResponse:
+        """Change the rate limits of an API key"""
+        limits_req = await ApiKeyRateLimitReq.from_request(request)
+        if not _valid_limit(limits_req.requests_per_second) or not _valid_limit(limits_req.tokens_per_minute):
+            return JSONResponse(
+                {"error": "Rate limits must be positive numbers or null"},
+                status_code=400
+            )
+        
+        db: Database = request.state.db  # pyright: ignore[reportAny]
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
+        key_hash = hashlib.sha256(limits_req.key.encode()).hexdigest()
+        
+        if not await api_keys.set_rate_limits(key_hash, limits_req.requests_per_second, limits_req.tokens_per_minute):
+            return JSONResponse(
+                {"error": "API key not found"},
+                status_code=404
+            )
+        
+        state_sync: StateSync = request.state.state_sync  # pyright: ignore[reportAny]
+        await state_sync.invalidate(db, key_hash)
         
         return JSONResponse(
-            {"message": f"API key {row[0]} deleted successfully"},
+            {"message": "API key rate limits updated successfully"},
             status_code=200
         )
 
+    async def rate_limit_usage(request: Request) -> MsgspecJSONResponse:
+        """Get the current rate limit consumption of rate limited keys, or of the one given as `key`"""
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
+        rate_limiter: RateLimiter = request.state.rate_limiter  # pyright: ignore[reportAny]
+        
+        key = request.query_params.get("key")
+        rate_limited = await api_keys.rate_limited(hashlib.sha256(key.encode()).hexdigest() if key else None)
+        
+        usage = {}
+        for key_prefix, permissions in rate_limited:
+            usage[key_prefix + "..."] = rate_limiter.usage(permissions)
+        
+        return MsgspecJSONResponse(usage)
+
+    async def usage_report(request: Request) -> JSONResponse:
+        """
+        Get usage totals from the hourly rollups, optionally filtered by `key`,
+        `model`, `provider` and a `since`/`until` unix time range (rounded down
+        to the hour), grouped by a comma separated `group_by` of hour, key,
+        model and provider
+        """
+        db: Database = request.state.db  # pyright: ignore[reportAny]
+        api_keys: ApiKeyRepository = request.state.api_keys  # pyright: ignore[reportAny]
+
+        group_by = [group for group in request.query_params.get("group_by", "key,model").split(",") if group]
+        if not all(group in _USAGE_GROUPS for group in group_by) or len(set(group_by)) != len(group_by):
+            return JSONResponse(
+                {"error": f"'group_by' must be a list of {', '.join(_USAGE_GROUPS)}"},
+                status_code=400
+            )
+
+        conditions: list[str] = []
+        params: list[str | int] = []
+        key = request.query_params.get("key")
+        if key:
+            conditions.append("key_hash = ?")
+            params.append(hashlib.sha256(key.encode()).hexdigest())
+        for column in ("model", "provider"):
+            value = request.query_params.get(column)
+            if value:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        for bound, operator in (("since", ">="), ("until", "<")):
+            value = request.query_params.get(bound)
+            if value:
+                try:
+                    hour = int(float(value) // 3600 * 3600)
+                except ValueError:
+                    return JSONResponse(
+                        {"error": f"'{bound}' must be a unix time"},
+                        status_code=400
+                    )
+                conditions.append(f"hour {operator} ?")
+                params.append(hour)
+
+        group_columns = [_USAGE_GROUPS[group] for group in group_by]
+        query = f"""SELECT {"".join(column + ", " for column in group_columns)}
+                   SUM(requests), SUM(errors), SUM(prompt_tokens), SUM(completion_tokens), SUM(latency_ms)
+                   FROM usage_hourly
+                   {"WHERE " + " AND ".join(conditions) if conditions else ""}
+                   {"GROUP BY " + ", ".join(group_columns) if group_columns else ""}
+                   ORDER BY {", ".join(group_columns + ["1"])}"""
+
+        report = []
+        async with db.reader() as con:
+            async with await con.execute(query, params) as cur:
+                async for row in cur:
+                    requests, errors, prompt_tokens, completion_tokens, latency_ms = row[len(group_by):]
+                    report.append({
+                        **dict(zip(group_by, row)),
+                        "requests": requests,
+                        "errors": errors,
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "avg_latency_ms": latency_ms / requests if requests else None,
+                    })
+
+        if "key" in group_by:
+            # Grouped by hash, shown by prefix
+            prefixes = await api_keys.prefixes({entry["key"] for entry in report})
+            for entry in report:
+                prefix = prefixes.get(entry["key"])
+                entry["key"] = prefix + "..." if prefix is not None else None
+            report.sort(key=lambda entry: _sort_key(entry, group_by))
+
+        return JSONResponse({"usage": report, "log": msgspec.structs.asdict(request.state.usage_log.stats)})  # pyright: ignore[reportAny]
+
+    async def prometheus_metrics(request: Request) -> PlainTextResponse:
+        """Get the proxy's metrics in the Prometheus text format"""
+        metrics: Metrics = request.state.metrics  # pyright: ignore[reportAny]
+        state_sync: StateSync = request.state.state_sync  # pyright: ignore[reportAny]
+        db: Database = request.state.db  # pyright: ignore[reportAny]
+        # With several workers, whichever answers renders the samples of all
+        others = await state_sync.worker_metrics(db)
+        return PlainTextResponse(metrics.render(others), media_type="text/plain; version=0.0.4")
+
+    async def reload_config(request: Request) -> JSONResponse | MsgspecJSONResponse:
+        """Reload providers and models from the config file, on every worker"""
+        reloader: ConfigReloader | None = request.state.reloader  # pyright: ignore[reportAny]
+        if reloader is None:
+            return JSONResponse({"error": "The proxy was not started from a config file"}, status_code=409)
+        try:
+            summary = await reloader.reload()
+        except ConfigReloadError as e:
+            return JSONResponse({"error": e.message}, status_code=400)
+        state_sync: StateSync = request.state.state_sync  # pyright: ignore[reportAny]
+        db: Database = request.state.db  # pyright: ignore[reportAny]
+        # The others read the same file, and log what changed for them
+        await state_sync.reloaded(db)
+        return MsgspecJSONResponse(summary)
+
+    async def admission_stats(request: Request) -> MsgspecJSONResponse:
+        """Get admission queue counters of providers and models with concurrency limits"""
+        providers: ProviderRegistry = request.state.providers  # pyright: ignore[reportAny]
+        stats = {}
+        for name, provider in providers.providers.items():
+            queues = {}
+            if provider.admission is not None:
+                queues["provider"] = provider.admission.stats
+            if provider.model_admission:
+                queues["models"] = {model: queue.stats for model, queue in provider.model_admission.items()}
+            if queues:
+                stats[name] = queues
+        return MsgspecJSONResponse(stats)
+
+    async def cache_stats(request: Request) -> MsgspecJSONResponse:
+        """Get response cache hit/miss counters and size"""
+        response_cache: ResponseCache = request.state.response_cache  # pyright: ignore[reportAny]
+        return MsgspecJSONResponse(response_cache.stats)
+
+    async def coalescing_stats(request: Request) -> MsgspecJSONResponse:
+        """Get counters of generations shared between identical in-flight requests"""
+        coalescer: Coalescer | None = request.state.coalescer  # pyright: ignore[reportAny]
+        return MsgspecJSONResponse(coalescer.stats if coalescer is not None else CoalescingStats())
+
+    async def affinity_stats(request: Request) -> MsgspecJSONResponse:
+        """Get prefix affinity routing counters for providers balancing on it"""
+        providers: ProviderRegistry = request.state.providers  # pyright: ignore[reportAny]
+        stats = {}
+        for name, provider in providers.providers.items():
+            affinity = provider.balancer.affinity
+            if affinity is None:
+                continue
+            counters = affinity.stats
+            routed = counters.hits + counters.load_spills + counters.health_spills
+            stats[name] = {
+                **msgspec.structs.asdict(counters),
+                "hit_rate": counters.hits / routed if routed else None,
+            }
+        return MsgspecJSONResponse(stats)
+
     return [
         Route("/admin", admin_dashboard, methods=["GET"]),
+        Route("/admin/cache", cache_stats, methods=["GET"]),
+        Route("/admin/affinity", affinity_stats, methods=["GET"]),
+        Route("/admin/coalescing", coalescing_stats, methods=["GET"]),
+        Route("/admin/admission", admission_stats, methods=["GET"]),
         Route("/admin/api_keys", get_api_key, methods=["GET"]),
         Route("/admin/api_keys/list", list_api_keys, methods=["GET"]),
         Route("/admin/api_keys", create_api_key, methods=["POST"]),
         Route("/admin/api_keys", delete_api_key, methods=["DELETE"]),
+        Route("/admin/api_keys/weight", set_api_key_weight, methods=["PUT"]),
+        Route("/admin/api_keys/rate_limits", set_api_key_rate_limits, methods=["PUT"]),
+        Route("/admin/rate_limits", rate_limit_usage, methods=["GET"]),
+        Route("/admin/usage", usage_report, methods=["GET"]),
+        Route("/admin/metrics", prometheus_metrics, methods=["GET"]),
+        Route("/admin/reload", reload_config, methods=["POST"]),
     ]
@@ -1,25 +1,47 @@
 from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
 from starlette.routing import Route
 
 from slut_proxy.models.slut import ModelMetadata
 from slut_proxy.models.config import Config
-from slut_proxy.utils.responses import MsgspecJSONResponse
+from slut_proxy.providers.registry import ProviderRegistry
+from slut_proxy.utils.responses import PreEncodedJSON
+
+class _ModelListings:
+    """The model list and each model's metadata, encoded once per config"""
+
+    def __init__(self, config: Config):
+        self.config = config
+        metadatas = [ModelMetadata.from_model_config(model, config.get_provider(model.provider)) for model in config.models]
+        self.model_list = PreEncodedJSON(metadatas)
+        self.model_metadata: dict[str, PreEncodedJSON] = {}
+        for metadata in metadatas:
+            if metadata.name not in self.model_metadata:
+                self.model_metadata[metadata.name] = PreEncodedJSON(metadata)
 
 def build_routes(config: Config) -> list[Route]:
-    def list_models(_request: Request) -> MsgspecJSONResponse:
-        metadatas = []
-        for model in config.models:
-            metadatas.append(ModelMetadata.from_model_config(model, config.get_provider(model.provider)) )  # pyright: ignore[reportUnknownMemberType]
-        return MsgspecJSONResponse(metadatas)
+    listings = _ModelListings(config)
+
+    def current_listings(request: Request) -> _ModelListings:
+        # A reload swaps in a new config, and with it new listings
+        nonlocal listings
+        providers: ProviderRegistry = request.state.providers  # pyright: ignore[reportAny]
+        if listings.config is not providers.current.config:
+            listings = _ModelListings(providers.current.config)
+        return listings
+
+    def list_models(request: Request) -> Response:
+        return current_listings(request).model_list.response(request)
     
-    def get_model(request: Request) -> MsgspecJSONResponse:
+    def get_model(request: Request) -> Response:
         model_name: str = request.path_params["model"]
-        model_config = config.get_model(model_name)
-        provider_config = config.get_provider(model_config.provider)
-        return MsgspecJSONResponse(ModelMetadata.from_model_config(model_config, provider_config))
+        metadata = current_listings(request).model_metadata.get(model_name)
+        if metadata is None:
+            return JSONResponse({"error": f"Model {model_name} does not exist"}, status_code=404)
+        return metadata.response(request)
 
 
     return [
         Route("/models", list_models),
         Route("/models/{model}", get_model)
-    ]
\ No newline at end of file
+    ]
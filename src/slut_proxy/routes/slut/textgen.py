@@ -1,11 +1,13 @@
-import json
 from starlette.requests import Request
 from starlette.responses import JSONResponse, StreamingResponse
 from starlette.routing import Route
 
 from slut_proxy.models.slut import TextGenerationRequest
 from slut_proxy.models.config import Config
-from slut_proxy.providers.factory import create_provider
+from slut_proxy.providers.registry import ProviderRegistry
+from slut_proxy.utils.metrics import Metrics
+from slut_proxy.utils.requests import RequestError
+from slut_proxy.utils.timing import current_timing, mark
 
 def build_routes(config: Config) -> list[Route]:
     async def generate(request: Request) -> JSONResponse | StreamingResponse:
@@ -13,12 +15,19 @@ def build_routes(config: Config) -> list[Route]:
         accept_header = request.headers.get("accept", "application/json")
         
         # Parse request body
-        body = await request.json()
-        gen_request = TextGenerationRequest(**body)
+        gen_request = await TextGenerationRequest.from_request(request, config.proxy.max_request_body_size)
+        mark("parse")
         
-        # Get model and provider config
-        model_config = config.get_model(gen_request.model)
-        provider_config = config.get_provider(model_config.provider)
+        # Get model and provider config, from the snapshot current as the
+        # request arrived even if a reload happens while it's served
+        providers: ProviderRegistry = request.state.providers  # pyright: ignore[reportAny]
+        snapshot = providers.current
+        try:
+            model_config = snapshot.config.get_model(gen_request.model)
+        except KeyError:
+            raise RequestError(f"Model {gen_request.model} does not exist", status_code=404, param="model")
+        metrics: Metrics = request.state.metrics  # pyright: ignore[reportAny]
+        metrics.requests.labels("/v2/generate", model_config.name).inc()
         
         # Check API key permissions
         api_permissions = getattr(request.state, 'api_key_permissions', None)
@@ -32,8 +41,8 @@ def build_routes(config: Config) -> list[Route]:
         # - If model is allowed but provider is not -> allow (200)
         # - If model isn't explicitly allowed but provider is -> allow (200) 
         # - If neither are allowed -> unauthorized (403)
-        model_allowed = gen_request.model in api_permissions["allowed_models"]
-        provider_allowed = model_config.provider in api_permissions["allowed_providers"]
+        model_allowed = gen_request.model in api_permissions.allowed_models
+        provider_allowed = model_config.provider in api_permissions.allowed_providers
         
         if not model_allowed and not provider_allowed:
             return JSONResponse(
@@ -41,10 +50,15 @@ def build_routes(config: Config) -> list[Route]:
                 status_code=403
             )
         
-        # Create provider instance and generate response
-        async with create_provider(provider_config) as provider:
-            stream = "text/event-stream" in accept_header
-            return await provider.generate(model_config, gen_request, stream=stream)
+        timing = current_timing()
+        if timing is not None:
+            timing.model = model_config.name
+            timing.mark("route")
+
+        # Generate with the long-lived provider from the registry
+        provider = snapshot.get(model_config.provider)
+        stream = "text/event-stream" in accept_header
+        return await provider.generate(model_config, gen_request, stream=stream, permissions=api_permissions)
 
     
     return [
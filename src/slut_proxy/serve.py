@@ -0,0 +1,180 @@
+"""
+Command line entry point: serves the proxy from one process, or from several
+worker processes sharing the listening address through SO_REUSEPORT so the
+kernel spreads connections over them.
+"""
+import argparse
+import multiprocessing
+import multiprocessing.connection
+import os
+import signal
+import socket
+import time
+
+import msgspec
+import trio
+from hypercorn.config import Config as HyperConfig
+from hypercorn.trio import serve # pyright: ignore[reportUnknownVariableType]
+
+from .models.config import Config
+from .storage import Database
+
+# Forking would copy whatever the parent had going, workers start clean
+_mp = multiprocessing.get_context("spawn")
+
+# A worker exiting sooner than this after starting won't do better restarted
+_MIN_WORKER_UPTIME = 5.0 # seconds
+
+
+class ServeOptions(msgspec.Struct):
+    binds: list[str]
+    workers: int
+    config_path: str
+    # Seconds open requests and streams get to finish on shutdown
+    graceful_timeout: float
+
+
+def _listen_socket(bind: str) -> int:
+    """The descriptor of a socket bound to `host:port` that other workers can bind too"""
+    host, _, port = bind.rpartition(":")
+    host = host.strip("[]")
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    sock.bind((host, int(port)))
+    # Hypercorn takes it over from here
+    return sock.detach()
+
+
+async def _serve_worker(options: ServeOptions, slut_config: Config):
+    from .app import build_app
+
+    hyper = HyperConfig()
+    hyper.graceful_timeout = options.graceful_timeout
+    if options.workers > 1:
+        # Bound here rather than inherited, so each worker has its own accept queue
+        hyper.bind = [f"fd://{_listen_socket(bind)}" for bind in options.binds]
+    else:
+        hyper.bind = options.binds
+
+    app = build_app(slut_config, options.config_path, shared_state=options.workers > 1)
+
+    # SIGTERM and SIGINT stop accepting and give open requests time to finish.
+    # Both are handled until the end, a Ctrl-C reaches workers directly and
+    # through the supervisor
+    shutdown = trio.Event()
+    with trio.open_signal_receiver(signal.SIGTERM, signal.SIGINT) as signals:
+        async def watch_signals():
+            async for signum in signals:
+                if not shutdown.is_set():
+                    print(f"Worker {os.getpid()} got {signal.Signals(signum).name}, finishing open requests")
+                    shutdown.set()
+
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(watch_signals)
+            await serve(app, hyper, shutdown_trigger=shutdown.wait)  # pyright: ignore[reportArgumentType]
+            nursery.cancel_scope.cancel()
+
+
+def _worker_main(options: ServeOptions, slut_config: Config):
+    # The file may have been reloaded since the supervisor read it
+    try:
+        slut_config = Config.from_toml(options.config_path)
+    except (OSError, msgspec.MsgspecError, ValueError) as e:
+        print(f"Failed to load {options.config_path}, starting with the config the proxy started with: {e}")
+    trio.run(_serve_worker, options, slut_config)
+
+
+async def _migrate():
+    # Opening the database migrates it
+    async with Database("slut_proxy.db", readers=0):
+        pass
+
+
+def _supervise(options: ServeOptions, slut_config: Config):
+    """
+    Runs the workers until SIGTERM or SIGINT, which is passed on to them;
+    SIGHUP is passed on too, to reload the config. Workers that die are
+    replaced, unless they die right away.
+    """
+    # Once here, rather than all workers racing to
+    trio.run(_migrate)
+
+    stopping = False
+    workers: list[tuple[multiprocessing.Process, float]] = []
+
+    def start_worker() -> tuple[multiprocessing.Process, float]:
+        process = _mp.Process(target=_worker_main, args=(options, slut_config), daemon=True)
+        process.start()
+        return process, time.monotonic()
+
+    def forward(signum: int, _frame: object):
+        for process, _ in workers:
+            if process.pid is not None and process.is_alive():
+                os.kill(process.pid, signum)
+
+    def stop(signum: int, frame: object):
+        nonlocal stopping
+        stopping = True
+        forward(signal.SIGTERM, frame)
+
+    _ = signal.signal(signal.SIGTERM, stop)
+    _ = signal.signal(signal.SIGINT, stop)
+    if hasattr(signal, "SIGHUP"):
+        _ = signal.signal(signal.SIGHUP, forward)
+
+    workers.extend(start_worker() for _ in range(options.workers))
+    print(f"Started {options.workers} workers on {', '.join(options.binds)}")
+    exit_code = 0
+    while not stopping:
+        _ = multiprocessing.connection.wait([process.sentinel for process, _ in workers], timeout=1.0)
+        for index, (process, started) in enumerate(workers):
+            if stopping or process.is_alive():
+                continue
+            if time.monotonic() - started < _MIN_WORKER_UPTIME:
+                print(f"Worker {process.pid} exited with {process.exitcode} right after starting, stopping")
+                exit_code = 1
+                stop(signal.SIGTERM, None)
+                break
+            print(f"Worker {process.pid} exited with {process.exitcode}, replacing it")
+            workers[index] = start_worker()
+
+    # Workers stop on their own once their requests are done or out of time
+    deadline = time.monotonic() + options.graceful_timeout + 10
+    for process, _ in workers:
+        process.join(max(0.0, deadline - time.monotonic()))
+        if process.is_alive():
+            print(f"Worker {process.pid} did not stop in time, killing it")
+            process.kill()
+    raise SystemExit(exit_code)
+
+
+def cli(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(prog="slut-proxy", description=__doc__)
+    _ = parser.add_argument("-b", "--bind", action="append", help="host:port to listen on, repeatable (default localhost:8080)")
+    _ = parser.add_argument("-w", "--workers", type=int, default=1, help="worker processes (default 1)")
+    _ = parser.add_argument("-c", "--config", default="config.toml", help="config file (default config.toml)")
+    _ = parser.add_argument("--graceful-timeout", type=float, default=30.0, help="seconds open requests get to finish on shutdown (default 30)")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+        parser.error("several workers need SO_REUSEPORT, which this platform lacks")
+
+    options = ServeOptions(
+        binds=args.bind or ["localhost:8080"],
+        workers=args.workers,
+        config_path=args.config,
+        graceful_timeout=args.graceful_timeout,
+    )
+    if options.workers > 1 and any(bind.startswith(("unix:", "fd://")) for bind in options.binds):
+        parser.error("several workers need host:port binds")
+
+    # Loaded up front so a broken config fails here rather than in every worker
+    slut_config = Config.from_toml(options.config_path)
+    if options.workers == 1:
+        trio.run(_serve_worker, options, slut_config)
+    else:
+        _supervise(options, slut_config)
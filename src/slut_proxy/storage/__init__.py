@@ -0,0 +1,4 @@
+from .api_keys import ApiKeyRepository
+from .database import Database
+
+__all__ = ["ApiKeyRepository", "Database"]
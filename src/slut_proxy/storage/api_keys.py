@@ -0,0 +1,191 @@
+from collections.abc import AsyncIterator, Collection
+import json
+
+import anyio_sqlite
+
+from ..middleware.key_cache import ApiKeyPermissions
+from ..models.slut import ApiKeyInfo
+from .database import Database
+
+# Kept well under SQLite's limit on bound parameters
+_IN_CHUNK = 500
+
+
+def _permissions(key_hash: str, row: tuple) -> ApiKeyPermissions:  # pyright: ignore[reportMissingTypeArgument]
+    # From allowed_providers, allowed_models, weight, requests_per_second, tokens_per_minute
+    return ApiKeyPermissions(
+        allowed_providers=frozenset(json.loads(row[0])),
+        allowed_models=frozenset(json.loads(row[1])),
+        key_hash=key_hash,
+        weight=row[2],
+        requests_per_second=row[3],
+        tokens_per_minute=row[4]
+    )
+
+
+def _info(row: tuple) -> ApiKeyInfo:  # pyright: ignore[reportMissingTypeArgument]
+    # From full_key, key_prefix, allowed_providers, allowed_models, weight
+    return ApiKeyInfo(
+        key=row[0] if row[0] else row[1] + "...",  # Use full key if available, otherwise prefix
+        allowed_providers=json.loads(row[2]),
+        allowed_models=json.loads(row[3]),
+        weight=row[4]
+    )
+
+
+class ApiKeyRepository:
+    """
+    The `api_keys` table. Keys are looked up by the SHA-256 hex digest of
+    the key; deleted keys stay in the table, inactive.
+    """
+
+    def __init__(self, db: Database):
+        self.db = db
+
+    async def permissions(self, key_hash: str) -> ApiKeyPermissions | None:
+        """Permissions of an active key"""
+        async with self.db.reader() as con:
+            async with await con.execute(
+                "SELECT allowed_providers, allowed_models, weight, requests_per_second, tokens_per_minute FROM api_keys WHERE key_hash = ? AND is_active = 1",
+                (key_hash,)
+            ) as cur:
+                row = await cur.fetchone()
+        return _permissions(key_hash, row) if row else None
+
+    async def get(self, key_hash: str) -> ApiKeyInfo | None:
+        async with self.db.reader() as con:
+            async with await con.execute(
+                "SELECT full_key, key_prefix, allowed_providers, allowed_models, weight FROM api_keys WHERE key_hash = ? AND is_active = 1",
+                (key_hash,)
+            ) as cur:
+                row = await cur.fetchone()
+        return _info(row) if row else None
+
+    async def page(self, after: int = 0, limit: int = 100, model: str | None = None, provider: str | None = None) -> list[tuple[int, ApiKeyInfo]]:
+        """
+        Active keys by id, the first `limit` past `after`, along with their
+        ids. `model` and `provider` only keep keys listing them as allowed.
+        """
+        query = "SELECT id, full_key, key_prefix, allowed_providers, allowed_models, weight FROM api_keys WHERE is_active = 1 AND id > ?"
+        params: list[str | int] = [after]
+        if model is not None:
+            query += " AND EXISTS (SELECT 1 FROM json_each(allowed_models) WHERE value = ?)"
+            params.append(model)
+        if provider is not None:
+            query += " AND EXISTS (SELECT 1 FROM json_each(allowed_providers) WHERE value = ?)"
+            params.append(provider)
+        query += " ORDER BY id LIMIT ?"
+        params.append(limit)
+
+        async with self.db.reader() as con:
+            async with await con.execute(query, params) as cur:
+                return [(row[0], _info(row[1:])) async for row in cur]
+
+    async def walk(self, after: int = 0, model: str | None = None, provider: str | None = None, page_size: int = 500) -> AsyncIterator[list[tuple[int, ApiKeyInfo]]]:
+        """
+        Every matching active key past `after`, a page at a time. No read is
+        held open between pages, so a slow consumer doesn't tie up a reader.
+        """
+        while True:
+            page = await self.page(after, page_size, model, provider)
+            if page:
+                yield page
+            if len(page) < page_size:
+                return
+            after = page[-1][0]
+
+    async def rate_limited(self, key_hash: str | None = None) -> list[tuple[str, ApiKeyPermissions]]:
+        """Prefixes and permissions of active keys with a rate limit, or only of `key_hash`"""
+        query = """SELECT key_hash, key_prefix, allowed_providers, allowed_models, weight, requests_per_second, tokens_per_minute FROM api_keys
+                   WHERE is_active = 1 AND (requests_per_second IS NOT NULL OR tokens_per_minute IS NOT NULL)"""
+        params: tuple[str, ...] = ()
+        if key_hash is not None:
+            query += " AND key_hash = ?"
+            params = (key_hash,)
+
+        async with self.db.reader() as con:
+            async with await con.execute(query, params) as cur:
+                return [(row[1], _permissions(row[0], row[2:])) async for row in cur]
+
+    async def prefixes(self, key_hashes: Collection[str]) -> dict[str, str]:
+        """Prefixes of the given keys, deleted ones included"""
+        key_hashes = list(key_hashes)
+        prefixes: dict[str, str] = {}
+        async with self.db.reader() as con:
+            for start in range(0, len(key_hashes), _IN_CHUNK):
+                chunk = key_hashes[start:start + _IN_CHUNK]
+                async with await con.execute(
+                    f"SELECT key_hash, key_prefix FROM api_keys WHERE key_hash IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ) as cur:
+                    async for row in cur:
+                        prefixes[row[0]] = row[1]
+        return prefixes
+
+    async def create(
+        self,
+        key: str,
+        key_hash: str,
+        allowed_providers: list[str],
+        allowed_models: list[str],
+        weight: float = 1.0,
+        requests_per_second: float | None = None,
+        tokens_per_minute: int | None = None,
+    ) -> bool:
+        """Stores a new key, `False` if its hash is already taken"""
+        async def insert(con: anyio_sqlite.Connection):  # pyright: ignore[reportMissingTypeArgument]
+            _ = await con.execute(
+                """INSERT INTO api_keys
+                   (key_hash, key_prefix, full_key, allowed_providers, allowed_models, weight, requests_per_second, tokens_per_minute)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                (
+                    key_hash,
+                    key[:8],
+                    key,
+                    json.dumps(allowed_providers),
+                    json.dumps(allowed_models),
+                    weight,
+                    requests_per_second,
+                    tokens_per_minute
+                )
+            )
+
+        try:
+            await self.db.write(insert)
+        except anyio_sqlite.IntegrityError:
+            return False
+        return True
+
+    async def deactivate(self, key_hash: str) -> str | None:
+        """Deactivates an active key, returning it as stored (`None` if there is none)"""
+        async def deactivate(con: anyio_sqlite.Connection) -> str | None:  # pyright: ignore[reportMissingTypeArgument]
+            async with await con.execute(
+                "SELECT full_key FROM api_keys WHERE key_hash = ? AND is_active = 1",
+                (key_hash,)
+            ) as cur:
+                row = await cur.fetchone()
+            if not row:
+                return None
+            # Soft delete by setting is_active = 0
+            _ = await con.execute("UPDATE api_keys SET is_active = 0 WHERE key_hash = ?", (key_hash,))
+            return row[0]
+
+        return await self.db.write(deactivate)
+
+    async def _update(self, query: str, params: tuple[object, ...]) -> bool:
+        async def update(con: anyio_sqlite.Connection) -> bool:  # pyright: ignore[reportMissingTypeArgument]
+            cursor = await con.execute(query, params)
+            return cursor.rowcount > 0
+
+        return await self.db.write(update)
+
+    async def set_weight(self, key_hash: str, weight: float) -> bool:
+        """`False` if there is no such active key"""
+        return await self._update("UPDATE api_keys SET weight = ? WHERE key_hash = ? AND is_active = 1", (weight, key_hash))
+
+    async def set_rate_limits(self, key_hash: str, requests_per_second: float | None, tokens_per_minute: int | None) -> bool:
+        """`False` if there is no such active key"""
+        return await self._update(
+            "UPDATE api_keys SET requests_per_second = ?, tokens_per_minute = ? WHERE key_hash = ? AND is_active = 1",
+            (requests_per_second, tokens_per_minute, key_hash)
+        )
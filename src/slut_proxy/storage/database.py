@@ -0,0 +1,194 @@
+from collections.abc import Awaitable, Callable
+import contextlib
+from typing import Generic, TypeVar
+
+import anyio_sqlite
+import trio
+
+from ..migrations import do_migration
+
+T = TypeVar("T")
+
+# Seconds a connection waits on another process holding the write lock
+_BUSY_TIMEOUT = 5.0
+# Writes queued behind a transaction share the next one, up to this many
+_MAX_BATCH = 256
+
+# Applied to every connection. WAL lets readers go on while a write is in
+# progress, and with it NORMAL only syncs at checkpoints, which can lose the
+# last transactions on power loss but never corrupts
+_PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",  # KiB
+)
+
+
+class _WriteJob(Generic[T]):
+    __slots__ = ("fn", "done", "result", "error")
+
+    def __init__(self, fn: Callable[[anyio_sqlite.Connection], Awaitable[T]]):  # pyright: ignore[reportMissingTypeArgument]
+        self.fn = fn
+        self.done = trio.Event()
+        self.result: T | None = None
+        self.error: BaseException | None = None
+
+    def fail(self, error: BaseException):
+        self.error = error
+        self.done.set()
+
+
+class _Reader:
+    """Lends a pooled connection for an `async with`, returning it after"""
+
+    __slots__ = ("_db", "_con")
+
+    def __init__(self, db: "Database"):
+        self._db = db
+
+    async def __aenter__(self) -> anyio_sqlite.Connection:  # pyright: ignore[reportMissingTypeArgument]
+        # A free connection is taken without a trip through the scheduler,
+        # the query run on it checkpoints anyway
+        try:
+            self._con = self._db._idle_receive.receive_nowait()  # pyright: ignore[reportPrivateUsage]
+        except trio.WouldBlock:
+            self._con = await self._db._idle_receive.receive()  # pyright: ignore[reportPrivateUsage]
+        return self._con
+
+    async def __aexit__(self, *exc_info: object):
+        self._db._idle_send.send_nowait(self._con)  # pyright: ignore[reportPrivateUsage]
+
+
+class Database:
+    """
+    The proxy's SQLite database, in WAL mode.
+
+    Reads go through a small pool of read-only connections, so lookups run
+    in parallel and never queue behind a write. Writes are functions run by
+    one writer task on its own connection: whatever queues up while a
+    transaction is being written goes into the next one, each write in a
+    savepoint so a failing one doesn't take the others with it.
+    """
+
+    def __init__(self, path: str, readers: int = 4):
+        """`readers` of 0 opens the database for writes only, and migrations"""
+        self.path = path
+        self.readers = readers
+        self._stack = contextlib.AsyncExitStack()
+        self._writer: anyio_sqlite.Connection | None = None  # pyright: ignore[reportMissingTypeArgument]
+        self._idle_send, self._idle_receive = trio.open_memory_channel[anyio_sqlite.Connection](max(1, readers))  # pyright: ignore[reportMissingTypeArgument]
+        self._jobs_send, self._jobs_receive = trio.open_memory_channel[_WriteJob[object]](_MAX_BATCH * 4)
+
+    async def _connect(self, *pragmas: str) -> anyio_sqlite.Connection:  # pyright: ignore[reportMissingTypeArgument]
+        con = await self._stack.enter_async_context(anyio_sqlite.connect(self.path, timeout=_BUSY_TIMEOUT, isolation_level=None))
+        for pragma in _PRAGMAS + pragmas:
+            async with await con.execute(pragma):
+                pass
+        return con
+
+    async def __aenter__(self):
+        await self._stack.__aenter__()
+        try:
+            self._writer = await self._connect()
+            await do_migration(self._writer)
+            for _ in range(self.readers):
+                self._idle_send.send_nowait(await self._connect("PRAGMA query_only = 1"))
+        except:
+            await self._stack.aclose()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info: object):
+        if self._writer is not None:
+            # Cheap, and keeps query plans good as tables grow
+            try:
+                _ = await self._writer.execute("PRAGMA optimize")
+            except anyio_sqlite.Error:
+                pass
+        await self._stack.aclose()
+
+    def reader(self) -> _Reader:
+        """A read-only connection from the pool for an `async with`, waiting for one to free up"""
+        return _Reader(self)
+
+    async def write(self, fn: Callable[[anyio_sqlite.Connection], Awaitable[T]]) -> T:  # pyright: ignore[reportMissingTypeArgument]
+        """
+        Runs `fn` with the writer's connection inside a transaction, returning
+        once it is committed. What `fn` raises is raised here, after its
+        changes are rolled back; it must not commit or roll back itself.
+        """
+        job = _WriteJob(fn)
+        try:
+            await self._jobs_send.send(job)  # pyright: ignore[reportArgumentType]
+        except (trio.ClosedResourceError, trio.BrokenResourceError):
+            raise anyio_sqlite.OperationalError("The database writer has stopped")
+        await job.done.wait()
+        if job.error is not None:
+            raise job.error
+        return job.result  # pyright: ignore[reportReturnType]
+
+    async def run(self, task_status: trio.TaskStatus[None] = trio.TASK_STATUS_IGNORED):
+        """The writer task, serving `write` until cancelled"""
+        assert self._writer is not None
+        task_status.started()
+        batch: list[_WriteJob[object]] = []
+        try:
+            while True:
+                batch.append(await self._jobs_receive.receive())
+                while len(batch) < _MAX_BATCH:
+                    try:
+                        batch.append(self._jobs_receive.receive_nowait())
+                    except trio.WouldBlock:
+                        break
+                await self._write_batch(self._writer, batch)
+                batch = []
+        finally:
+            # Writes still queued would wait forever otherwise
+            error = anyio_sqlite.OperationalError("The database writer has stopped")
+            for job in batch:
+                if not job.done.is_set():
+                    job.fail(error)
+            while True:
+                try:
+                    self._jobs_receive.receive_nowait().fail(error)
+                except trio.WouldBlock:
+                    break
+            self._jobs_receive.close()
+
+    async def _write_batch(self, con: anyio_sqlite.Connection, batch: list[_WriteJob[object]]):  # pyright: ignore[reportMissingTypeArgument]
+        try:
+            # Takes the write lock up front rather than failing halfway on a busy database
+            _ = await con.execute("BEGIN IMMEDIATE")
+        except anyio_sqlite.Error as e:
+            for job in batch:
+                job.fail(e)
+            return
+
+        try:
+            for job in batch:
+                _ = await con.execute("SAVEPOINT job")
+                try:
+                    job.result = await job.fn(con)
+                except Exception as e:
+                    job.error = e
+                    _ = await con.execute("ROLLBACK TO job")
+                _ = await con.execute("RELEASE job")
+            _ = await con.execute("COMMIT")
+        except BaseException as e:
+            with trio.CancelScope(shield=True):
+                try:
+                    _ = await con.execute("ROLLBACK")
+                except anyio_sqlite.Error:
+                    pass
+            # Nothing in the batch was written
+            error = e if isinstance(e, Exception) else anyio_sqlite.OperationalError("The write was cancelled")
+            for job in batch:
+                job.result = None
+                job.fail(error)
+            if not isinstance(e, Exception):
+                raise
+            return
+
+        for job in batch:
+            job.done.set()
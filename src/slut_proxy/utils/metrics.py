@@ -0,0 +1,232 @@
+import bisect
+import math
+from abc import ABC, abstractmethod
+from collections.abc import Iterable
+from typing import Generic, TypeVar
+
+C = TypeVar("C")
+
+# Seconds, from a cache hit to a long generation
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+# Seconds between streamed tokens
+INTER_TOKEN_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.02, 0.035, 0.05, 0.075, 0.1, 0.15, 0.25, 0.5, 1.0)
+# Seconds, from a key cache hit to a database lookup
+AUTH_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], *extra: str) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(pair for pair in extra if pair)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Family(ABC, Generic[C]):
+    """
+    A metric with one child per combination of label values. Children are
+    created on first use and kept, so hot paths can hold on to them.
+    """
+
+    type_name = ""
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = label_names
+        self.children: dict[tuple[str, ...], C] = {}
+
+    @abstractmethod
+    def _new_child(self) -> C:
+        pass
+
+    def labels(self, *values: str) -> C:
+        child = self.children.get(values)
+        if child is None:
+            child = self.children[values] = self._new_child()
+        return child
+
+    @abstractmethod
+    def render_samples(self, lines: list[str], const: str = ""):
+        """Appends the samples, each with the `const` label pair if given"""
+        pass
+
+    def render_header(self, lines: list[str]):
+        lines.append(f"# HELP {self.name} {self.help}")
+        lines.append(f"# TYPE {self.name} {self.type_name}")
+
+
+class CounterChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+
+class Counter(_Family[CounterChild]):
+    type_name = "counter"
+
+    def _new_child(self) -> CounterChild:
+        return CounterChild()
+
+    def render_samples(self, lines: list[str], const: str = ""):
+        for values, child in self.children.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, values, const)} {_format_value(child.value)}")
+
+
+class GaugeChild:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Gauge(_Family[GaugeChild]):
+    type_name = "gauge"
+
+    def _new_child(self) -> GaugeChild:
+        return GaugeChild()
+
+    def render_samples(self, lines: list[str], const: str = ""):
+        for values, child in self.children.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, values, const)} {_format_value(child.value)}")
+
+
+class HistogramChild:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple[float, ...]):
+        self.bounds = bounds
+        # One count per bucket plus the +Inf overflow, not cumulative
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        # Buckets are inclusive upper bounds
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+class Histogram(_Family[HistogramChild]):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, label_names: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> HistogramChild:
+        return HistogramChild(self.buckets)
+
+    def render_samples(self, lines: list[str], const: str = ""):
+        for values, child in self.children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                labels = _format_labels(self.label_names, values, const, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, values, const)
+            lines.append(f"{self.name}_sum{labels} {_format_value(child.sum)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+
+class Metrics:
+    """
+    The proxy's metrics, exposed in the Prometheus text format.
+
+    Updates are plain attribute arithmetic on preallocated children: the
+    proxy runs on a single trio thread, so nothing needs a lock. With several
+    worker processes each sample carries a `worker` label, and any worker
+    renders the others' samples (passed around by `StateSync`) with its own.
+    """
+
+    def __init__(self, worker: str | None = None):
+        self._const = f'worker="{_escape(worker)}"' if worker is not None else ""
+        self.requests = Counter(
+            "slut_requests_total", "Generation requests received", ("endpoint", "model")
+        )
+        self.generations = Counter(
+            "slut_generations_total", "Generations finished, by the status they ended with", ("model", "provider", "status")
+        )
+        self.upstream_responses = Counter(
+            "slut_upstream_responses_total", "Responses from upstream endpoints, by HTTP status or 'error' for transport failures", ("provider", "endpoint", "status")
+        )
+        self.hedges = Counter(
+            "slut_hedges_total", "Second attempts sent for slow non-streaming generations", ("model", "provider")
+        )
+        self.latency = Histogram(
+            "slut_request_duration_seconds", "Total time to generate a response", ("model", "provider")
+        )
+        self.time_to_first_token = Histogram(
+            "slut_time_to_first_token_seconds", "Time until the first streamed chunk", ("model", "provider")
+        )
+        self.inter_token_latency = Histogram(
+            "slut_inter_token_latency_seconds", "Time between streamed chunks", ("model", "provider"), INTER_TOKEN_BUCKETS
+        )
+        self.queue_wait = Histogram(
+            "slut_queue_wait_seconds", "Time spent waiting for an admission slot", ("model", "provider")
+        )
+        self.active_streams = Gauge(
+            "slut_active_streams", "Streams currently being relayed", ("model", "provider")
+        )
+        self.auth = Counter(
+            "slut_auth_requests_total", "Authentication outcomes of protected requests", ("result",)
+        )
+        self.auth_lookup = Histogram(
+            "slut_auth_lookup_seconds", "Time to validate an API key, cached or not", (), AUTH_BUCKETS
+        )
+        self.families: tuple[_Family, ...] = (  # pyright: ignore[reportMissingTypeArgument]
+            self.requests,
+            self.generations,
+            self.upstream_responses,
+            self.hedges,
+            self.latency,
+            self.time_to_first_token,
+            self.inter_token_latency,
+            self.queue_wait,
+            self.active_streams,
+            self.auth,
+            self.auth_lookup,
+        )
+
+    def samples(self) -> dict[str, list[str]]:
+        """This process's sample lines by metric name"""
+        samples: dict[str, list[str]] = {}
+        for family in self.families:
+            lines: list[str] = []
+            family.render_samples(lines, self._const)
+            samples[family.name] = lines
+        return samples
+
+    def render(self, others: Iterable[dict[str, list[str]]] = ()) -> str:
+        """The text format, with the `samples()` of other workers in `others`"""
+        others = list(others)
+        lines: list[str] = []
+        for family in self.families:
+            family.render_header(lines)
+            family.render_samples(lines, self._const)
+            for samples in others:
+                lines.extend(samples.get(family.name, ()))
+        lines.append("")
+        return "\n".join(lines)
@@ -0,0 +1,65 @@
+import re
+from typing import TypeVar
+import msgspec
+from starlette.requests import Request
+
+T = TypeVar("T")
+
+# Room for long prompts, without letting a client make the proxy buffer gigabytes
+DEFAULT_MAX_BODY_SIZE = 8 * 1024 * 1024
+
+# Where msgspec says a validation error is, as in "... - at `$.samplers.top_p`"
+_ERROR_PATH = re.compile(r" - at `\$\.?([^`]*)`$")
+_MISSING_FIELD = re.compile(r"^Object missing required field `([^`]*)`")
+
+_decoders: dict[type, msgspec.json.Decoder] = {}  # pyright: ignore[reportMissingTypeArgument]
+
+
+class RequestError(Exception):
+    """A request body that can't be served as sent, answered with a 4xx"""
+
+    def __init__(self, message: str, status_code: int = 400, param: str | None = None):
+        super().__init__(message)
+        self.message = message
+        self.status_code = status_code
+        # The offending field, dotted for nested ones
+        self.param = param
+
+
+async def read_body(request: Request, max_size: int = DEFAULT_MAX_BODY_SIZE) -> bytes:
+    """The raw request body, refused with a 413 past `max_size` bytes"""
+    content_length = request.headers.get("content-length")
+    if content_length is not None and content_length.isdigit() and int(content_length) > max_size:
+        raise RequestError(f"Request body is larger than {max_size} bytes", status_code=413)
+
+    # Chunked bodies don't announce their size, so count as they come
+    chunks: list[bytes] = []
+    size = 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_size:
+            raise RequestError(f"Request body is larger than {max_size} bytes", status_code=413)
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def decode_body(body: bytes, type: type[T]) -> T:
+    """Decodes and validates a JSON body straight into `type`, in one pass"""
+    decoder = _decoders.get(type)
+    if decoder is None:
+        decoder = _decoders[type] = msgspec.json.Decoder(type)
+
+    try:
+        return decoder.decode(body)
+    except msgspec.ValidationError as e:
+        message = str(e)
+        # A missing field is named relative to the object missing it
+        matches = (_ERROR_PATH.search(message), _MISSING_FIELD.search(message))
+        param = ".".join(match.group(1) for match in matches if match is not None and match.group(1))
+        raise RequestError(message, param=param or None)
+    except msgspec.DecodeError as e:
+        raise RequestError(f"Request body is not valid JSON: {e}")
+
+
+async def decode_request(request: Request, type: type[T], max_size: int = DEFAULT_MAX_BODY_SIZE) -> T:
+    return decode_body(await read_body(request, max_size), type)
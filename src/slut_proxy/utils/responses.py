@@ -1,7 +1,12 @@
+from collections.abc import AsyncIterator, Awaitable, Callable
+import hashlib
 from typing import Any
 from typing_extensions import override
 import msgspec
-from starlette.responses import JSONResponse
+import trio
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.types import Receive, Scope, Send
 
 class MsgspecJSONResponse(JSONResponse):
     _content: msgspec.Struct
@@ -21,3 +26,86 @@ class MsgspecJSONResponse(JSONResponse):
     @override
     def render(self, content: msgspec.Struct) -> bytes:
         return msgspec.json.encode(content)
+
+
+class ProducerStreamingResponse(StreamingResponse):
+    """
+    A streaming response fed by a producer task through a channel, so the
+    body can be assembled by concurrent tasks. The producer runs in a nursery
+    tied to the response and is cancelled if the client goes away.
+    """
+
+    def __init__(
+        self,
+        produce: Callable[[trio.MemorySendChannel[bytes]], Awaitable[None]],
+        status_code: int = 200,
+        headers: dict[str, str] | None = None,
+        media_type: str | None = None,
+    ) -> None:
+        self._produce = produce
+        self._send_channel, receive_channel = trio.open_memory_channel[bytes](0)
+        super().__init__(receive_channel, status_code, headers, media_type)
+
+    async def _run_producer(self):
+        async with self._send_channel:
+            await self._produce(self._send_channel)
+
+    @override
+    async def stream_response(self, send: Send) -> None:
+        async with trio.open_nursery() as nursery:
+            nursery.start_soon(self._run_producer)
+            await super().stream_response(send)
+
+
+class ClosingStreamingResponse(StreamingResponse):
+    """
+    A streaming response that calls `close` once the body is sent or the
+    client went away. A generator body that was never started doesn't get
+    to run its `finally`, so what it holds open is closed here instead.
+    """
+
+    def __init__(
+        self,
+        content: AsyncIterator[bytes],
+        close: Callable[[], Awaitable[object]],
+        status_code: int = 200,
+        headers: dict[str, str] | None = None,
+        media_type: str | None = None,
+    ) -> None:
+        self._close = close
+        super().__init__(content, status_code, headers, media_type)
+
+    @override
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            with trio.CancelScope(shield=True):
+                _ = await self._close()
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if if_none_match is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # If-None-Match compares weakly, W/ prefixes don't matter
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+class PreEncodedJSON:
+    """
+    A JSON body encoded once up front, for responses that only change with
+    the config. Served with a strong ETag so polling clients get a 304.
+    """
+
+    __slots__ = ("body", "etag")
+
+    def __init__(self, content: Any):
+        self.body = msgspec.json.encode(content)
+        self.etag = f'"{hashlib.blake2b(self.body, digest_size=16).hexdigest()}"'
+
+    def response(self, request: Request) -> Response:
+        if _etag_matches(request.headers.get("if-none-match"), self.etag):
+            return Response(status_code=304, headers={"ETag": self.etag})
+        return Response(self.body, media_type="application/json", headers={"ETag": self.etag})
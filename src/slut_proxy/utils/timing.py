@@ -0,0 +1,82 @@
+from collections.abc import Awaitable, Callable
+import contextvars
+import time
+from typing import Any
+
+
+class RequestTiming:
+    """
+    Phase durations of one request, in seconds from a monotonic clock.
+
+    Sequential phases are closed with `mark`, which measures from the end of
+    the previous one. Phases that are timed elsewhere (or that overlap, like
+    hedged upstream attempts) are recorded with `add`.
+    """
+
+    __slots__ = ("started", "phases", "model", "_last")
+
+    def __init__(self):
+        self.started = self._last = time.monotonic()
+        self.phases: list[tuple[str, float]] = []
+        self.model: str | None = None
+
+    def mark(self, name: str):
+        now = time.monotonic()
+        self.phases.append((name, now - self._last))
+        self._last = now
+
+    def add(self, name: str, duration: float):
+        self.phases.append((name, duration))
+
+    def total(self) -> float:
+        return time.monotonic() - self.started
+
+    def server_timing(self) -> str:
+        """The phases so far as a `Server-Timing` header value, in milliseconds"""
+        entries = [f"{name};dur={duration * 1000:.1f}" for name, duration in self.phases]
+        entries.append(f"total;dur={self.total() * 1000:.1f}")
+        return ", ".join(entries)
+
+
+_current: contextvars.ContextVar[RequestTiming | None] = contextvars.ContextVar("request_timing", default=None)
+
+
+def current_timing() -> RequestTiming | None:
+    """The timing of the request being handled, if any; tasks it spawns share it"""
+    return _current.get()
+
+
+def mark(name: str):
+    """Closes a phase of the current request, if it is being timed"""
+    timing = _current.get()
+    if timing is not None:
+        timing.mark(name)
+
+
+def add(name: str, duration: float):
+    """Records a separately timed phase of the current request, if it is being timed"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, duration)
+
+
+def start_timing() -> RequestTiming:
+    timing = RequestTiming()
+    _current.set(timing)
+    return timing
+
+
+def connect_tracer(timing: RequestTiming) -> Callable[[str, dict[str, Any]], Awaitable[None]]:
+    """An httpx `trace` extension recording time spent opening upstream connections"""
+    started = 0.0
+
+    async def trace(event_name: str, _info: dict[str, Any]):
+        nonlocal started
+        if event_name in ("connection.connect_tcp.started", "connection.start_tls.started"):
+            started = time.monotonic()
+        elif event_name == "connection.connect_tcp.complete":
+            timing.add("connect", time.monotonic() - started)
+        elif event_name == "connection.start_tls.complete":
+            timing.add("tls", time.monotonic() - started)
+
+    return trace
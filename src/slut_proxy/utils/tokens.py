@@ -0,0 +1,18 @@
+from ..models.slut import TextGenerationResponse, Usage
+
+
+def estimate_tokens(content: str | list[int]) -> int:
+    """
+    Rough token count, for upstreams that don't report usage.
+    Token id prompts are exact, text is counted in words.
+    """
+    if isinstance(content, list):
+        return len(content)
+    return len(content.split())
+
+
+def usage_of(prompt: str | list[int], response: TextGenerationResponse) -> Usage:
+    """Token counts of a generation, as reported by the upstream or else estimated"""
+    if response.usage is not None:
+        return response.usage
+    return Usage(prompt_tokens=estimate_tokens(prompt), completion_tokens=estimate_tokens(response.text))
@@ -0,0 +1,90 @@
+"""
+Circuit breaking around cancelled requests: a half-open endpoint whose
+trial request never finishes must still be picked afterwards, and only the
+trial itself may give up its slot.
+"""
+import httpx
+import trio
+
+from slut_proxy.models.config import AvailableProvider, HealthCheckConfig, ProviderConfig
+from slut_proxy.providers.health import CircuitState
+from slut_proxy.providers.openai import OpenAIProvider
+
+CONFIG = ProviderConfig(
+    name="test",
+    type=AvailableProvider.OPENAI_COMPATIBLE,
+    base_url="http://upstream.test/v1",
+    health=HealthCheckConfig(enabled=False, failure_threshold=1, open_duration=0.0),
+)
+
+
+async def _hang(_request: httpx.Request) -> httpx.Response:
+    await trio.sleep_forever()
+    raise AssertionError
+
+
+def _provider() -> OpenAIProvider:
+    provider = OpenAIProvider(CONFIG)
+    provider.client = httpx.AsyncClient(transport=httpx.MockTransport(_hang))
+    [endpoint] = provider.balancer.endpoints
+    endpoint.record_failure("test")
+    assert endpoint.circuit.state is CircuitState.OPEN
+    return provider
+
+
+def test_cancelled_post_trial_leaves_endpoint_pickable():
+    async def main():
+        provider = _provider()
+        with trio.move_on_after(0.01):
+            await provider._post("/completions", b"{}")  # pyright: ignore[reportPrivateUsage]
+        assert provider.balancer.endpoints[0].circuit.state is CircuitState.HALF_OPEN
+        assert provider.balancer.pick() is not None
+        await provider.aclose()
+
+    trio.run(main)
+
+
+def test_cancelled_stream_trial_leaves_endpoint_pickable():
+    async def main():
+        provider = _provider()
+        with trio.move_on_after(0.01):
+            async with provider._stream("/completions", b"{}"):  # pyright: ignore[reportPrivateUsage]
+                pass
+        assert provider.balancer.pick() is not None
+        await provider.aclose()
+
+    trio.run(main)
+
+
+def test_non_trial_request_keeps_trial_in_flight():
+    async def main():
+        provider = OpenAIProvider(CONFIG)
+        provider.client = httpx.AsyncClient(transport=httpx.MockTransport(_hang))
+        [endpoint] = provider.balancer.endpoints
+
+        async with trio.open_nursery() as nursery:
+            # Dispatched while the circuit is closed, so not a trial
+            early = trio.CancelScope()
+
+            async def post_early():
+                with early:
+                    await provider._post("/completions", b"{}")  # pyright: ignore[reportPrivateUsage]
+
+            nursery.start_soon(post_early)
+            await trio.sleep(0.01)
+
+            endpoint.record_failure("test")
+            nursery.start_soon(provider._post, "/completions", b"{}")  # pyright: ignore[reportPrivateUsage]
+            await trio.sleep(0.01)
+            assert endpoint.circuit.state is CircuitState.HALF_OPEN
+
+            early.cancel()
+            await trio.sleep(0.01)
+            # The trial is still out, nothing else may be sent
+            assert provider.balancer.pick() is None
+            nursery.cancel_scope.cancel()
+
+        assert provider.balancer.pick() is not None
+        await provider.aclose()
+
+    trio.run(main)
@@ -0,0 +1,73 @@
+"""
+Hedged requests: the primary attempt's latency is what the hedge delay
+learns from, and a hedge attempt is a single try.
+"""
+import httpx
+import trio
+
+from slut_proxy.models.config import AvailableProvider, HedgeConfig, HealthCheckConfig, ModelConfig, ProviderConfig, UpstreamEndpoint
+from slut_proxy.providers.openai import OpenAIProvider
+from slut_proxy.utils.metrics import Metrics
+
+MODEL = ModelConfig(
+    name="m1",
+    model_id="upstream-model",
+    provider="test",
+    hedge=HedgeConfig(delay=0.02, adaptive=False, max_ratio=1.0),
+)
+
+
+def _provider(endpoints: int, upstream: httpx.AsyncBaseTransport) -> OpenAIProvider:
+    provider = OpenAIProvider(ProviderConfig(
+        name="test",
+        type=AvailableProvider.OPENAI_COMPATIBLE,
+        endpoints=[UpstreamEndpoint(f"http://upstream{i}.test/v1") for i in range(endpoints)],
+        health=HealthCheckConfig(enabled=False),
+    ))
+    provider.client = httpx.AsyncClient(transport=upstream)
+    return provider
+
+
+def test_cancelled_primary_latency_is_observed():
+    async def main():
+        calls = 0
+
+        async def upstream(_request: httpx.Request) -> httpx.Response:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                await trio.sleep_forever()
+            return httpx.Response(200)
+
+        provider = _provider(2, httpx.MockTransport(upstream))
+        provider.metrics = Metrics()
+        response = await provider._post_hedged(MODEL, "/completions", b"{}")  # pyright: ignore[reportPrivateUsage]
+        assert response.status_code == 200
+        [latency] = provider._hedgers["m1"].latencies._samples  # pyright: ignore[reportPrivateUsage]
+        assert latency >= 0.02
+        assert provider.metrics.hedges.labels("m1", "test").value == 1
+        await provider.aclose()
+
+    trio.run(main)
+
+
+def test_hedge_attempt_does_not_retry():
+    async def main():
+        calls = 0
+
+        async def upstream(_request: httpx.Request) -> httpx.Response:
+            nonlocal calls
+            calls += 1
+            if calls == 1:
+                await trio.sleep(0.1)
+                return httpx.Response(200)
+            return httpx.Response(503)
+
+        provider = _provider(3, httpx.MockTransport(upstream))
+        response = await provider._post_hedged(MODEL, "/completions", b"{}")  # pyright: ignore[reportPrivateUsage]
+        assert response.status_code == 200
+        # The failed hedge didn't move on to the third endpoint
+        assert calls == 2
+        await provider.aclose()
+
+    trio.run(main)
@@ -0,0 +1,57 @@
+"""
+Config reloads: a config whose providers can't all be created is rejected
+as a whole, and the running one stays in place.
+"""
+from pathlib import Path
+
+import pytest
+import trio
+
+from slut_proxy.models.config import Config
+from slut_proxy.providers.registry import ProviderRegistry
+from slut_proxy.reload import ConfigReloader, ConfigReloadError
+
+CONFIG = """
+[proxy]
+admin_key = "test"
+
+[[providers]]
+name = "upstream"
+type = "openai"
+base_url = "http://upstream.test/v1"
+
+[[models]]
+name = "m1"
+model_id = "upstream-model"
+provider = "upstream"
+"""
+
+UNSUPPORTED_PROVIDER = CONFIG + """
+[[providers]]
+name = "claude"
+type = "anthropic"
+base_url = "http://claude.test"
+
+[[models]]
+name = "m2"
+model_id = "claude-model"
+provider = "claude"
+"""
+
+
+def test_unbuildable_provider_keeps_current_config(tmp_path: Path):
+    path = tmp_path / "config.toml"
+    _ = path.write_text(CONFIG)
+    registry = ProviderRegistry(Config.from_toml(str(path)))
+    current = registry.current
+    reloader = ConfigReloader(str(path), registry)
+
+    async def main():
+        _ = path.write_text(UNSUPPORTED_PROVIDER)
+        with pytest.raises(ConfigReloadError, match="claude"):
+            _ = await reloader.reload()
+        await registry.aclose()
+
+    trio.run(main)
+    assert registry.current is current
+    assert list(registry.providers) == ["upstream"]
@@ -0,0 +1,73 @@
+"""
+Streamed generations are counted out of the provider and their upstream
+stream closed however the client leaves, including before the body starts.
+"""
+from collections.abc import AsyncIterator
+
+import httpx
+import trio
+
+from slut_proxy.models.config import AvailableProvider, ModelConfig, ProviderConfig
+from slut_proxy.models.slut import TextGenerationRequest
+from slut_proxy.providers.openai import OpenAIProvider
+
+CONFIG = ProviderConfig(name="test", type=AvailableProvider.OPENAI_COMPATIBLE, base_url="http://upstream.test/v1")
+MODEL = ModelConfig(name="m1", model_id="upstream-model", provider="test")
+REQUEST = TextGenerationRequest(prompt="Once upon a time", model="m1")
+
+
+class _UpstreamStream(httpx.AsyncByteStream):
+    def __init__(self):
+        self.closed = False
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        for _ in range(3):
+            yield b'data: {"choices":[{"index":0,"text":" tok","finish_reason":null}]}\n\n'
+        yield b"data: [DONE]\n\n"
+
+    async def aclose(self):
+        self.closed = True
+
+
+def _provider() -> tuple[OpenAIProvider, list[_UpstreamStream]]:
+    streams: list[_UpstreamStream] = []
+
+    def upstream(_request: httpx.Request) -> httpx.Response:
+        streams.append(_UpstreamStream())
+        return httpx.Response(200, headers={"content-type": "text/event-stream"}, stream=streams[-1])
+
+    provider = OpenAIProvider(CONFIG)
+    provider.client = httpx.AsyncClient(transport=httpx.MockTransport(upstream))
+    return provider, streams
+
+
+def test_stream_closed_before_iterating():
+    async def main():
+        provider, streams = _provider()
+        events, _ = await provider.stream(MODEL, REQUEST)
+        assert provider.in_flight == 1
+        await events.aclose()
+        assert provider.in_flight == 0
+        assert streams[0].closed
+        await provider.aclose()
+
+    trio.run(main)
+
+
+def test_client_gone_before_body_starts():
+    async def main():
+        provider, streams = _provider()
+        response = await provider.generate(MODEL, REQUEST, stream=True)
+
+        async def receive():
+            return {"type": "http.disconnect"}
+
+        async def send(_message: object):
+            await trio.sleep_forever()
+
+        await response({"type": "http", "asgi": {"spec_version": "2.0"}}, receive, send)  # pyright: ignore[reportArgumentType]
+        assert provider.in_flight == 0
+        assert streams[0].closed
+        await provider.aclose()
+
+    trio.run(main)